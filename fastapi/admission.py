@@ -0,0 +1,191 @@
+"""
+Admission control in front of Medusa, keyed by buyer org (the
+`From/Credential/Identity` of the PunchOutSetupRequest).
+
+- Per-tenant token buckets: each buyer org may start PUNCHOUT_TENANT_RATE
+  setups per second, with bursts of up to PUNCHOUT_TENANT_BURST. The setup
+  route answers requests over the limit with a cXML 429 Status right away.
+- A global cap of MEDUSA_MAX_IN_FLIGHT concurrent Medusa calls. Calls over
+  the cap wait in a per-tenant queue and slots are handed out round-robin
+  between tenants, so one org's storm cannot starve the others. A call that
+  finds its tenant's queue full, or waits longer than MEDUSA_ADMISSION_TIMEOUT
+  (or the request's latency budget), raises `Overloaded` and the setup route
+  answers with a cXML 503 Status instead of piling up.
+
+Background work (catalog crawls, SKU index reloads) queues as SYSTEM_TENANT,
+so it gets its round-robin share of the slots without crowding out buyers.
+
+State is per worker process, like the caches: with N uvicorn workers the
+effective limits are N times the configured ones.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from metrics import MEDUSA_IN_FLIGHT, MEDUSA_QUEUE_WAIT_SECONDS
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+# Setups per second per buyer org; 0 disables the per-tenant limit
+PUNCHOUT_TENANT_RATE = float(os.getenv("PUNCHOUT_TENANT_RATE", "10"))
+PUNCHOUT_TENANT_BURST = float(os.getenv("PUNCHOUT_TENANT_BURST", "50"))
+# Buyer orgs whose buckets are kept (least recently seen are dropped first)
+PUNCHOUT_TENANT_MAX_TRACKED = int(os.getenv("PUNCHOUT_TENANT_MAX_TRACKED", "10000"))
+# Concurrent Medusa calls per worker; 0 disables the cap
+MEDUSA_MAX_IN_FLIGHT = int(os.getenv("MEDUSA_MAX_IN_FLIGHT", "50"))
+# Calls one buyer org may have waiting for a slot
+MEDUSA_ADMISSION_TENANT_QUEUE = int(os.getenv("MEDUSA_ADMISSION_TENANT_QUEUE", "20"))
+# Max seconds a call waits for a slot
+MEDUSA_ADMISSION_TIMEOUT = float(os.getenv("MEDUSA_ADMISSION_TIMEOUT", "2"))
+
+tenant_var: contextvars.ContextVar[str] = contextvars.ContextVar("tenant", default="")
+# Queue of the background crawls; only a scheduling label, never a credential
+SYSTEM_TENANT = "_system"
+
+
+class Overloaded(Exception):
+    """No Medusa slot could be obtained in time."""
+
+    reason = "overloaded"
+
+
+def bind_tenant(tenant: str) -> None:
+    """Tags the current request (and tasks it starts) with its buyer org."""
+    tenant_var.set(tenant)
+
+
+# ── Per-tenant rate limit ─────────────────────────────────────────────────────
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+
+def rate_limit(tenant: str) -> float:
+    """0 when the tenant may proceed, otherwise the Retry-After in seconds."""
+    if PUNCHOUT_TENANT_RATE <= 0:
+        return 0.0
+    bucket = _buckets.get(tenant)
+    if bucket is None:
+        bucket = _buckets[tenant] = TokenBucket(PUNCHOUT_TENANT_RATE, max(1.0, PUNCHOUT_TENANT_BURST))
+        if len(_buckets) > PUNCHOUT_TENANT_MAX_TRACKED:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(tenant)
+    return bucket.try_acquire()
+
+
+# ── Fair global concurrency cap ───────────────────────────────────────────────
+
+class FairScheduler:
+    """
+    Semaphore whose waiters are queued per tenant and woken round-robin
+    across tenants (FIFO within a tenant).
+    """
+
+    def __init__(self, limit: int, tenant_queue: int):
+        self.limit = limit
+        self.tenant_queue = tenant_queue
+        self.in_flight = 0
+        self.waiting = 0
+        # Tenants with waiters, in round-robin order
+        self._queues: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    async def acquire(self, tenant: str, timeout: float) -> None:
+        if self.in_flight < self.limit and not self.waiting:
+            self._take()
+            return
+        queue = self._queues.get(tenant)
+        if (queue is not None and len(queue) >= self.tenant_queue) or timeout <= 0:
+            raise Overloaded(f"No Medusa slot available for tenant {tenant!r}")
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # granted while we were giving up
+            else:
+                waiter.cancel()
+                self._discard(tenant, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded(f"Timed out waiting for a Medusa slot for tenant {tenant!r}") from None
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+        MEDUSA_IN_FLIGHT.set(value=self.in_flight)
+
+    def _take(self) -> None:
+        self.in_flight += 1
+        MEDUSA_IN_FLIGHT.set(value=self.in_flight)
+
+    def _wake(self) -> None:
+        while self.in_flight < self.limit and self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            if not waiter.done():
+                waiter.set_result(None)
+                self._take()
+
+    def _discard(self, tenant: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(tenant)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.waiting -= 1
+        if not queue:
+            del self._queues[tenant]
+
+
+_scheduler = FairScheduler(MEDUSA_MAX_IN_FLIGHT, MEDUSA_ADMISSION_TENANT_QUEUE)
+
+
+@asynccontextmanager
+async def medusa_slot(timeout: float | None = None, tenant: str | None = None):
+    """
+    Holds one of the MEDUSA_MAX_IN_FLIGHT slots for `tenant` (default: the
+    current request's). Waits at most `timeout` (or MEDUSA_ADMISSION_TIMEOUT)
+    seconds.
+    """
+    if MEDUSA_MAX_IN_FLIGHT <= 0:
+        yield
+        return
+    wait = MEDUSA_ADMISSION_TIMEOUT if timeout is None else min(timeout, MEDUSA_ADMISSION_TIMEOUT)
+    started = time.perf_counter()
+    await _scheduler.acquire(tenant_var.get() if tenant is None else tenant, wait)
+    MEDUSA_QUEUE_WAIT_SECONDS.observe(value=time.perf_counter() - started)
+    try:
+        yield
+    finally:
+        _scheduler.release()
+
@@ -0,0 +1,127 @@
+"""
+Helpers for the batch cart-to-cXML endpoint.
+
+- `iter_ndjson`: decodes an NDJSON request stream line by line, without
+  first joining the whole body into one buffer.
+- `map_as_completed`: runs a coroutine per input with bounded concurrency and
+  yields results in completion order.
+- `run_in_pool`: runs CPU-bound rendering on the worker pool selected by
+  PUNCHOUT_BATCH_EXECUTOR, keeping the event loop free for other requests.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+# "thread" keeps the loop responsive; "process" also spreads rendering of very
+# large carts over several CPUs at the cost of pickling each cart.
+PUNCHOUT_BATCH_EXECUTOR = os.getenv("PUNCHOUT_BATCH_EXECUTOR", "thread").lower()
+PUNCHOUT_BATCH_WORKERS = int(os.getenv("PUNCHOUT_BATCH_WORKERS", "4"))
+PUNCHOUT_BATCH_MAX_IN_FLIGHT = int(os.getenv("PUNCHOUT_BATCH_MAX_IN_FLIGHT", str(2 * PUNCHOUT_BATCH_WORKERS)))
+
+_executor: Executor | None = None
+
+
+class InvalidLine:
+    """Placeholder yielded by `iter_ndjson` for a line that is not valid JSON."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """Yields one decoded value (or InvalidLine) per non-blank line."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        scan_from = len(buffer)
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", scan_from)) != -1:
+            line = bytes(buffer[start:end])
+            start = scan_from = end + 1
+            if line.strip():
+                yield _decode_line(line)
+        del buffer[:start]
+    if buffer.strip():
+        yield _decode_line(bytes(buffer))
+
+
+def _decode_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return InvalidLine(f"Invalid JSON: {e}")
+
+
+async def map_as_completed(
+    items: Iterable[Any],
+    fn: Callable[[int, Any], Awaitable[Any]],
+    limit: int = PUNCHOUT_BATCH_MAX_IN_FLIGHT,
+) -> AsyncIterator[Any]:
+    """
+    Calls `fn(index, item)` for every item with at most `limit` calls in
+    flight, yielding each result as soon as it is ready. `fn` is expected to
+    turn its own failures into result values.
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(limit)
+    pending: set[asyncio.Task] = set()
+    _DONE = object()
+
+    async def run(index: int, item: Any) -> None:
+        try:
+            await results.put(await fn(index, item))
+        finally:
+            slots.release()
+
+    async def produce() -> None:
+        try:
+            index = 0
+            for item in items:
+                await slots.acquire()
+                task = asyncio.create_task(run(index, item))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                index += 1
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            await results.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            yield result
+        await producer  # surface errors raised while reading the input
+    finally:
+        producer.cancel()
+        for task in list(pending):
+            task.cancel()
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if PUNCHOUT_BATCH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=PUNCHOUT_BATCH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PUNCHOUT_BATCH_WORKERS, thread_name_prefix="punchout-batch")
+    return _executor
+
+
+async def run_in_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+
+
+def shutdown_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
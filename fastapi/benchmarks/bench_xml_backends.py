@@ -0,0 +1,115 @@
+"""
+Compares the PunchOutSetupRequest parser backends (defusedxml vs lxml) on
+small, typical and very large setup requests, next to two references:
+
+- `reference`: the original parse (defusedxml `fromstring` + `.find()`),
+  which every backend should match or beat;
+- `defusedxml-stream`: the defusedxml backend with CXML_STREAM_THRESHOLD
+  forced to 1 byte, i.e. the incremental parser. Only set a threshold when
+  this column beats `defusedxml` for bodies of that size.
+
+Usage (from the fastapi/ directory):
+    python benchmarks/bench_xml_backends.py [--repeat 5] [--number 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import defusedxml.ElementTree as ET  # noqa: E402
+
+from cxml_parser import BACKENDS, CXML_MAX_DEPTH, DefusedXMLBackend  # noqa: E402
+
+
+def build_setup_request(extrinsics: int = 0, contacts: int = 0, selected_item: bool = True) -> bytes:
+    """Builds a PunchOutSetupRequest padded with Extrinsic and Contact blocks."""
+    extrinsic_xml = "".join(
+        f'<Extrinsic name="CostCenter{i}">CC-{i:06d} Department of Procurement Operations</Extrinsic>'
+        for i in range(extrinsics)
+    )
+    contact_xml = "".join(
+        f'<Contact role="buyer" addressID="A{i}"><Name xml:lang="en">Buyer {i}</Name>'
+        f'<Email>buyer{i}@example.com</Email><Phone name="work"><TelephoneNumber>'
+        f'<CountryCode isoCountryCode="US">1</CountryCode><AreaOrCityCode>555</AreaOrCityCode>'
+        f'<Number>{i:07d}</Number></TelephoneNumber></Phone></Contact>'
+        for i in range(contacts)
+    )
+    selected_xml = (
+        "<SelectedItem><ItemID><SupplierPartID>SKU-12345</SupplierPartID></ItemID></SelectedItem>"
+        if selected_item else ""
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<cXML payloadID="1@bench" timestamp="2026-02-24T00:00:00Z">
+    <Header>
+        <From><Credential domain="NetworkId"><Identity>AcmeCorp</Identity></Credential></From>
+        <To><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></To>
+        <Sender><Credential domain="NetworkId"><Identity>AcmeCorp</Identity>
+            <SharedSecret>secret</SharedSecret></Credential><UserAgent>bench</UserAgent></Sender>
+    </Header>
+    <Request>
+        <PunchOutSetupRequest operation="create">
+            <BuyerCookie>cookie-bench</BuyerCookie>
+            {extrinsic_xml}
+            <BrowserFormPost><URL>https://procurement.example.com/return</URL></BrowserFormPost>
+            {contact_xml}
+            {selected_xml}
+        </PunchOutSetupRequest>
+    </Request>
+</cXML>""".encode()
+
+
+class ReferenceParse:
+    """The setup route's parse before the backends existed."""
+
+    def parse_setup_request_bytes(self, chunks, max_bytes, max_depth):
+        root = ET.fromstring(b"".join(chunks))
+        request_node = root.find("Request")
+        header_node = root.find("Header")
+        setup_request = request_node.find("PunchOutSetupRequest")
+        header_node.find(".//From/Credential/Identity")
+        setup_request.find("BuyerCookie")
+        setup_request.find("BrowserFormPost/URL")
+        setup_request.find(".//SelectedItem/ItemID/SupplierPartID")
+
+
+SCENARIOS = {
+    "small": build_setup_request(),
+    "typical": build_setup_request(extrinsics=10, contacts=2),
+    "very_large": build_setup_request(extrinsics=5000, contacts=1000),
+}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--number", type=int, default=0, help="iterations per repeat (0 = auto)")
+    args = ap.parse_args()
+
+    backends = {"reference": ReferenceParse()}
+    for name, backend_cls in BACKENDS.items():
+        try:
+            backends[name] = backend_cls()
+        except ImportError as e:
+            print(f"skipping {name}: {e}")
+    backends["defusedxml-stream"] = DefusedXMLBackend(stream_threshold=1)
+
+    print(f"{'scenario':<12}{'size':>10}  " + "".join(f"{name:>20}" for name in backends))
+    for scenario, doc in SCENARIOS.items():
+        max_bytes = len(doc) + 1
+        chunks = [doc[i:i + 65536] for i in range(0, len(doc), 65536)]
+        row = f"{scenario:<12}{len(doc):>10,}  "
+        for backend in backends.values():
+            def run(backend=backend):
+                backend.parse_setup_request_bytes(chunks, max_bytes, CXML_MAX_DEPTH)
+
+            number = args.number or max(1, int(0.2 / max(timeit.timeit(run, number=1), 1e-6)))
+            best = min(timeit.repeat(run, number=number, repeat=args.repeat)) / number
+            row += f"{best * 1e6:>17.1f} µs"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+In-memory stand-in for the Medusa store API, for load tests.
+
+Implements the calls the middleware makes during provisioning
+(`/auth/customer/emailpass`, `/auth/customer/emailpass/register`,
+`/store/customers`) plus a synthetic `/store/products` catalog, with
+configurable latency and error rate.
+
+Used in-process through `httpx.ASGITransport` by `loadtest.py`, or served
+over HTTP for a middleware running under uvicorn:
+    python benchmarks/fake_medusa.py --port 9100 --latency-ms 20
+    MEDUSA_BACKEND_URL=http://127.0.0.1:9100 uvicorn main:app --workers 4
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import jwt
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+TOKEN_SECRET = "fake-medusa-signing-key-not-a-real-secret"
+TOKEN_TTL = 24 * 60 * 60
+
+
+class FakeMedusa:
+    """
+    ASGI app: Medusa-like routes behind injected latency and failures.
+    `latency_ms` ± `jitter_ms` is added to every call; `error_rate` of the
+    calls answer 503 instead. Customers live in memory for the app's lifetime.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        products: int = 1000,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.customers: dict[str, str] = {}  # email -> password
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self.routes = self._build_routes(products)
+
+    async def __call__(self, scope, receive, send):
+        # A plain ASGI wrapper rather than an HTTP middleware, which would cost
+        # more CPU than the routes themselves and skew in-process measurements.
+        if scope["type"] == "http":
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            if delay:
+                await asyncio.sleep(delay)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                failure = JSONResponse({"type": "unexpected_state", "message": "Injected failure"}, status_code=503)
+                await failure(scope, receive, send)
+                return
+        await self.routes(scope, receive, send)
+
+    def _build_routes(self, products: int) -> FastAPI:
+        app = FastAPI(title="Fake Medusa")
+        customers = self.customers
+        catalog = [
+            {
+                "id": f"prod_{i:08d}",
+                "handle": f"product-{i}",
+                "title": f"Product {i}",
+                "metadata": {"unspsc": "44121600", "manufacturer": "Fake Manufacturing"},
+                "variants": [
+                    {"id": f"variant_{i:08d}_{v}", "sku": f"SKU-{i}-{v}", "title": f"Variant {v}", "metadata": {}}
+                    for v in range(2)
+                ],
+            }
+            for i in range(products)
+        ]
+        by_id = {product["id"]: product for product in catalog}
+
+        def token(email: str) -> str:
+            now = int(time.time())
+            return jwt.encode({"actor_id": email, "iat": now, "exp": now + TOKEN_TTL}, TOKEN_SECRET, algorithm="HS256")
+
+        async def credentials(request: Request) -> tuple[str, str]:
+            body = json.loads(await request.body() or b"{}")
+            return body.get("email", ""), body.get("password", "")
+
+        @app.post("/auth/customer/emailpass")
+        async def login(request: Request):
+            email, password = await credentials(request)
+            if customers.get(email) != password:
+                return JSONResponse({"type": "unauthorized", "message": "Invalid email or password"}, status_code=401)
+            return {"token": token(email)}
+
+        @app.post("/auth/customer/emailpass/register")
+        async def register(request: Request):
+            email, password = await credentials(request)
+            if email in customers:
+                return JSONResponse({"type": "unauthorized", "message": "Identity with email already exists"}, status_code=401)
+            customers[email] = password
+            return {"token": token(email)}
+
+        @app.post("/store/customers")
+        async def create_customer(request: Request):
+            body = json.loads(await request.body() or b"{}")
+            return {"customer": {"id": f"cus_{len(customers):016d}", **body}}
+
+        @app.get("/store/products")
+        async def list_products(request: Request):
+            params = request.query_params
+            ids = params.getlist("id[]")
+            selected = [by_id[product_id] for product_id in ids if product_id in by_id] if ids else catalog
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", 50))
+            return {"products": selected[offset:offset + limit], "count": len(selected), "offset": offset, "limit": limit}
+
+        return app
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Serve the fake Medusa store API over HTTP.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--products", type=int, default=1000)
+    args = ap.parse_args()
+    app = FakeMedusa(args.latency_ms, args.jitter_ms, args.error_rate, args.products)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
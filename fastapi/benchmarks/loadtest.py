@@ -0,0 +1,257 @@
+"""
+End-to-end load test of /api/punchout/setup and /api/punchout/order, fully
+offline.
+
+By default the middleware runs in-process: requests go through
+`httpx.ASGITransport` into `main.app`, whose Medusa client is pointed at the
+fake Medusa app from `fake_medusa.py` (latency and error rate configurable).
+With --url, a running middleware is driven over HTTP instead (point its
+MEDUSA_BACKEND_URL at `python benchmarks/fake_medusa.py`).
+
+Each phase keeps --concurrency requests in flight until --requests have
+completed, then reports throughput and p50/p95/p99 latency.
+
+Usage (from the fastapi/ directory):
+    python benchmarks/loadtest.py --scenario setup --concurrency 50 --requests 2000 --latency-ms 20
+    python benchmarks/loadtest.py --scenario order --cart-lines 1,100,1000,5000
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --scenario mixed --json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import time
+from typing import Awaitable, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+
+SETUP_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<cXML payloadID="{n}@loadtest" timestamp="2026-02-24T00:00:00Z" xml:lang="en-US">
+    <Header>
+        <From><Credential domain="NetworkId"><Identity>{company}</Identity></Credential></From>
+        <To><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></To>
+        <Sender>
+            <Credential domain="NetworkId"><Identity>{company}</Identity><SharedSecret>secret</SharedSecret></Credential>
+            <UserAgent>Procurement System 1.0</UserAgent>
+        </Sender>
+    </Header>
+    <Request deploymentMode="production">
+        <PunchOutSetupRequest operation="create">
+            <BuyerCookie>cookie-{n}</BuyerCookie>
+            <Extrinsic name="UserEmail">buyer{n}@{company}.example.com</Extrinsic>
+            <Extrinsic name="CostCenter">CC-{n:06d}</Extrinsic>
+            <BrowserFormPost><URL>https://procurement.example.com/punchout/return?cookie={n}</URL></BrowserFormPost>
+            <Contact role="buyer"><Name xml:lang="en">Buyer {n}</Name><Email>buyer{n}@{company}.example.com</Email></Contact>
+            <ShipTo><Address addressID="HQ"><Name xml:lang="en">{company} HQ</Name></Address></ShipTo>
+            {selected_item}
+        </PunchOutSetupRequest>
+    </Request>
+</cXML>"""
+
+_TOKEN = re.compile(r"token=([^<\s]+)")
+
+
+def build_setup_request(n: int, companies: int, level2: bool) -> bytes:
+    selected_item = (
+        f"<SelectedItem><ItemID><SupplierPartID>SKU-{n % 1000}-0</SupplierPartID></ItemID></SelectedItem>"
+        if level2 else ""
+    )
+    return SETUP_REQUEST.format(n=n, company=f"LoadTestCo{n % companies}", selected_item=selected_item).encode()
+
+
+def build_cart_return(lines: int, session_id: str) -> bytes:
+    return json.dumps({
+        "session_id": session_id,
+        "buyer_cookie": "cookie-loadtest",
+        "browser_form_post_url": "https://procurement.example.com/punchout/return",
+        "currency": "usd",
+        "items": [
+            {
+                "id": f"SKU-{i % 1000}-{i % 2}",
+                "title": f"Product {i % 1000} & accessories <{i % 2}>",
+                "quantity": 1 + i % 5,
+                "unit_price": round(5 + (i % 97) * 1.37, 2),
+                "currency_code": "usd",
+                "description": f"Line {i} of a load test cart",
+            }
+            for i in range(lines)
+        ],
+    }).encode()
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(pct / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+async def run_phase(
+    name: str,
+    send: Callable[[int], Awaitable[httpx.Response]],
+    requests: int,
+    concurrency: int,
+    warmup: int = 0,
+) -> dict:
+    """Closed-loop run: `concurrency` workers issue `send(n)` until `requests` are done."""
+    for n in range(warmup):
+        await send(-1 - n)
+
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            started = time.perf_counter()
+            try:
+                response = await send(n)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+                statuses[0] = statuses.get(0, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "phase": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def _session_id(setup_response: httpx.Response) -> str | None:
+    match = _TOKEN.search(setup_response.text)
+    if not match:
+        return None
+    claims = jwt.decode(match.group(1), options={"verify_signature": False})
+    return claims.get("sid") or claims.get("session_id")
+
+
+async def run(args) -> list[dict]:
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency),
+            timeout=httpx.Timeout(60.0),
+        )
+        app_context = None
+    else:
+        # Background work that would also hit the fake Medusa is kept off
+        # unless asked for, so the numbers reflect the request path.
+        os.environ.setdefault("CATALOG_REFRESH_INTERVAL", "0")
+        os.environ.setdefault("SKU_INDEX_ENABLED", "true" if args.sku_index else "false")
+        os.environ.setdefault("LOG_LEVEL", args.log_level)
+        from fake_medusa import FakeMedusa
+        import main
+        from medusa_client import open_medusa_client
+
+        fake = FakeMedusa(args.latency_ms, args.jitter_ms, args.error_rate, seed=1)
+        app_context = main.lifespan(main.app)
+        await app_context.__aenter__()
+        await open_medusa_client(httpx.ASGITransport(app=fake))
+        if args.sku_index:
+            from sku_index import reload_sku_index
+
+            await reload_sku_index()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://punchout", timeout=60.0)
+
+    results = []
+    try:
+        async def setup(n: int) -> httpx.Response:
+            return await client.post(
+                "/api/punchout/setup",
+                content=build_setup_request(abs(n), args.companies, args.level2),
+                headers={"Content-Type": "text/xml"},
+            )
+
+        if args.scenario in ("setup", "mixed"):
+            results.append(await run_phase("setup", setup, args.requests, args.concurrency, args.warmup))
+
+        if args.scenario in ("order", "mixed"):
+            session_id = _session_id(await setup(0)) or "loadtest-session"
+            for lines in args.cart_lines:
+                body = build_cart_return(lines, session_id)
+                # Big carts take longer; keep the phase duration in the same ballpark
+                requests = max(args.concurrency, args.requests // max(1, lines // 100))
+
+                async def order(n: int, body=body) -> httpx.Response:
+                    return await client.post(
+                        f"/api/punchout/order?format={args.format}",
+                        content=body,
+                        headers={"Content-Type": "application/json"},
+                    )
+
+                result = await run_phase(f"order[{lines} lines]", order, requests, args.concurrency, args.warmup)
+                result["payload_bytes"] = len(body)
+                results.append(result)
+    finally:
+        await client.aclose()
+        if app_context is not None:
+            await app_context.__aexit__(None, None, None)
+
+    return results
+
+
+def print_report(results: list[dict]) -> None:
+    print(f"{'phase':<22}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        print(
+            f"{r['phase']:<22}{r['requests']:>9}{r['errors']:>8}{r['throughput_rps']:>10.1f}"
+            f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}"
+        )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Offline load test of the punchout middleware.")
+    ap.add_argument("--scenario", choices=["setup", "order", "mixed"], default="mixed")
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--requests", type=int, default=1000, help="requests per phase (order phases scale down with cart size)")
+    ap.add_argument("--warmup", type=int, default=20, help="sequential requests before each phase")
+    ap.add_argument("--companies", type=int, default=100, help="distinct buyer orgs in setup requests")
+    ap.add_argument("--level2", action="store_true", help="send a SelectedItem with every setup request")
+    ap.add_argument("--cart-lines", default="1,10,100,1000,5000",
+                    type=lambda value: [int(v) for v in value.split(",") if v.strip()])
+    ap.add_argument("--format", choices=["json", "xml"], default="json", help="PunchOutOrderMessage response format")
+    ap.add_argument("--latency-ms", type=float, default=10.0, help="fake Medusa latency per call")
+    ap.add_argument("--jitter-ms", type=float, default=5.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of fake Medusa calls answering 503")
+    ap.add_argument("--sku-index", action="store_true", help="load the SKU index from the fake catalog first")
+    ap.add_argument("--log-level", default="ERROR", help="middleware LOG_LEVEL for in-process runs")
+    ap.add_argument("--url", help="drive a running middleware instead of the in-process app")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Micro-benchmarks for the CPU-bound hot paths, checked against stored baselines.
+
+Benchmarks (synthetic inputs of growing size):
+- setup_parse:     PunchOutSetupRequest parsing (configured CXML_PARSER_BACKEND)
+- cart_validate:   PunchoutCartReturn validation from the JSON request body
+                   (Pydantic, the fallback path of cart_codec)
+- cart_decode:     the same body through cart_codec's fast backend
+- response_encode: order route JSON response, stdlib encoder vs. cart_codec's
+- order_render:    PunchOutOrderMessage rendering
+- catalog_rows:    Medusa variant → index catalog row transformation + CSV encoding
+
+Each result is the best per-call time over --repeat runs, divided by the
+time of a fixed pure-Python calibration loop measured right before and after
+it. The ratio is what gets stored and compared: it stays stable when the
+machine is faster, slower or busy (shared CI runners drift by ±50% within
+minutes; the ratio by ~10%). A benchmark whose ratio exceeds its baseline by
+more than --threshold is measured again (--confirm times) and fails the run
+(exit status 1) only if it stays slower, so a noisy neighbour does not.
+
+Usage (from the fastapi/ directory):
+    python benchmarks/microbench.py                   # compare with baseline.json
+    python benchmarks/microbench.py --update          # record a new baseline
+    python benchmarks/microbench.py --update --only cart_decode   # (re)record just these
+    python benchmarks/microbench.py --only order_render --threshold 0.1
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Keep module import side effects (background tasks, log output) out of the numbers
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from bench_xml_backends import build_setup_request  # noqa: E402
+from cart_codec import PunchoutCartReturn, _backend as cart_backend, decode_cart_return  # noqa: E402
+from cxml_parser import parse_setup_request_bytes  # noqa: E402
+from cxml_render import render_order_message  # noqa: E402
+from generate_catalog import iter_variant_rows  # noqa: E402
+from loadtest import build_cart_return  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+
+
+def build_products(count: int, variants: int = 3) -> list[dict]:
+    return [
+        {
+            "id": f"prod_{i:08d}",
+            "title": f"Product {i}, \"premium\" edition",
+            "variants": [
+                {
+                    "id": f"variant_{i:08d}_{v}",
+                    "sku": f"SKU-{i}-{v}",
+                    "prices": [{"amount": 1999 + i + v, "currency_code": "usd"}],
+                }
+                for v in range(variants)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def _catalog_rows(products: list[dict]) -> None:
+    writer = csv.writer(io.StringIO(), delimiter=',', quoting=csv.QUOTE_MINIMAL)
+    for row in iter_variant_rows(products):
+        writer.writerow(row)
+
+
+def benchmarks() -> dict[str, Callable[[], object]]:
+    cases: dict[str, Callable[[], object]] = {}
+    for name, kwargs in {
+        "small": {},
+        "typical": {"extrinsics": 10, "contacts": 2},
+        "large": {"extrinsics": 1000, "contacts": 200},
+    }.items():
+        doc = build_setup_request(**kwargs)
+        cases[f"setup_parse[{name}]"] = lambda doc=doc: parse_setup_request_bytes(doc, max_bytes=len(doc) + 1)
+
+    for lines in (10, 100, 1000, 10000):
+        body = build_cart_return(lines, "bench-session")
+        payload = PunchoutCartReturn.model_validate_json(body)
+        cases[f"cart_validate[{lines}]"] = lambda body=body: PunchoutCartReturn.model_validate_json(body)
+        cases[f"order_render[{lines}]"] = lambda payload=payload: render_order_message(payload)
+
+    for lines in (10, 1000, 10000):
+        body = build_cart_return(lines, "bench-session")
+        response = {
+            "status": "success",
+            "redirect_url": "https://procurement.example.com/punchout/return",
+            "cxml_base64": render_order_message(PunchoutCartReturn.model_validate_json(body)),
+        }
+        cases[f"cart_decode[{cart_backend.name},{lines}]"] = (
+            lambda body=body: decode_cart_return(body, "application/json")
+        )
+        cases[f"response_encode[stdlib,{lines}]"] = lambda response=response: json.dumps(
+            response, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        cases[f"response_encode[{cart_backend.name},{lines}]"] = (
+            lambda response=response: cart_backend.encode(response)
+        )
+
+    for count in (100, 1000, 10000):
+        products = build_products(count)
+        cases[f"catalog_rows[{count * 3}]"] = lambda products=products: _catalog_rows(products)
+    return cases
+
+
+def _calibrate() -> int:
+    total = 0
+    for i in range(20000):
+        total += len(str(i)) * (i & 7)
+    return total
+
+
+def measure(func: Callable[[], object], repeat: int, budget: float = 0.2) -> float:
+    """Best per-call time in seconds."""
+    number = max(1, int(budget / max(timeit.timeit(func, number=1), 1e-7)))
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def measure_relative(func: Callable[[], object], repeat: int) -> tuple[float, float]:
+    """(seconds per call, seconds per call / calibration loop time)."""
+    before = measure(_calibrate, 3, budget=0.05)
+    seconds = measure(func, repeat)
+    after = measure(_calibrate, 3, budget=0.05)
+    return seconds, seconds / min(before, after)
+
+
+def load_baseline(path: str) -> dict | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Micro-benchmarks with baseline regression checks.")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                    help="allowed slowdown vs. baseline, as a fraction (0.25 = 25%%)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--confirm", type=int, default=2, help="re-measurements before reporting a regression")
+    ap.add_argument("--only", help="run only benchmarks whose name starts with this prefix")
+    args = ap.parse_args()
+    baseline = None if args.update else load_baseline(args.baseline)
+
+    results = {}
+    seconds_by_name = {}
+    regressions = []
+    print(f"{'benchmark':<32}{'time µs':>12}{'relative':>12}{'baseline':>12}{'change':>10}")
+    for name, func in benchmarks().items():
+        if args.only and not name.startswith(args.only):
+            continue
+        if args.update:
+            # Median of three, so a lucky run doesn't set an unreachable bar
+            samples = sorted((measure_relative(func, args.repeat) for _ in range(3)), key=lambda sample: sample[1])
+            seconds, relative = samples[1]
+        else:
+            seconds, relative = measure_relative(func, args.repeat)
+        expected = baseline["results"].get(name) if baseline else None
+        if expected:
+            for _ in range(args.confirm):
+                if relative / expected - 1 <= args.threshold:
+                    break
+                retry_seconds, retry = measure_relative(func, args.repeat)
+                if retry < relative:
+                    seconds, relative = retry_seconds, retry
+        results[name] = relative
+        seconds_by_name[name] = seconds
+
+        row = f"{name:<32}{seconds * 1e6:>12.1f}{relative:>12.4f}"
+        if expected:
+            change = relative / expected - 1
+            flag = ""
+            if change > args.threshold:
+                regressions.append(name)
+                flag = "  REGRESSION"
+            row += f"{expected:>12.4f}{change:>+10.1%}{flag}"
+        print(row)
+
+    if args.update:
+        if args.only:
+            # Leave every other benchmark's reference untouched
+            previous = load_baseline(args.baseline) or {}
+            results = {**previous.get("results", {}), **results}
+            seconds_by_name = {**previous.get("seconds", {}), **seconds_by_name}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                # Informational; comparisons use `results` (calibration-relative)
+                "seconds": seconds_by_name,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    elif baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update to record one.")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
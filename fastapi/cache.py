@@ -0,0 +1,299 @@
+"""
+Small caching primitives used on the punchout request path.
+
+- `TTLCache`: LRU-bounded key/value cache whose entries expire after a TTL.
+- `SQLiteCache`: same interface, stored in a SQLite file in WAL mode so every
+  uvicorn worker on the host reads and writes the same entries.
+- `SingleFlight`: coalesces concurrent calls for the same key into one
+  in-flight coroutine, so a burst of identical requests does the work once.
+
+Coroutines on the event loop use `aget` / `aset` / `adelete` (and the
+`*_many` batch variants): SQLiteCache runs them in a worker thread, since a
+write-locked database can block a call for up to the 5 s busy timeout. The
+plain methods are for synchronous code.
+
+Use `make_cache()` to get the backend selected by CACHE_BACKEND.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+# "memory" (per worker) or "sqlite" (shared by all workers on the host)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "/tmp/punchout-cache.sqlite3")
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry. Not thread-safe; intended to be used from
+    the event loop of a single worker.
+    """
+
+    def __init__(self, maxsize: int = 10_000, default_ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        """The cached values of `keys` (misses are left out)."""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, items: dict, ttl: float | None = None) -> None:
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    async def aget(self, key: Hashable) -> Any | None:
+        return self.get(key)
+
+    async def aset(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self.set(key, value, ttl)
+
+    async def adelete(self, key: Hashable) -> None:
+        self.delete(key)
+
+    async def aget_many(self, keys: Iterable[Hashable]) -> dict:
+        return self.get_many(keys)
+
+    async def aset_many(self, items: dict, ttl: float | None = None) -> None:
+        self.set_many(items, ttl)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "pid": os.getpid(), "size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    TTL cache shared across worker processes through a SQLite database in WAL
+    mode (readers never block the single writer). Values must be
+    JSON-serialisable. Hit/miss counters are kept per worker process.
+
+    Size is bounded approximately: once the namespace grows past `maxsize`,
+    the entries closest to expiry are evicted.
+    """
+
+    _EVICT_EVERY = 256  # check the size bound every N writes
+    _BATCH = 500  # keys per statement in get_many (SQLite caps bound parameters)
+
+    def __init__(self, namespace: str, maxsize: int = 10_000, default_ttl: float = 300.0,
+                 path: str = CACHE_SQLITE_PATH):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so each worker process gets its own connection.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expiry ON cache (ns, expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM cache WHERE ns = ? AND key = ? AND expires_at > ?",
+                (self.namespace, str(key), time.time()),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.delete(key)
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, str(key), json.dumps(value, separators=(",", ":")), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict(conn)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        """The cached values of `keys` (misses are left out), read in batched queries."""
+        by_str = {str(key): key for key in keys}
+        names = list(by_str)
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            for start in range(0, len(names), self._BATCH):
+                batch = names[start:start + self._BATCH]
+                rows = conn.execute(
+                    f"SELECT key, value FROM cache WHERE ns = ? AND expires_at > ? AND key IN ({', '.join('?' * len(batch))})",
+                    (self.namespace, now, *batch),
+                ).fetchall()
+                for key, value in rows:
+                    found[by_str[key]] = value
+            self.hits += len(found)
+            self.misses += len(names) - len(found)
+        return {key: json.loads(value) for key, value in found.items()}
+
+    def set_many(self, items: dict, ttl: float | None = None) -> None:
+        """Writes all `items` in one transaction."""
+        ttl = self.default_ttl if ttl is None else ttl
+        if not items:
+            return
+        if ttl <= 0:
+            for key in items:
+                self.delete(key)
+            return
+        expires_at = time.time() + ttl
+        rows = [
+            (self.namespace, str(key), json.dumps(value, separators=(",", ":")), expires_at)
+            for key, value in items.items()
+        ]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)", rows)
+            before, self._writes = self._writes, self._writes + len(rows)
+            if before // self._EVICT_EVERY != self._writes // self._EVICT_EVERY:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM cache WHERE ns = ? AND expires_at <= ?", (self.namespace, time.time()))
+        (size,) = conn.execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()
+        if size > self.maxsize:
+            conn.execute(
+                "DELETE FROM cache WHERE ns = ? AND key IN ("
+                " SELECT key FROM cache WHERE ns = ? ORDER BY expires_at LIMIT ?)",
+                (self.namespace, self.namespace, size - self.maxsize),
+            )
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, str(key)))
+
+    async def aget(self, key: Hashable) -> Any | None:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def adelete(self, key: Hashable) -> None:
+        await asyncio.to_thread(self.delete, key)
+
+    async def aget_many(self, keys: Iterable[Hashable]) -> dict:
+        return await asyncio.to_thread(self.get_many, keys)
+
+    async def aset_many(self, items: dict, ttl: float | None = None) -> None:
+        await asyncio.to_thread(self.set_many, items, ttl)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM cache WHERE ns = ?", (self.namespace,))
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "pid": os.getpid(), "size": len(self), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        with self._lock:
+            (size,) = self._connection().execute(
+                "SELECT COUNT(*) FROM cache WHERE ns = ? AND expires_at > ?", (self.namespace, time.time())
+            ).fetchone()
+        return size
+
+
+def make_cache(namespace: str, maxsize: int = 10_000, default_ttl: float = 300.0) -> TTLCache | SQLiteCache:
+    """Returns a cache for `namespace` using the backend selected by CACHE_BACKEND."""
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCache(namespace, maxsize=maxsize, default_ttl=default_ttl)
+    return TTLCache(maxsize=maxsize, default_ttl=default_ttl)
+
+
+class SingleFlight:
+    """
+    Ensures at most one coroutine runs per key at a time. Callers arriving
+    while a call is in flight await the same result (or exception).
+
+    The shared call runs in its own task, so cancelling one waiter (e.g. a
+    client disconnect) does not cancel the work the other waiters depend on.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter was cancelled.
+        if not task.cancelled():
+            task.exception()
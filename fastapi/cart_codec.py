@@ -0,0 +1,303 @@
+"""
+Cart return (PunchoutCartReturn) decoding and order response encoding.
+
+The Pydantic models below define the cart return and its error messages.
+For large carts, building them dominates the order route's CPU time, so
+`decode_cart_return` first tries a fast backend that decodes straight into
+slotted dataclasses (`CartReturnRecord` / `CartItemRecord`):
+
+- `msgspec`: typed decoding in a single pass (strict: no str → number or
+  float → int coercion);
+- `orjson`: orjson parsing plus exact type checks;
+- `pydantic`: no fast path.
+
+A fast backend only accepts bodies that the models would accept with the
+same values. Anything else is decoded again exactly as FastAPI decodes a
+`PunchoutCartReturn` body parameter (stdlib JSON, then lax Pydantic
+validation), so coerced values and 422 error bodies are unchanged.
+
+`CartJSONResponse` encodes the route's JSON response with the same backend.
+Select the backend with CART_CODEC_BACKEND (`auto` picks the fastest
+installed one).
+"""
+import email.message
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, List
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from starlette.responses import JSONResponse
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+# "auto", "msgspec", "orjson" or "pydantic"
+CART_CODEC_BACKEND = os.getenv("CART_CODEC_BACKEND", "auto").lower()
+
+
+class CartItem(BaseModel):
+    id: str
+    title: str
+    quantity: int
+    unit_price: float # Must be decimal/float in Medusa
+    currency_code: str
+    description: str = ""
+
+class PunchoutCartReturn(BaseModel):
+    session_id: str
+    # Optional when the session is known server-side; the stored values win.
+    browser_form_post_url: str | None = None
+    buyer_cookie: str | None = None
+    currency: str
+    items: List[CartItem]
+
+
+@dataclass(slots=True)
+class CartItemRecord:
+    id: str
+    title: str
+    quantity: int
+    unit_price: float
+    currency_code: str
+    description: str = ""
+
+
+@dataclass(slots=True)
+class CartReturnRecord:
+    session_id: str
+    currency: str
+    items: list[CartItemRecord]
+    browser_form_post_url: str | None = None
+    buyer_cookie: str | None = None
+
+    @classmethod
+    def from_model(cls, model: PunchoutCartReturn) -> "CartReturnRecord":
+        return cls(
+            session_id=model.session_id,
+            currency=model.currency,
+            items=[
+                CartItemRecord(item.id, item.title, item.quantity, item.unit_price, item.currency_code, item.description)
+                for item in model.items
+            ],
+            browser_form_post_url=model.browser_form_post_url,
+            buyer_cookie=model.buyer_cookie,
+        )
+
+
+class _Rejected(Exception):
+    """The fast path cannot vouch for this input; decode it the Pydantic way."""
+
+
+# ── Fast backends ─────────────────────────────────────────────────────────────
+
+def _optional_str(value: Any) -> str | None:
+    if value is None or type(value) is str:
+        return value
+    raise _Rejected
+
+
+def _record_from_python(obj: Any) -> CartReturnRecord:
+    """Exact-type check of already decoded JSON; anything Pydantic would coerce is rejected."""
+    if type(obj) is not dict:
+        raise _Rejected
+    session_id = obj.get("session_id")
+    currency = obj.get("currency")
+    items = obj.get("items")
+    if type(session_id) is not str or type(currency) is not str or type(items) is not list:
+        raise _Rejected
+
+    records = []
+    append = records.append
+    for item in items:
+        if type(item) is not dict:
+            raise _Rejected
+        item_id = item.get("id")
+        title = item.get("title")
+        quantity = item.get("quantity")
+        unit_price = item.get("unit_price")
+        currency_code = item.get("currency_code")
+        description = item.get("description", "")
+        if (
+            type(item_id) is not str
+            or type(title) is not str
+            or type(quantity) is not int
+            or type(currency_code) is not str
+            or type(description) is not str
+        ):
+            raise _Rejected
+        if type(unit_price) is int:
+            try:
+                unit_price = float(unit_price)
+            except OverflowError:
+                raise _Rejected from None
+        elif type(unit_price) is not float:
+            raise _Rejected
+        append(CartItemRecord(item_id, title, quantity, unit_price, currency_code, description))
+
+    return CartReturnRecord(
+        session_id=session_id,
+        currency=currency,
+        items=records,
+        browser_form_post_url=_optional_str(obj.get("browser_form_post_url")),
+        buyer_cookie=_optional_str(obj.get("buyer_cookie")),
+    )
+
+
+class _MsgspecBackend:
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self._decoder = msgspec.json.Decoder(CartReturnRecord)
+        self._encoder = msgspec.json.Encoder()
+        self._error = msgspec.MsgspecError
+
+    def decode(self, body: bytes) -> CartReturnRecord:
+        try:
+            return self._decoder.decode(body)
+        except (self._error, UnicodeDecodeError):  # invalid UTF-8 inside a string
+            raise _Rejected from None
+
+    def encode(self, content: Any) -> bytes:
+        return self._encoder.encode(content)
+
+
+class _OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def decode(self, body: bytes) -> CartReturnRecord:
+        try:
+            obj = self._orjson.loads(body)
+        except self._orjson.JSONDecodeError:
+            raise _Rejected from None
+        return _record_from_python(obj)
+
+    def encode(self, content: Any) -> bytes:
+        return self._orjson.dumps(content)
+
+
+class _PydanticBackend:
+    name = "pydantic"
+
+    def decode(self, body: bytes) -> CartReturnRecord:
+        raise _Rejected
+
+    def encode(self, content: Any) -> bytes:
+        # Same output as starlette's JSONResponse
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+BACKENDS = {
+    "msgspec": _MsgspecBackend,
+    "orjson": _OrjsonBackend,
+    "pydantic": _PydanticBackend,
+}
+
+
+def make_backend(name: str):
+    if name == "auto":
+        for candidate in ("msgspec", "orjson"):
+            try:
+                return BACKENDS[candidate]()
+            except ImportError:
+                continue
+        return _PydanticBackend()
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown CART_CODEC_BACKEND {name!r}; expected auto or one of {sorted(BACKENDS)}")
+    return backend_cls()
+
+
+_backend = make_backend(CART_CODEC_BACKEND)
+
+
+def backend_name() -> str:
+    return _backend.name
+
+
+# ── Decoding ──────────────────────────────────────────────────────────────────
+
+def _is_json(content_type: str | None) -> bool:
+    # Same rule FastAPI applies before parsing a body parameter as JSON
+    if not content_type:
+        return True
+    message = email.message.Message()
+    message["content-type"] = content_type
+    if message.get_content_maintype() != "application":
+        return False
+    subtype = message.get_content_subtype()
+    return subtype == "json" or subtype.endswith("+json")
+
+
+def _missing_body_error() -> dict:
+    error = ValidationError.from_exception_data(
+        "Field required", [{"type": "missing", "loc": ("body",), "input": {}}]
+    ).errors()[0]
+    error["input"] = None
+    return error
+
+
+def _decode_like_fastapi(body: bytes, is_json: bool) -> CartReturnRecord:
+    """What FastAPI does for a `payload: PunchoutCartReturn` parameter, errors included."""
+    value = None
+    if body:
+        if is_json:
+            try:
+                value = json.loads(body)
+            except json.JSONDecodeError as e:
+                raise RequestValidationError(
+                    [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+                    body=e.doc,
+                ) from e
+            except Exception as e:
+                raise HTTPException(status_code=400, detail="There was an error parsing the body") from e
+        else:
+            value = body
+    if value is None:
+        raise RequestValidationError([_missing_body_error()], body=value)
+    try:
+        model = PunchoutCartReturn.model_validate(value, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()], body=value
+        ) from None
+    return CartReturnRecord.from_model(model)
+
+
+def decode_cart_return(body: bytes, content_type: str | None) -> CartReturnRecord:
+    """
+    Decodes a cart return request body. Raises RequestValidationError (422)
+    or HTTPException (400) like a FastAPI body parameter would.
+    """
+    is_json = _is_json(content_type)
+    if body and is_json:
+        try:
+            return _backend.decode(body)
+        except _Rejected:
+            pass
+    return _decode_like_fastapi(body, is_json)
+
+
+def validate_cart_return(obj: Any) -> CartReturnRecord:
+    """Validates an already decoded cart return; raises pydantic.ValidationError."""
+    try:
+        return _record_from_python(obj)
+    except _Rejected:
+        return CartReturnRecord.from_model(PunchoutCartReturn.model_validate(obj))
+
+
+# ── Encoding ──────────────────────────────────────────────────────────────────
+
+class CartJSONResponse(JSONResponse):
+    """JSONResponse encoded by the selected backend (plain JSON types only)."""
+
+    def render(self, content: Any) -> bytes:
+        return _backend.encode(content)
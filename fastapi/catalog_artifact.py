@@ -0,0 +1,255 @@
+"""
+Precomputed index catalog artifacts behind GET /api/punchout/catalog.
+
+The catalog is exported from Medusa in the background (one streaming pass
+producing every format in CATALOG_ARTIFACT_FORMATS, gzip-compressed) into
+CATALOG_ARTIFACT_DIR, and regenerated every CATALOG_REFRESH_INTERVAL seconds.
+A file lock makes sure only one worker on the host crawls Medusa per round;
+files are renamed into place when complete, so readers always see a whole
+artifact.
+
+Each artifact gets a strong ETag (SHA-256 of the gzip bytes), computed once
+per file version and cached per worker.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import re
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from catalog_writers import WRITERS, output_path
+from logs import get_logger
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+CATALOG_ARTIFACT_DIR = os.getenv("CATALOG_ARTIFACT_DIR", "/tmp/punchout-catalog")
+CATALOG_ARTIFACT_FORMATS = [
+    fmt.strip() for fmt in os.getenv("CATALOG_ARTIFACT_FORMATS", "csv,cif,cxml").split(",") if fmt.strip() in WRITERS
+]
+# Seconds between regenerations; 0 disables the schedule (artifacts are then
+# only built on first request).
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "3600"))
+
+ARTIFACT_BASENAME = "index_catalog.csv"
+MEDIA_TYPE = "application/gzip"
+
+_refresh_task: asyncio.Task | None = None
+_generation: asyncio.Task | None = None
+_etags: dict[str, tuple[tuple, str]] = {}  # path -> ((ino, mtime_ns, size), etag)
+
+logger = get_logger(__name__)
+
+
+class ArtifactInfo:
+    __slots__ = ("path", "filename", "size", "etag", "last_modified")
+
+    def __init__(self, path: str, size: int, etag: str, last_modified: datetime):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def artifact_path(fmt: str) -> str:
+    return output_path(os.path.join(CATALOG_ARTIFACT_DIR, ARTIFACT_BASENAME), fmt, "gzip")
+
+
+def _age(path: str) -> float | None:
+    try:
+        return datetime.now().timestamp() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _needs_refresh() -> bool:
+    # Half an interval: another worker that regenerated moments ago wins.
+    for fmt in CATALOG_ARTIFACT_FORMATS:
+        age = _age(artifact_path(fmt))
+        if age is None or (CATALOG_REFRESH_INTERVAL and age >= CATALOG_REFRESH_INTERVAL / 2):
+            return True
+    return False
+
+
+def _try_lock():
+    """Non-blocking exclusive lock shared by all workers on the host; None if held elsewhere."""
+    import fcntl
+
+    os.makedirs(CATALOG_ARTIFACT_DIR, exist_ok=True)
+    lock = open(os.path.join(CATALOG_ARTIFACT_DIR, ".lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+async def regenerate(force: bool = False) -> bool:
+    """
+    Rebuilds the artifacts unless they are fresh or another worker is already
+    at it. Returns True when this call produced new files.
+    """
+    from generate_catalog import export_index_catalog
+
+    if not force and not _needs_refresh():
+        return False
+    lock = _try_lock()
+    if lock is None:
+        return False
+    try:
+        # Re-check under the lock: another worker may have just finished.
+        if not force and not _needs_refresh():
+            return False
+        progress, paths = await export_index_catalog(
+            os.path.join(CATALOG_ARTIFACT_DIR, ARTIFACT_BASENAME),
+            CATALOG_ARTIFACT_FORMATS,
+            "gzip",
+            progress_interval=0,
+        )
+        logger.info("Catalog artifacts regenerated", extra={"rows": progress.rows, "paths": paths})
+        return True
+    finally:
+        lock.close()
+
+
+def trigger_regeneration() -> None:
+    """Starts a background regeneration unless one is already running in this worker."""
+    global _generation
+    if _generation is None or _generation.done():
+        _generation = asyncio.create_task(_regenerate_logged())
+
+
+async def _regenerate_logged() -> None:
+    try:
+        await regenerate()
+    except Exception:
+        logger.exception("Catalog regeneration failed")
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await _regenerate_logged()
+        # Jitter keeps the workers from all waking up at the same moment
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL * random.uniform(0.9, 1.1))
+
+
+def start_catalog_refresh() -> None:
+    """Starts the regeneration schedule. Called from the app lifespan."""
+    global _refresh_task
+    if CATALOG_REFRESH_INTERVAL > 0 and CATALOG_ARTIFACT_FORMATS and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop_catalog_refresh() -> None:
+    global _refresh_task, _generation
+    for task in (_refresh_task, _generation):
+        if task is not None:
+            task.cancel()
+    _refresh_task = _generation = None
+
+
+def _hash_file(fd: int) -> str:
+    digest = hashlib.sha256()
+    offset = 0
+    while chunk := os.pread(fd, 1024 * 1024, offset):
+        digest.update(chunk)
+        offset += len(chunk)
+    return f'"{digest.hexdigest()}"'
+
+
+async def artifact_info(fmt: str, fd: int) -> ArtifactInfo:
+    """Describes the artifact open as `fd` (stat'ed through the descriptor, so a concurrent replace can't mix versions)."""
+    st = os.fstat(fd)
+    path = artifact_path(fmt)
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _etags.get(path)
+    if cached is not None and cached[0] == key:
+        etag = cached[1]
+    else:
+        etag = await asyncio.to_thread(_hash_file, fd)
+        _etags[path] = (key, etag)
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+    return ArtifactInfo(path, st.st_size, etag, last_modified)
+
+
+# ── Conditional and range requests ────────────────────────────────────────────
+
+class RangeNotSatisfiable(ValueError):
+    """The Range header does not overlap the artifact. Maps to HTTP 416."""
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison function
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def is_not_modified(headers, info: ArtifactInfo) -> bool:
+    """RFC 9110 §13.2.2: If-None-Match wins over If-Modified-Since."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, info.etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return info.last_modified <= since
+    return False
+
+
+_RANGE_SPEC = re.compile(r"([0-9]*)-([0-9]*)")
+
+
+def byte_range(headers, info: ArtifactInfo) -> tuple[int, int] | None:
+    """
+    The single `bytes=` range requested, as inclusive (start, end), or None to
+    send the whole artifact (no Range, a stale If-Range, a multi-range
+    request, which servers may answer in full, or a malformed range such as
+    `bytes=500-100`, which RFC 9110 says to ignore). Raises
+    RangeNotSatisfiable for a well-formed range that starts past the end.
+    """
+    value = headers.get("range")
+    if not value or info.size == 0:
+        return None
+    if_range = headers.get("if-range")
+    if if_range is not None and if_range.strip() != info.etag:
+        return None
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    match = _RANGE_SPEC.fullmatch(spec.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = int(last) if last else info.size - 1
+    elif last:
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable(value)
+        start, end = max(info.size - suffix, 0), info.size - 1
+    else:
+        return None
+    if start >= info.size:
+        raise RangeNotSatisfiable(value)
+    return start, min(end, info.size - 1)
+
+
+async def iter_file(fd: int, start: int, end: int, chunk_size: int = 256 * 1024):
+    """Yields bytes start..end (inclusive) of `fd` without moving a shared file offset."""
+    offset = start
+    while offset <= end:
+        chunk = await asyncio.to_thread(os.pread, fd, min(chunk_size, end - offset + 1), offset)
+        if not chunk:
+            return
+        offset += len(chunk)
+        yield chunk
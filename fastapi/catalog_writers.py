@@ -0,0 +1,283 @@
+"""
+Streaming writers for index catalogs.
+
+Every writer takes rows in CATALOG_HEADERS order, one at a time, and writes
+them straight to its file, so any number of formats can be produced from a
+single pass over the Medusa catalog:
+
+- `csv`:  the minimal RFC 4180 index catalog CSV.
+- `cif`:  Ariba CIF 3.0 (CIF_I_V3.0 header, FIELDNAMES, DATA ... ENDOFDATA).
+- `cxml`: a cXML `Index` document with one IndexItemAdd per row.
+
+Output can be compressed on the fly with gzip or zip. Files are written under
+a temporary name and only renamed into place on `commit()`, so a failed
+export never leaves a truncated catalog behind.
+"""
+import csv
+import gzip
+import io
+import os
+import zipfile
+from datetime import datetime, timezone
+from typing import Iterable
+from xml.sax.saxutils import escape, quoteattr
+
+# ── Configuration (set via env vars) ─────────────────────────────────────────
+CATALOG_SUPPLIER_ID = os.getenv("CATALOG_SUPPLIER_ID", "Supplier")
+CATALOG_SUPPLIER_ID_DOMAIN = os.getenv("CATALOG_SUPPLIER_ID_DOMAIN", "NetworkId")
+CATALOG_DEFAULT_CURRENCY = os.getenv("CATALOG_DEFAULT_CURRENCY", "USD")
+CATALOG_GZIP_LEVEL = int(os.getenv("CATALOG_GZIP_LEVEL", "6"))
+
+# Standard minimal CIF/CSV headers for procurement systems
+CATALOG_HEADERS = [
+    "Supplier Part ID", # Maps to SKU
+    "Manufacturer Part ID",
+    "Manufacturer Name",
+    "Item Description", # Title/Description
+    "Unit Price",
+    "Unit of Measure", # Usually EA (Each)
+    "Currency",
+    "Lead Time"
+]
+
+# Placeholder classification until products carry a real UNSPSC code
+DEFAULT_UNSPSC = "00000000"
+
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zip": ".zip"}
+
+
+class _Output:
+    """A text stream onto `path` (via a temporary file), optionally gzip- or zip-compressed."""
+
+    def __init__(self, path: str, compression: str = "none"):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}; expected one of {sorted(COMPRESSIONS)}")
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self._closers = []
+        raw = open(self.tmp_path, "wb")
+        self._closers.append(raw)
+        if compression == "gzip":
+            member = os.path.basename(path).removesuffix(".gz")
+            raw = gzip.GzipFile(filename=member, mode="wb", fileobj=raw, compresslevel=CATALOG_GZIP_LEVEL)
+            self._closers.append(raw)
+        elif compression == "zip":
+            archive = zipfile.ZipFile(raw, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=CATALOG_GZIP_LEVEL)
+            self._closers.append(archive)
+            raw = archive.open(os.path.basename(path).removesuffix(".zip"), "w", force_zip64=True)
+            self._closers.append(raw)
+        self.stream = io.TextIOWrapper(raw, encoding="utf-8", newline="", write_through=False)
+
+    def _close(self) -> None:
+        try:
+            self.stream.flush()
+            self.stream.detach()
+        finally:
+            for closer in reversed(self._closers):
+                closer.close()
+
+    def commit(self) -> None:
+        self._close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self) -> None:
+        try:
+            self._close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+class CatalogWriter:
+    """Base class: subclasses implement `_begin`, `write_row` and `_end`."""
+
+    format = ""
+    extension = ""
+
+    def __init__(self, path: str, compression: str = "none"):
+        self.path = path
+        self.rows = 0
+        self._output = _Output(path, compression)
+        self.stream = self._output.stream
+        self._begin()
+
+    def _begin(self) -> None:
+        pass
+
+    def write_row(self, row: list) -> None:
+        raise NotImplementedError
+
+    def _end(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        try:
+            self._end()
+        except BaseException:
+            self._output.discard()
+            raise
+        self._output.commit()
+
+    def discard(self) -> None:
+        self._output.discard()
+
+
+def _money(value) -> str:
+    return f"{float(value or 0):.2f}"
+
+
+class CSVCatalogWriter(CatalogWriter):
+    format = "csv"
+    extension = ".csv"
+
+    def __init__(self, path: str, compression: str = "none", headers: list = CATALOG_HEADERS):
+        self.headers = headers
+        super().__init__(path, compression)
+
+    def _begin(self) -> None:
+        self._writer = csv.writer(self.stream, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+        self._writer.writerow(self.headers)
+
+    def write_row(self, row: list) -> None:
+        self._writer.writerow(row)
+        self.rows += 1
+
+
+class CIFCatalogWriter(CatalogWriter):
+    """Ariba CIF 3.0 full-load catalog."""
+
+    format = "cif"
+    extension = ".cif"
+
+    FIELDNAMES = [
+        "Supplier ID", "Supplier Part ID", "Manufacturer Part ID", "Item Description", "SPSC Code",
+        "Unit Price", "Unit of Measure", "Lead Time", "Manufacturer Name", "Currency",
+    ]
+
+    def _begin(self) -> None:
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self.stream.write(
+            "CIF_I_V3.0\r\n"
+            "CHARSET: UTF-8\r\n"
+            "LOADMODE: F\r\n"
+            "CODEFORMAT: UNSPSC\r\n"
+            f"CURRENCY: {CATALOG_DEFAULT_CURRENCY}\r\n"
+            f"SUPPLIERID_DOMAIN: {CATALOG_SUPPLIER_ID_DOMAIN}\r\n"
+            f"TIMESTAMP: {timestamp}\r\n"
+            "UNUOM: TRUE\r\n"
+            f"FIELDNAMES: {','.join(self.FIELDNAMES)}\r\n"
+            "DATA\r\n"
+        )
+        self._writer = csv.writer(self.stream, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+
+    def write_row(self, row: list) -> None:
+        sku, mfr_part_id, mfr_name, description, price, uom, currency, lead_time = row
+        self._writer.writerow([
+            CATALOG_SUPPLIER_ID, sku, mfr_part_id, description, DEFAULT_UNSPSC,
+            _money(price), uom, lead_time, mfr_name, currency,
+        ])
+        self.rows += 1
+
+    def _end(self) -> None:
+        self.stream.write("ENDOFDATA\r\n")
+
+
+class CXMLIndexWriter(CatalogWriter):
+    """cXML Index document."""
+
+    format = "cxml"
+    extension = ".xml"
+
+    def _begin(self) -> None:
+        self.stream.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE Index SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<Index>
+    <SupplierID domain={quoteattr(CATALOG_SUPPLIER_ID_DOMAIN)}>{escape(CATALOG_SUPPLIER_ID)}</SupplierID>
+    <IndexItem>""")
+
+    def write_row(self, row: list) -> None:
+        sku, mfr_part_id, mfr_name, description, price, uom, currency, lead_time = row
+        manufacturer = ""
+        if mfr_part_id:
+            manufacturer += f"\n                <ManufacturerPartID>{escape(str(mfr_part_id))}</ManufacturerPartID>"
+        if mfr_name:
+            manufacturer += f"\n                <ManufacturerName>{escape(str(mfr_name))}</ManufacturerName>"
+        self.stream.write(f"""
+        <IndexItemAdd>
+            <ItemID>
+                <SupplierPartID>{escape(str(sku))}</SupplierPartID>
+            </ItemID>
+            <ItemDetail>
+                <UnitPrice>
+                    <Money currency={quoteattr(str(currency))}>{_money(price)}</Money>
+                </UnitPrice>
+                <Description xml:lang="en">{escape(str(description))}</Description>
+                <UnitOfMeasure>{escape(str(uom))}</UnitOfMeasure>
+                <Classification domain="UNSPSC">{DEFAULT_UNSPSC}</Classification>{manufacturer}
+            </ItemDetail>
+            <IndexItemDetail>
+                <LeadTime>{escape(str(lead_time))}</LeadTime>
+            </IndexItemDetail>
+        </IndexItemAdd>""")
+        self.rows += 1
+
+    def _end(self) -> None:
+        self.stream.write("""
+    </IndexItem>
+</Index>
+""")
+
+
+WRITERS = {
+    CSVCatalogWriter.format: CSVCatalogWriter,
+    CIFCatalogWriter.format: CIFCatalogWriter,
+    CXMLIndexWriter.format: CXMLIndexWriter,
+}
+
+
+def output_path(base_path: str, fmt: str, compression: str = "none") -> str:
+    """
+    `index_catalog.csv` → `index_catalog.cif.gz` for fmt="cif", compression="gzip".
+    The CSV keeps the base path as given.
+    """
+    if fmt == CSVCatalogWriter.format:
+        return base_path + COMPRESSIONS[compression]
+    stem, _ = os.path.splitext(base_path)
+    return stem + WRITERS[fmt].extension + COMPRESSIONS[compression]
+
+
+class MultiWriter:
+    """Fans every row out to several writers and commits or discards them together."""
+
+    def __init__(self, writers: Iterable[CatalogWriter]):
+        self.writers = list(writers)
+
+    @classmethod
+    def open(cls, base_path: str, formats: Iterable[str], compression: str = "none") -> "MultiWriter":
+        writers = []
+        try:
+            for fmt in formats:
+                if fmt not in WRITERS:
+                    raise ValueError(f"Unknown catalog format {fmt!r}; expected one of {sorted(WRITERS)}")
+                writers.append(WRITERS[fmt](output_path(base_path, fmt, compression), compression))
+        except BaseException:
+            for writer in writers:
+                writer.discard()
+            raise
+        return cls(writers)
+
+    @property
+    def paths(self) -> list[str]:
+        return [writer.path for writer in self.writers]
+
+    def write_row(self, row: list) -> None:
+        for writer in self.writers:
+            writer.write_row(row)
+
+    def commit(self) -> None:
+        for writer in self.writers:
+            writer.commit()
+
+    def discard(self) -> None:
+        for writer in self.writers:
+            writer.discard()
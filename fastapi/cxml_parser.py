@@ -0,0 +1,421 @@
+"""
+XXE-safe parsing of PunchOutSetupRequest documents, with pluggable backends.
+
+- `defusedxml` (default): the body is collected (up to CXML_MAX_BODY_BYTES),
+  parsed in one go by defusedxml's `DefusedXMLParser` and the fields are read
+  with fixed `.find()` paths, which ElementPath compiles once and caches.
+  Bodies larger than CXML_STREAM_THRESHOLD bytes are instead fed chunk by
+  chunk into `SetupRequestParser`, a pull parser that keeps memory bounded by
+  the nesting depth. Streaming is off by default: its per-event Python loop
+  measured slower than the one-shot parse at every size
+  (benchmarks/bench_xml_backends.py), so only enable it after measuring a gain.
+- `lxml`: libxml2 parser with entity resolution, network access and DTD
+  loading disabled, plus precompiled XPath expressions for the same fields.
+  Documents declaring entities are rejected, as with defusedxml.
+
+Select the backend with CXML_PARSER_BACKEND.
+"""
+import os
+from typing import AsyncIterable, Iterable
+from xml.etree.ElementTree import ParseError, TreeBuilder, XMLPullParser
+
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import DefusedXMLParser
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+CXML_MAX_BODY_BYTES = int(os.getenv("CXML_MAX_BODY_BYTES", str(2 * 1024 * 1024)))
+CXML_MAX_DEPTH = int(os.getenv("CXML_MAX_DEPTH", "32"))
+CXML_PARSER_BACKEND = os.getenv("CXML_PARSER_BACKEND", "defusedxml").lower()
+# Bodies above this many bytes are parsed incrementally (defusedxml backend); 0 never streams
+CXML_STREAM_THRESHOLD = int(os.getenv("CXML_STREAM_THRESHOLD", "0"))
+
+
+class CXMLParseError(ValueError):
+    """The payload is not a usable PunchOutSetupRequest. Maps to HTTP 400."""
+
+    status_code = 400
+
+
+class CXMLTooLargeError(CXMLParseError):
+    """The payload exceeds CXML_MAX_BODY_BYTES. Maps to HTTP 413."""
+
+    status_code = 413
+
+
+class SetupRequestFields:
+    """The PunchOutSetupRequest fields the middleware acts on."""
+
+    __slots__ = ("from_identity", "buyer_cookie", "browser_form_post_url", "supplier_part_id", "operation")
+
+    def __init__(self):
+        self.from_identity: str | None = None
+        self.buyer_cookie: str | None = None
+        self.browser_form_post_url: str | None = None
+        self.supplier_part_id: str | None = None
+        self.operation: str | None = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"SetupRequestFields({fields})"
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class SetupRequestParser:
+    """
+    Push-style parser: call `feed()` with every chunk, then `close()` and
+    `result()`. Once `feed()` returns True all fields are known and the rest
+    of the document is only checked for well-formedness, nesting depth and
+    size, so trailing garbage is still rejected. The first occurrence of each
+    field wins, as with `.find()`.
+    """
+
+    def __init__(self, max_bytes: int = CXML_MAX_BODY_BYTES, max_depth: int = CXML_MAX_DEPTH):
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.fields = SetupRequestFields()
+        self._received = 0
+        self._path: list[str] = []
+        self._elements: list = []
+        self._seen_header = False
+        self._seen_request = False
+        self._seen_setup = False
+        self._setup_ended = False
+        self._done = False
+        self._parser = XMLPullParser(
+            events=("start", "end"),
+            _parser=DefusedXMLParser(target=TreeBuilder(), forbid_dtd=False, forbid_entities=True, forbid_external=True),
+        )
+
+    def feed(self, chunk: bytes) -> bool:
+        self._received += len(chunk)
+        if self._received > self.max_bytes:
+            raise CXMLTooLargeError(f"cXML payload exceeds {self.max_bytes} bytes")
+        try:
+            self._parser.feed(chunk)
+            self._drain() if self._done else self._consume()
+        except (ParseError, DefusedXmlException) as e:
+            raise CXMLParseError(f"Invalid XML payload: {e}") from e
+        return self._done
+
+    def close(self) -> None:
+        try:
+            self._parser.close()
+            self._drain() if self._done else self._consume()
+        except (ParseError, DefusedXmlException) as e:
+            raise CXMLParseError(f"Invalid XML payload: {e}") from e
+
+    def result(self) -> SetupRequestFields:
+        if not self._seen_header or not self._seen_request:
+            raise CXMLParseError("Missing Request or Header node")
+        if not self._seen_setup:
+            raise CXMLParseError("Missing PunchOutSetupRequest node")
+        return self.fields
+
+    def _consume(self) -> None:
+        path, elements, fields = self._path, self._elements, self.fields
+        for event, elem in self._parser.read_events():
+            if self._done:
+                # Completed mid-chunk; the rest is only checked
+                self._drain_event(event, elem)
+                continue
+            if event == "start":
+                path.append(_local(elem.tag))
+                elements.append(elem)
+                depth = len(path)
+                if depth > self.max_depth:
+                    raise CXMLParseError(f"cXML nesting exceeds {self.max_depth} levels")
+                if depth == 2:
+                    if path[1] == "Header":
+                        self._seen_header = True
+                    elif path[1] == "Request":
+                        self._seen_request = True
+                elif (depth == 3 and not self._seen_setup
+                        and path[1] == "Request" and path[2] == "PunchOutSetupRequest"):
+                    self._seen_setup = True
+                    fields.operation = elem.get("operation")
+                continue
+
+            # "end": pick out the fields we need by their element path
+            depth = len(path)
+            tag = path[-1]
+            if tag == "Identity":
+                if (fields.from_identity is None and depth >= 5 and path[1] == "Header"
+                        and path[-3] == "From" and path[-2] == "Credential"):
+                    fields.from_identity = elem.text
+            elif (depth >= 4 and not self._setup_ended
+                    and path[2] == "PunchOutSetupRequest" and path[1] == "Request"):
+                # Only the first PunchOutSetupRequest counts
+                if tag == "BuyerCookie" and depth == 4:
+                    if fields.buyer_cookie is None:
+                        fields.buyer_cookie = elem.text
+                elif tag == "URL" and depth == 5 and path[3] == "BrowserFormPost":
+                    if fields.browser_form_post_url is None:
+                        fields.browser_form_post_url = elem.text
+                elif (tag == "SupplierPartID" and fields.supplier_part_id is None
+                        and path[-3] == "SelectedItem" and path[-2] == "ItemID"):
+                    fields.supplier_part_id = elem.text
+            elif depth == 3 and tag == "PunchOutSetupRequest" and path[1] == "Request":
+                self._setup_ended = True
+
+            path.pop()
+            elements.pop()
+            # Drop the finished subtree so memory stays bounded by depth
+            if elements:
+                elements[-1].remove(elem)
+
+            # The Header normally precedes the Request, so this is usually the
+            # PunchOutSetupRequest end tag; no field can change after it.
+            # A Level 2 SelectedItem completes the field set even earlier.
+            if self._setup_ended and self._seen_header:
+                self._done = True
+            elif (fields.supplier_part_id is not None and fields.from_identity is not None
+                    and fields.buyer_cookie is not None and fields.browser_form_post_url is not None):
+                self._done = True
+
+    def _drain(self) -> None:
+        for event, elem in self._parser.read_events():
+            self._drain_event(event, elem)
+
+    def _drain_event(self, event: str, elem) -> None:
+        if event == "start":
+            self._path.append("")
+            if len(self._path) > self.max_depth:
+                raise CXMLParseError(f"cXML nesting exceeds {self.max_depth} levels")
+        else:
+            self._path.pop()
+            elem.clear()
+
+
+class _SetupRequestBody:
+    """Collects a body for DefusedXMLBackend, handing it to SetupRequestParser past the threshold."""
+
+    __slots__ = ("backend", "max_bytes", "max_depth", "chunks", "received", "stream")
+
+    def __init__(self, backend: "DefusedXMLBackend", max_bytes: int, max_depth: int):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.chunks: list[bytes] = []
+        self.received = 0
+        self.stream: SetupRequestParser | None = None
+
+    def feed(self, chunk: bytes) -> None:
+        if self.stream is not None:
+            self.stream.feed(chunk)
+            return
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            raise CXMLTooLargeError(f"cXML payload exceeds {self.max_bytes} bytes")
+        self.chunks.append(chunk)
+        if 0 < self.backend.stream_threshold < self.received:
+            self.stream = SetupRequestParser(max_bytes=self.max_bytes, max_depth=self.max_depth)
+            for buffered in self.chunks:
+                self.stream.feed(buffered)
+            self.chunks = []
+
+    def result(self) -> SetupRequestFields:
+        if self.stream is not None:
+            self.stream.close()
+            return self.stream.result()
+        return self.backend.parse_document(b"".join(self.chunks), self.max_depth)
+
+
+class DefusedXMLBackend:
+    """
+    defusedxml backend (stdlib expat underneath): one-shot parse with
+    `.find()`, or SetupRequestParser above `stream_threshold` bytes.
+    """
+
+    name = "defusedxml"
+
+    def __init__(self, stream_threshold: int = CXML_STREAM_THRESHOLD):
+        self.stream_threshold = stream_threshold
+
+    @staticmethod
+    def _too_deep(root, max_depth: int) -> bool:
+        # Level by level, so a normal (shallow) document stops after a few passes
+        level = [root]
+        for _ in range(max_depth):
+            level = [child for elem in level for child in elem]
+            if not level:
+                return False
+        return True
+
+    def parse_document(self, data: bytes, max_depth: int) -> SetupRequestFields:
+        try:
+            parser = DefusedXMLParser(target=TreeBuilder(), forbid_dtd=False, forbid_entities=True, forbid_external=True)
+            parser.feed(data)
+            root = parser.close()
+        except (ParseError, DefusedXmlException) as e:
+            raise CXMLParseError(f"Invalid XML payload: {e}") from e
+
+        if self._too_deep(root, max_depth):
+            raise CXMLParseError(f"cXML nesting exceeds {max_depth} levels")
+        request = root.find("Request")
+        header = root.find("Header")
+        if request is None or header is None:
+            raise CXMLParseError("Missing Request or Header node")
+        setup = request.find("PunchOutSetupRequest")
+        if setup is None:
+            raise CXMLParseError("Missing PunchOutSetupRequest node")
+
+        fields = SetupRequestFields()
+        fields.operation = setup.get("operation")
+        for attr, path, context in (
+            ("from_identity", ".//From/Credential/Identity", header),
+            ("buyer_cookie", "BuyerCookie", setup),
+            ("browser_form_post_url", "BrowserFormPost/URL", setup),
+            ("supplier_part_id", ".//SelectedItem/ItemID/SupplierPartID", setup),
+        ):
+            found = context.find(path)
+            if found is not None:
+                setattr(fields, attr, found.text)
+        return fields
+
+    async def parse_setup_request(self, chunks: AsyncIterable[bytes], max_bytes: int, max_depth: int) -> SetupRequestFields:
+        body = _SetupRequestBody(self, max_bytes, max_depth)
+        async for chunk in chunks:
+            if chunk:
+                body.feed(chunk)
+        return body.result()
+
+    def parse_setup_request_bytes(self, chunks: Iterable[bytes], max_bytes: int, max_depth: int) -> SetupRequestFields:
+        body = _SetupRequestBody(self, max_bytes, max_depth)
+        for chunk in chunks:
+            if chunk:
+                body.feed(chunk)
+        return body.result()
+
+
+class LxmlBackend:
+    """
+    libxml2 backend. The document is parsed in full (via the feed interface,
+    so the body is never concatenated) and the fields are read with
+    precompiled XPath expressions.
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree
+
+        self._etree = etree
+        self._setup = etree.XPath("/*/Request/PunchOutSetupRequest")
+        self._has_header = etree.XPath("boolean(/*/Header)")
+        self._has_request = etree.XPath("boolean(/*/Request)")
+        self._from_identity = etree.XPath("(/*/Header//From/Credential/Identity)[1]")
+        self._buyer_cookie = etree.XPath("BuyerCookie")
+        self._form_post_url = etree.XPath("BrowserFormPost/URL")
+        self._supplier_part_id = etree.XPath("(.//SelectedItem/ItemID/SupplierPartID)[1]")
+        self._too_deep: dict[int, object] = {}
+
+    def _new_parser(self):
+        return self._etree.XMLParser(
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            dtd_validation=False,
+            huge_tree=False,
+            remove_comments=True,
+            remove_pis=True,
+        )
+
+    def _depth_check(self, max_depth: int):
+        # True when an element exists below max_depth levels
+        check = self._too_deep.get(max_depth)
+        if check is None:
+            check = self._too_deep[max_depth] = self._etree.XPath("boolean(" + "/*" * (max_depth + 1) + ")")
+        return check
+
+    def _feed(self, parser, chunk: bytes, received: int, max_bytes: int) -> int:
+        received += len(chunk)
+        if received > max_bytes:
+            raise CXMLTooLargeError(f"cXML payload exceeds {max_bytes} bytes")
+        try:
+            parser.feed(chunk)
+        except self._etree.XMLSyntaxError as e:
+            raise CXMLParseError(f"Invalid XML payload: {e}") from e
+        return received
+
+    def _extract(self, parser, max_depth: int) -> SetupRequestFields:
+        try:
+            root = parser.close()
+        except self._etree.XMLSyntaxError as e:
+            raise CXMLParseError(f"Invalid XML payload: {e}") from e
+
+        dtd = root.getroottree().docinfo.internalDTD
+        if dtd is not None and any(True for _ in dtd.iterentities()):
+            raise CXMLParseError("Invalid XML payload: entity declarations are forbidden")
+        if self._depth_check(max_depth)(root):
+            raise CXMLParseError(f"cXML nesting exceeds {max_depth} levels")
+        if not self._has_header(root) or not self._has_request(root):
+            raise CXMLParseError("Missing Request or Header node")
+        setup = self._setup(root)
+        if not setup:
+            raise CXMLParseError("Missing PunchOutSetupRequest node")
+        setup = setup[0]
+
+        fields = SetupRequestFields()
+        fields.operation = setup.get("operation")
+        for attr, xpath, context in (
+            ("from_identity", self._from_identity, root),
+            ("buyer_cookie", self._buyer_cookie, setup),
+            ("browser_form_post_url", self._form_post_url, setup),
+            ("supplier_part_id", self._supplier_part_id, setup),
+        ):
+            found = xpath(context)
+            if found:
+                setattr(fields, attr, found[0].text)
+        return fields
+
+    async def parse_setup_request(self, chunks: AsyncIterable[bytes], max_bytes: int, max_depth: int) -> SetupRequestFields:
+        parser, received = self._new_parser(), 0
+        async for chunk in chunks:
+            if chunk:
+                received = self._feed(parser, chunk, received, max_bytes)
+        return self._extract(parser, max_depth)
+
+    def parse_setup_request_bytes(self, chunks: Iterable[bytes], max_bytes: int, max_depth: int) -> SetupRequestFields:
+        parser, received = self._new_parser(), 0
+        for chunk in chunks:
+            if chunk:
+                received = self._feed(parser, chunk, received, max_bytes)
+        return self._extract(parser, max_depth)
+
+
+BACKENDS = {
+    DefusedXMLBackend.name: DefusedXMLBackend,
+    LxmlBackend.name: LxmlBackend,
+}
+
+
+def make_backend(name: str) -> DefusedXMLBackend | LxmlBackend:
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown CXML_PARSER_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
+    return backend_cls()
+
+
+_backend = make_backend(CXML_PARSER_BACKEND)
+
+
+async def parse_setup_request(
+    chunks: AsyncIterable[bytes],
+    max_bytes: int = CXML_MAX_BODY_BYTES,
+    max_depth: int = CXML_MAX_DEPTH,
+) -> SetupRequestFields:
+    """Parses a PunchOutSetupRequest from an async byte stream (e.g. `request.stream()`)."""
+    return await _backend.parse_setup_request(chunks, max_bytes, max_depth)
+
+
+def parse_setup_request_bytes(
+    data: bytes | Iterable[bytes],
+    max_bytes: int = CXML_MAX_BODY_BYTES,
+    max_depth: int = CXML_MAX_DEPTH,
+) -> SetupRequestFields:
+    """Synchronous variant for an in-memory body or an iterable of chunks."""
+    return _backend.parse_setup_request_bytes([data] if isinstance(data, bytes) else data, max_bytes, max_depth)
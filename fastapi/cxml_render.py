@@ -0,0 +1,110 @@
+"""
+Rendering of the cXML PunchOutOrderMessage returned to the procurement system.
+
+`iter_order_message` yields the document in chunks of CXML_RENDER_CHUNK_ITEMS
+ItemIn elements, so a StreamingResponse never holds more than one chunk of a
+very large cart in memory. `render_order_message` joins the same chunks into
+a single string for the JSON response. All text and attribute values are
+XML-escaped.
+
+Per-line classification, unit of measure, manufacturer and lead time come
+from an optional `details` mapping (item id → ItemDetails, see enrichment.py);
+lines without details use CXML_DEFAULT_UNSPSC / CXML_DEFAULT_UOM.
+"""
+import os
+from typing import Iterator, Mapping, NamedTuple
+from xml.sax.saxutils import escape, quoteattr
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+CXML_RENDER_CHUNK_ITEMS = int(os.getenv("CXML_RENDER_CHUNK_ITEMS", "256"))
+CXML_DEFAULT_UNSPSC = os.getenv("CXML_DEFAULT_UNSPSC", "00000000")
+CXML_DEFAULT_UOM = os.getenv("CXML_DEFAULT_UOM", "EA")
+
+
+class ItemDetails(NamedTuple):
+    unspsc: str = CXML_DEFAULT_UNSPSC
+    unit_of_measure: str = CXML_DEFAULT_UOM
+    manufacturer_part_id: str | None = None
+    manufacturer_name: str | None = None
+    lead_time: str | None = None  # days
+
+
+DEFAULT_ITEM_DETAILS = ItemDetails()
+
+
+def _render_item(item, currency_attr: str, details: ItemDetails = DEFAULT_ITEM_DETAILS) -> str:
+    extra = ""
+    if details.manufacturer_part_id:
+        extra += f"""
+                        <ManufacturerPartID>{escape(details.manufacturer_part_id)}</ManufacturerPartID>"""
+    if details.manufacturer_name:
+        extra += f"""
+                        <ManufacturerName xml:lang="en">{escape(details.manufacturer_name)}</ManufacturerName>"""
+    if details.lead_time:
+        extra += f"""
+                        <LeadTime>{escape(details.lead_time)}</LeadTime>"""
+    return f"""
+                <ItemIn quantity={quoteattr(str(item.quantity))}>
+                    <ItemID>
+                        <SupplierPartID>{escape(item.id)}</SupplierPartID>
+                    </ItemID>
+                    <ItemDetail>
+                        <UnitPrice>
+                            <Money currency={currency_attr}>{item.unit_price:.2f}</Money>
+                        </UnitPrice>
+                        <Description xml:lang="en">{escape(item.title)}</Description>
+                        <UnitOfMeasure>{escape(details.unit_of_measure)}</UnitOfMeasure>
+                        <Classification domain="UNSPSC">{escape(details.unspsc)}</Classification>{extra}
+                    </ItemDetail>
+                </ItemIn>"""
+
+
+def iter_order_message(
+    payload,
+    details: Mapping[str, ItemDetails] | None = None,
+    chunk_items: int = CXML_RENDER_CHUNK_ITEMS,
+) -> Iterator[str]:
+    """
+    Yields the PunchOutOrderMessage for a cart return (anything with
+    session_id, buyer_cookie, currency and items) as successive text chunks.
+    """
+    details = details or {}
+    currency_attr = quoteattr(payload.currency)
+    total_amount = sum(item.quantity * item.unit_price for item in payload.items)
+
+    # Note: A real implementation would dynamically fetch Supplier Identity configs from the Database
+    yield f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<cXML payloadID={quoteattr(f"order-return-{payload.session_id}@middleware")} timestamp="2026-02-24T00:00:00Z">
+    <Header>
+        <From><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></From>
+        <To><Credential domain="NetworkId"><Identity>BuyerNetwork</Identity></Credential></To>
+        <Sender><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></Sender>
+    </Header>
+    <Message>
+        <PunchOutOrderMessage>
+            <BuyerCookie>{escape(payload.buyer_cookie)}</BuyerCookie>
+            <PunchOutOrderMessageHeader operationAllowed="edit">
+                <Total>
+                    <Money currency={currency_attr}>{total_amount:.2f}</Money>
+                </Total>
+            </PunchOutOrderMessageHeader>
+            """
+
+    items = payload.items
+    for start in range(0, len(items), chunk_items):
+        yield "".join(
+            _render_item(item, currency_attr, details.get(item.id, DEFAULT_ITEM_DETAILS))
+            for item in items[start:start + chunk_items]
+        )
+
+    yield """
+        </PunchOutOrderMessage>
+    </Message>
+</cXML>
+"""
+
+
+def render_order_message(payload, details: Mapping[str, ItemDetails] | None = None) -> str:
+    """Renders the whole PunchOutOrderMessage as one string."""
+    return "".join(iter_order_message(payload, details))
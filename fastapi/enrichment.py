@@ -0,0 +1,186 @@
+"""
+Item enrichment for PunchOutOrderMessage: UNSPSC classification, unit of
+measure, manufacturer part ID / name and lead time for every cart line.
+
+Values are read from the Medusa variant's `metadata`, falling back to the
+product's `metadata` (keys in METADATA_KEYS), then to the cxml_render
+defaults. Cart line ids are SupplierPartIDs (SKU or variant id); the SKU index
+maps them to their variant and product, so all lines missing from the
+variant details cache are fetched with a single `/store/products?id[]=...`
+call per cart (one per ENRICHMENT_BATCH_SIZE products for huge carts, sent
+concurrently).
+
+Lines the SKU index cannot resolve (SKU_INDEX_ENABLED=false, an index still
+loading, or a SKU added since the last sync) are looked up by SKU / variant
+id through the middleware's Medusa route `/store/punchout/variants`, in the
+same batches and within the same timeout; with ENRICHMENT_FALLBACK=false
+they go out with the defaults. Lines that end up with the defaults are
+logged and counted in `punchout_enrichment_lines_total{source="unresolved"}`.
+
+The calls go through `resilience.medusa_request` (breaker, retries and the
+buyer org's admission slot). Enrichment never fails a cart return: if Medusa
+is slow or unavailable, the lines it could not resolve within
+ENRICHMENT_TIMEOUT use the defaults.
+"""
+import asyncio
+import os
+from typing import Iterable
+
+from cache import make_cache
+from cxml_render import CXML_DEFAULT_UNSPSC, CXML_DEFAULT_UOM, ItemDetails
+from logs import get_logger
+from metrics import ENRICHMENT_LINES
+from resilience import medusa_request
+from sku_index import SkuEntry, resolve_sku, sku_index_ready
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+ENRICHMENT_ENABLED = os.getenv("ENRICHMENT_ENABLED", "true").lower() in ("1", "true", "yes")
+ENRICHMENT_CACHE_TTL = float(os.getenv("ENRICHMENT_CACHE_TTL", "900"))
+ENRICHMENT_CACHE_SIZE = int(os.getenv("ENRICHMENT_CACHE_SIZE", "50000"))
+ENRICHMENT_BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", "100"))
+# Seconds a cart return may wait for the batched lookup
+ENRICHMENT_TIMEOUT = float(os.getenv("ENRICHMENT_TIMEOUT", "2"))
+# Look up lines the SKU index does not know by SKU / variant id
+ENRICHMENT_FALLBACK = os.getenv("ENRICHMENT_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# ItemDetails field → metadata keys tried in order
+METADATA_KEYS = {
+    "unspsc": ("unspsc", "unspsc_code"),
+    "unit_of_measure": ("unit_of_measure", "uom"),
+    "manufacturer_part_id": ("manufacturer_part_id", "mpn"),
+    "manufacturer_name": ("manufacturer_name", "manufacturer"),
+    "lead_time": ("lead_time", "lead_time_days"),
+}
+DEFAULTS = {"unspsc": CXML_DEFAULT_UNSPSC, "unit_of_measure": CXML_DEFAULT_UOM}
+PRODUCT_FIELDS = "id,metadata,variants.id,variants.metadata"
+# Medusa route (medusa/src/api/store/punchout/variants) for lines missing from the SKU index
+UNINDEXED_VARIANTS_PATH = "/store/punchout/variants"
+
+logger = get_logger(__name__)
+
+# variant_id → ItemDetails as a dict (JSON-serialisable for the sqlite backend)
+_details = make_cache("variant_details", maxsize=ENRICHMENT_CACHE_SIZE, default_ttl=ENRICHMENT_CACHE_TTL)
+# Same, keyed by cart line id, for lines resolved without the SKU index
+_unindexed = make_cache("unindexed_item_details", maxsize=ENRICHMENT_CACHE_SIZE, default_ttl=ENRICHMENT_CACHE_TTL)
+
+
+def _details_from(product: dict, variant: dict) -> dict:
+    sources = (variant.get("metadata") or {}, product.get("metadata") or {})
+    details = {}
+    for field, keys in METADATA_KEYS.items():
+        value = next(
+            (source[key] for source in sources for key in keys if source.get(key) not in (None, "")),
+            DEFAULTS.get(field),
+        )
+        details[field] = None if value is None else str(value)
+    return details
+
+
+async def _fetch_products(product_ids: list[str]) -> None:
+    """One Medusa call for a batch of products; caches details for all their variants."""
+    response = await medusa_request(
+        "GET",
+        "/store/products",
+        idempotent=True,
+        params={"id[]": product_ids, "fields": PRODUCT_FIELDS, "limit": len(product_ids)},
+    )
+    response.raise_for_status()
+    await _details.aset_many({
+        variant["id"]: _details_from(product, variant)
+        for product in response.json().get("products", [])
+        for variant in product.get("variants") or []
+    })
+
+
+async def _fetch_unindexed(line_ids: list[str]) -> None:
+    """One Medusa call for a batch of line ids unknown to the SKU index; caches what it finds per line id."""
+    response = await medusa_request(
+        "GET",
+        UNINDEXED_VARIANTS_PATH,
+        idempotent=True,
+        params={"sku[]": line_ids, "id[]": [line_id for line_id in line_ids if line_id.startswith("variant_")]},
+    )
+    response.raise_for_status()
+    wanted = set(line_ids)
+    found = {}
+    for variant in response.json().get("variants", []):
+        details = _details_from(variant.get("product") or {}, variant)
+        for key in (variant.get("id"), variant.get("sku")):
+            if key in wanted:
+                found[key] = details
+    await _unindexed.aset_many(found)
+
+
+def _batches(ids: list[str]) -> list[list[str]]:
+    return [ids[start:start + ENRICHMENT_BATCH_SIZE] for start in range(0, len(ids), ENRICHMENT_BATCH_SIZE)]
+
+
+async def enrich_items(items: Iterable) -> dict[str, ItemDetails]:
+    """
+    Returns ItemDetails per cart line id for every line that could be
+    resolved; the renderer uses defaults for the rest.
+    """
+    if not ENRICHMENT_ENABLED:
+        return {}
+
+    enriched: dict[str, ItemDetails] = {}
+    resolved: dict[str, SkuEntry] = {}  # line id → index entry
+    unindexed: set[str] = set()  # line ids the index does not know
+    for item in items:
+        if item.id not in resolved and item.id not in unindexed:
+            entry = resolve_sku(item.id)
+            if entry is not None:
+                resolved[item.id] = entry
+            else:
+                unindexed.add(item.id)
+
+    cached = await _details.aget_many({entry.variant_id for entry in resolved.values()}) if resolved else {}
+    pending: dict[str, str] = {}  # line id → variant id, not cached yet
+    missing_products: set[str] = set()
+    for line_id, entry in resolved.items():
+        details = cached.get(entry.variant_id)
+        if details is not None:
+            enriched[line_id] = ItemDetails(**details)
+        else:
+            pending[line_id] = entry.variant_id
+            missing_products.add(entry.product_id)
+    if unindexed and ENRICHMENT_FALLBACK:
+        cached_unindexed = await _unindexed.aget_many(unindexed)
+        for line_id, details in cached_unindexed.items():
+            enriched[line_id] = ItemDetails(**details)
+        unindexed_pending = sorted(unindexed - cached_unindexed.keys())
+    else:
+        unindexed_pending = []
+    cached_lines = len(enriched)
+    ENRICHMENT_LINES.inc("cached", amount=cached_lines)
+
+    if missing_products or unindexed_pending:
+        calls = [_fetch_products(batch) for batch in _batches(sorted(missing_products))]
+        calls += [_fetch_unindexed(batch) for batch in _batches(unindexed_pending)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*calls), timeout=ENRICHMENT_TIMEOUT)
+        except Exception as e:
+            logger.warning("Item enrichment incomplete, using defaults for unresolved lines: %r", e)
+        fetched = await _details.aget_many(set(pending.values())) if pending else {}
+        for line_id, variant_id in pending.items():
+            details = fetched.get(variant_id)
+            if details is not None:
+                enriched[line_id] = ItemDetails(**details)
+        ENRICHMENT_LINES.inc("fetched", amount=len(enriched) - cached_lines)
+        fetched = await _unindexed.aget_many(unindexed_pending) if unindexed_pending else {}
+        for line_id, details in fetched.items():
+            enriched[line_id] = ItemDetails(**details)
+        ENRICHMENT_LINES.inc("fallback", amount=len(fetched))
+
+    unresolved = len(resolved) + len(unindexed) - len(enriched)
+    if unresolved:
+        ENRICHMENT_LINES.inc("unresolved", amount=unresolved)
+        logger.warning(
+            "Cart lines sent with default item details",
+            extra={"lines": unresolved, "sku_index_ready": sku_index_ready()},
+        )
+    return enriched
+
+
+def enrichment_cache_stats() -> dict:
+    return _details.stats()
@@ -1,79 +1,729 @@
 import httpx
-import csv
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
 import sys
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Iterable, Iterator
 
-MEDUSA_API_URL = os.getenv("MEDUSA_API_URL", "http://localhost:9000/store/products")
+from admission import SYSTEM_TENANT, Overloaded, medusa_slot
+from catalog_writers import CATALOG_HEADERS, COMPRESSIONS, WRITERS, CSVCatalogWriter, MultiWriter
+from logs import get_logger
 
-def fetch_medusa_catalog():
+MEDUSA_API_URL = os.getenv(
+    "MEDUSA_API_URL",
+    os.getenv("MEDUSA_BACKEND_URL", "http://localhost:9000").rstrip("/") + "/store/products",
+)
+MEDUSA_PUBLISHABLE_KEY = os.getenv(
+    "MEDUSA_PUBLISHABLE_KEY",
+    os.getenv("NEXT_PUBLIC_MEDUSA_PUBLISHABLE_KEY", ""),
+)
+# Optional Medusa `fields` selector, e.g. "*variants,*variants.prices"
+MEDUSA_PRODUCT_FIELDS = os.getenv("MEDUSA_PRODUCT_FIELDS", "")
+
+DEFAULT_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "100"))
+DEFAULT_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", "8"))
+DEFAULT_RETRIES = int(os.getenv("CATALOG_RETRIES", "3"))
+DEFAULT_STATE_PATH = os.getenv("CATALOG_STATE_PATH", "catalog_state.json")
+# Region (ISO country code or Medusa region id) for tenants that don't name one
+DEFAULT_REGION = os.getenv("CATALOG_DEFAULT_REGION", os.getenv("NEXT_PUBLIC_DEFAULT_REGION", "cl"))
+DEFAULT_TENANT_CONCURRENCY = int(os.getenv("CATALOG_TENANT_CONCURRENCY", "4"))
+DEFAULT_RENDER_WORKERS = int(os.getenv("CATALOG_RENDER_WORKERS", str(os.cpu_count() or 2)))
+RETRY_BACKOFF = 0.5  # seconds, doubled on every attempt (plus jitter)
+
+logger = get_logger(__name__)
+
+
+def _catalog_client(concurrency: int) -> httpx.AsyncClient:
+    headers = {"x-publishable-api-key": MEDUSA_PUBLISHABLE_KEY} if MEDUSA_PUBLISHABLE_KEY else {}
+    return httpx.AsyncClient(
+        headers=headers,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+    )
+
+
+async def _fetch_page(
+    client: httpx.AsyncClient,
+    offset: int,
+    limit: int,
+    retries: int,
+    filters: dict | None = None,
+    headers: dict | None = None,
+) -> dict:
+    """
+    Fetches one `limit`/`offset` page of products, retrying transport errors,
+    5xx and 429 responses with exponential backoff and jitter. `filters` are
+    extra query parameters (e.g. an `updated_at` filter or a `fields` selector).
+
+    Every attempt holds a Medusa admission slot as SYSTEM_TENANT, so crawls
+    share the worker's in-flight cap fairly with buyer traffic; a slot that
+    could not be obtained in time is retried like a 503.
+    """
+    params = {"limit": limit, "offset": offset}
+    if MEDUSA_PRODUCT_FIELDS:
+        params["fields"] = MEDUSA_PRODUCT_FIELDS
+    if filters:
+        params.update(filters)
+
+    for attempt in range(retries + 1):
+        try:
+            async with medusa_slot(tenant=SYSTEM_TENANT):
+                response = await client.get(MEDUSA_API_URL, params=params, headers=headers)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, Overloaded) as e:
+            retryable = not isinstance(e, httpx.HTTPStatusError) or (
+                e.response.status_code == 429 or e.response.status_code >= 500
+            )
+            if not retryable or attempt == retries:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt + random.uniform(0, RETRY_BACKOFF)
+            # stderr in the CLI; JSON logs when crawling from the middleware
+            logger.warning("Page at offset %d failed (%s); retrying in %.1fs", offset, e, delay)
+            await asyncio.sleep(delay)
+
+
+async def iter_catalog_pages(
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    filters: dict | None = None,
+    headers: dict | None = None,
+    client: httpx.AsyncClient | None = None,
+) -> AsyncIterator[dict]:
+    """
+    Yields Medusa product pages as they arrive. `count` is read from the first
+    page; the remaining pages are fetched over one pooled client with at most
+    `concurrency` requests in flight, so memory stays bounded by
+    `concurrency * page_size` products however large the catalog is.
+    Raises if any page still fails after its retries, so a partial catalog
+    is never exported.
+
+    Pass `client` to share one connection pool between several scans.
+    """
+    owned = client is None
+    if owned:
+        client = _catalog_client(concurrency)
+    try:
+        first = await _fetch_page(client, 0, page_size, retries, filters, headers)
+        count = first.get("count", len(first.get("products", [])))
+        offsets = iter(range(page_size, count, page_size))
+        pending: set[asyncio.Task] = set()
+
+        def launch() -> None:
+            while len(pending) < concurrency:
+                offset = next(offsets, None)
+                if offset is None:
+                    return
+                pending.add(asyncio.create_task(_fetch_page(client, offset, page_size, retries, filters, headers)))
+
+        try:
+            launch()  # start the next pages before handing out the first one
+            yield first
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                launch()
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    finally:
+        if owned:
+            await client.aclose()
+
+
+async def fetch_medusa_catalog_async(
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+) -> list:
+    """Collects every product of the catalog into one list."""
+    products = []
+    async for page in iter_catalog_pages(page_size, concurrency, retries):
+        products.extend(page.get("products", []))
+    return products
+
+
+def fetch_medusa_catalog(
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+):
     """
     Queries the Medusa store API to get all available products.
     Returns a list of products.
     """
     try:
-        # Note: In production, pagination and proper API-key authentication
-        # may be required if not using the public /store endpoint.
-        response = httpx.get(MEDUSA_API_URL)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("products", [])
+        return asyncio.run(fetch_medusa_catalog_async(page_size, concurrency, retries))
     except Exception as e:
         print(f"Failed to fetch catalog from Medusa: {e}", file=sys.stderr)
         return []
 
-def generate_index_catalog_csv(products, output_path="catalog.csv"):
+def variant_row(product: dict, variant: dict) -> list:
+    """Maps one Medusa variant to an index catalog row."""
+    title = product.get("title", "Unknown Product")
+    sku = variant.get("sku", "UNKNOWN_SKU")
+
+    # Prices are usually handled in pricing rules, but if included in Index:
+    # Medusa v2 stores amounts in major units (7 means 7.00), like calculated_amount
+    prices = variant.get("prices", [])
+    unit_price = prices[0].get("amount") if prices else 0.00
+    currency = prices[0].get("currency_code", "usd").upper() if prices else "USD"
+
+    return [
+        sku,                    # Supplier Part ID
+        "",                     # Manufacturer Part ID (Optional)
+        "",                     # Manufacturer Name (Optional)
+        title,                  # Item Description
+        unit_price,             # Unit Price
+        "EA",                   # Unit of Measure (Each)
+        currency,               # Currency
+        "1",                    # Lead Time (Days)
+    ]
+
+def iter_variants(products) -> Iterator[tuple[dict, dict]]:
+    """
+    Products in Medusa have variants (which have the SKUs and prices).
+    We typically export the variants as indexable items.
+    """
+    for product in products:
+        for variant in product.get("variants", []):
+            yield product, variant
+
+def iter_variant_rows(products) -> Iterator[list]:
+    for product, variant in iter_variants(products):
+        yield variant_row(product, variant)
+
+def generate_index_catalog_csv(products, output_path="catalog.csv", compression="none"):
     """
     Generates an RFC4180-compliant CSV mapping Medusa products
     to standard B2B/cXML Index Catalog formats.
     """
-    # Standard minimal CIF/CSV headers for procurement systems
-    headers = [
-        "Supplier Part ID", # Maps to SKU
-        "Manufacturer Part ID",
-        "Manufacturer Name",
-        "Item Description", # Title/Description
-        "Unit Price",
-        "Unit of Measure", # Usually EA (Each)
-        "Currency",
-        "Lead Time"
-    ]
-
-    with open(output_path, mode='w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(headers)
-
-        for product in products:
-            title = product.get("title", "Unknown Product")
-            
-            # Products in Medusa have variants (which have the SKUs and prices).
-            # We typically export the variants as indexable items.
-            for variant in product.get("variants", []):
-                sku = variant.get("sku", "UNKNOWN_SKU")
-                
-                # Prices are usually handled in pricing rules, but if included in Index:
-                prices = variant.get("prices", [])
-                unit_price = (prices[0].get("amount") / 100) if prices else 0.00
-                currency = prices[0].get("currency_code", "usd").upper() if prices else "USD"
-
-                writer.writerow([
-                    sku,                    # Supplier Part ID
-                    "",                     # Manufacturer Part ID (Optional)
-                    "",                     # Manufacturer Name (Optional)
-                    title,                  # Item Description
-                    unit_price,             # Unit Price
-                    "EA",                   # Unit of Measure (Each)
-                    currency,               # Currency
-                    "1",                    # Lead Time (Days)
-                ])
+    writer = CSVCatalogWriter(output_path, compression)
+    try:
+        for row in iter_variant_rows(products):
+            writer.write_row(row)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit()
 
     print(f"Catalog successfully generated at {output_path}")
 
+
+class ExportProgress:
+    """Prints rows, pages and rows/second to stderr at most every `interval` seconds."""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self.rows = 0
+        self.pages = 0
+        self.total_pages = None
+
+    def update(self, rows: int, page: dict, page_size: int) -> None:
+        self.rows += rows
+        self.pages += 1
+        if self.total_pages is None and "count" in page:
+            self.total_pages = max(1, -(-page["count"] // page_size))
+        now = time.monotonic()
+        if self.interval and now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        pages = f"{self.pages}/{self.total_pages}" if self.total_pages else str(self.pages)
+        print(f"  {self.rows:,} rows, {pages} pages, {elapsed:.1f}s ({self.rows / elapsed:,.0f} rows/s)", file=sys.stderr)
+
+
+class CatalogState:
+    """
+    What the last export sent to the procurement network: the highest product
+    `updated_at` seen (the watermark, taken from Medusa's clock so local clock
+    skew does not matter) and, per variant id, its product id, SKU and a hash
+    of its catalog row.
+    """
+
+    VERSION = 1
+
+    def __init__(self, watermark: str | None = None, variants: dict | None = None):
+        self.watermark = watermark
+        self.variants: dict[str, list] = variants or {}  # variant_id -> [product_id, sku, row_hash]
+
+    @staticmethod
+    def row_hash(row: list) -> str:
+        return hashlib.sha1(json.dumps(row, separators=(",", ":")).encode()).hexdigest()
+
+    @classmethod
+    def load(cls, path: str) -> "CatalogState | None":
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get("version") != cls.VERSION:
+            return None
+        return cls(data.get("watermark"), data.get("variants"))
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "watermark": self.watermark, "variants": self.variants}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def see_product(self, product: dict) -> None:
+        updated_at = product.get("updated_at")
+        if updated_at and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def variants_by_product(self) -> dict[str, set]:
+        by_product: dict[str, set] = {}
+        for variant_id, (product_id, _, _) in self.variants.items():
+            by_product.setdefault(product_id, set()).add(variant_id)
+        return by_product
+
+
+async def export_index_catalog(
+    output_path: str = "index_catalog.csv",
+    formats: Iterable[str] = ("csv",),
+    compression: str = "none",
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    progress_interval: float = 5.0,
+    state_path: str | None = None,
+) -> tuple[ExportProgress, list[str]]:
+    """
+    Streams the catalog straight from Medusa pages to every requested format
+    (see catalog_writers.WRITERS): each page is flattened into variant rows
+    and written as soon as it arrives, while the next pages are still being
+    fetched. Memory stays flat regardless of catalog size, and Medusa is read
+    once however many formats are produced. Files are only renamed into
+    place once the export is complete.
+
+    With `state_path`, a fresh CatalogState is recorded alongside (a full
+    resync), so later runs can export deltas against it.
+
+    Rows are flattened, encoded and compressed in a worker thread, one page
+    at a time, so an export running inside the middleware does not block its
+    event loop.
+    Returns the progress counters and the paths written.
+    """
+    progress = ExportProgress(progress_interval)
+    state = CatalogState() if state_path else None
+
+    def write_page(products: list) -> int:
+        rows = 0
+        for product, variant in iter_variants(products):
+            row = variant_row(product, variant)
+            writer.write_row(row)
+            rows += 1
+            if state is not None:
+                state.variants[variant.get("id")] = [product.get("id"), row[0], CatalogState.row_hash(row)]
+        if state is not None:
+            for product in products:
+                state.see_product(product)
+        return rows
+
+    writer = await asyncio.to_thread(MultiWriter.open, output_path, formats, compression)
+    write: asyncio.Future | None = None
+    try:
+        async for page in iter_catalog_pages(page_size, concurrency, retries):
+            write = asyncio.ensure_future(asyncio.to_thread(write_page, page.get("products", [])))
+            await asyncio.wait({write})
+            progress.update(write.result(), page, page_size)
+    except BaseException:
+        # A cancelled export must let the thread finish its page before the
+        # files are removed under it
+        if write is not None and not write.done():
+            await asyncio.wait({write})
+        writer.discard()
+        raise
+    await asyncio.to_thread(writer.commit)
+    if state is not None:
+        await asyncio.to_thread(state.save, state_path)
+    return progress, writer.paths
+
+
+async def export_index_catalog_csv(
+    output_path: str = "index_catalog.csv",
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    progress_interval: float = 5.0,
+    state_path: str | None = None,
+) -> ExportProgress:
+    """CSV-only `export_index_catalog`."""
+    progress, _ = await export_index_catalog(
+        output_path, ("csv",), "none", page_size, concurrency, retries, progress_interval, state_path,
+    )
+    return progress
+
+
+# Delta catalogs carry the change type in front of the usual columns
+DELTA_HEADERS = ["Change Type"] + CATALOG_HEADERS
+CHANGE_ADDED, CHANGE_CHANGED, CHANGE_DELETED = "added", "changed", "deleted"
+
+
+async def _live_product_ids(page_size: int, concurrency: int, retries: int) -> set:
+    """Lightweight scan of every product id, used to detect deleted products."""
+    ids = set()
+    async for page in iter_catalog_pages(page_size, concurrency, retries, {"fields": "id"}):
+        ids.update(product["id"] for product in page.get("products", []))
+    return ids
+
+
+async def export_delta_catalog_csv(
+    output_path: str = "index_catalog_delta.csv",
+    state_path: str = DEFAULT_STATE_PATH,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    progress_interval: float = 5.0,
+    compression: str = "none",
+) -> dict:
+    """
+    Writes only the rows that changed since the export recorded in
+    `state_path`:
+
+    - Medusa is asked for products with `updated_at` at or after the
+      watermark; their variants are compared by row hash against the state
+      and written as added or changed. Re-fetching products at the watermark
+      itself is harmless, as unchanged rows are skipped.
+    - Variants that disappeared from a changed product, and all variants of
+      products missing from an id-only scan of the catalog, are written as
+      deleted.
+
+    The state is only updated once the delta file is in place, so a failed
+    run can simply be repeated. Changes that do not touch the product's
+    `updated_at` (e.g. price list edits) are picked up by a full resync.
+    Returns counts per change type.
+    """
+    state = CatalogState.load(state_path)
+    if state is None or state.watermark is None:
+        raise FileNotFoundError(f"No usable catalog state at {state_path}; run a full export first")
+
+    counts = {CHANGE_ADDED: 0, CHANGE_CHANGED: 0, CHANGE_DELETED: 0}
+    progress = ExportProgress(progress_interval)
+    by_product = state.variants_by_product()
+
+    def delete(variant_id: str) -> None:
+        _, sku, _ = state.variants.pop(variant_id)
+        writer.write_row([CHANGE_DELETED, sku] + [""] * (len(CATALOG_HEADERS) - 1))
+        counts[CHANGE_DELETED] += 1
+
+    writer = CSVCatalogWriter(output_path + COMPRESSIONS[compression], compression, headers=DELTA_HEADERS)
+    try:
+        since = {"updated_at[$gte]": state.watermark}
+        async for page in iter_catalog_pages(page_size, concurrency, retries, since):
+            rows = 0
+            for product in page.get("products", []):
+                state.see_product(product)
+                product_id = product.get("id")
+                previous = by_product.pop(product_id, set())
+                for _, variant in iter_variants([product]):
+                    variant_id = variant.get("id")
+                    row = variant_row(product, variant)
+                    row_hash = CatalogState.row_hash(row)
+                    known = state.variants.get(variant_id)
+                    previous.discard(variant_id)
+                    if known is not None and known[2] == row_hash:
+                        continue
+                    change = CHANGE_ADDED if known is None else CHANGE_CHANGED
+                    writer.write_row([change] + row)
+                    counts[change] += 1
+                    rows += 1
+                    state.variants[variant_id] = [product_id, row[0], row_hash]
+                for variant_id in previous:
+                    delete(variant_id)
+                    rows += 1
+            progress.update(rows, page, page_size)
+
+        if by_product:
+            live = await _live_product_ids(page_size, concurrency, retries)
+            for product_id, variant_ids in by_product.items():
+                if product_id not in live:
+                    for variant_id in variant_ids:
+                        delete(variant_id)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit()
+    state.save(state_path)
+    return counts
+
+# ── Per-tenant priced catalogs ───────────────────────────────────────────────
+
+# (variant_id, row) for every variant, set once per render worker process
+_tenant_structure: list[tuple[str, list]] = []
+
+
+def _init_render_worker(structure: list[tuple[str, list]]) -> None:
+    global _tenant_structure
+    _tenant_structure = structure
+
+
+def _render_tenant_catalog(output_path: str, formats: list[str], compression: str, prices: dict) -> tuple[list[str], int, int]:
+    """
+    Runs in a render worker: writes the shared structure with one tenant's
+    prices. Variants without a price for the tenant's region are left out.
+    Returns the paths written, rows written and rows skipped.
+    """
+    writer = MultiWriter.open(output_path, formats, compression)
+    written = skipped = 0
+    try:
+        for variant_id, row in _tenant_structure:
+            price = prices.get(variant_id)
+            if price is None:
+                skipped += 1
+                continue
+            sku, mfr_part_id, mfr_name, description, _, uom, _, lead_time = row
+            amount, currency = price
+            writer.write_row([sku, mfr_part_id, mfr_name, description, amount, uom, currency, lead_time])
+            written += 1
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit()
+    return writer.paths, written, skipped
+
+
+def parse_tenant(value: str) -> dict:
+    """`COMPANY_ID[:REGION]` → {"company_id", "region"}."""
+    company_id, _, region = value.partition(":")
+    return {"company_id": company_id, "region": region or DEFAULT_REGION}
+
+
+def load_tenants(path: str) -> list[dict]:
+    """Reads a JSON list of {"company_id": ..., "region": ...} objects (region optional)."""
+    with open(path, encoding="utf-8") as f:
+        tenants = json.load(f)
+    return [{"company_id": str(t["company_id"]), "region": t.get("region") or DEFAULT_REGION} for t in tenants]
+
+
+async def _resolve_regions(client: httpx.AsyncClient, regions: set) -> dict:
+    """Maps each region (Medusa region id or ISO country code) to a region id."""
+    resolved = {region: region for region in regions if region.startswith("reg_")}
+    if len(resolved) == len(regions):
+        return resolved
+    url = MEDUSA_API_URL.rsplit("/products", 1)[0] + "/regions"
+    async with medusa_slot(tenant=SYSTEM_TENANT):
+        response = await client.get(url, params={"limit": 1000, "fields": "id,*countries"})
+    response.raise_for_status()
+    by_country = {
+        country.get("iso_2", "").lower(): region["id"]
+        for region in response.json().get("regions", [])
+        for country in region.get("countries") or []
+    }
+    for region in regions - set(resolved):
+        if region.lower() in by_country:
+            resolved[region] = by_country[region.lower()]
+    return resolved
+
+
+async def _fetch_tenant_prices(
+    client: httpx.AsyncClient, region_id: str, token: str | None, page_size: int, concurrency: int, retries: int,
+) -> dict:
+    """
+    Calculated price per variant id in one region (major units, as Medusa
+    returns them): for the tenant's customer, and so its customer group price
+    lists, when `token` is given; the region's prices otherwise. Only ids and
+    prices are requested, so these scans are far lighter than the structure
+    fetch.
+    """
+    prices = {}
+    filters = {"region_id": region_id, "fields": "id,variants.id,*variants.calculated_price"}
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    async for page in iter_catalog_pages(page_size, concurrency, retries, filters, headers, client):
+        for _, variant in iter_variants(page.get("products", [])):
+            calculated = variant.get("calculated_price") or {}
+            amount = calculated.get("calculated_amount")
+            if amount is not None:
+                prices[variant["id"]] = (amount, (calculated.get("currency_code") or "").upper())
+    return prices
+
+
+def tenant_output_path(output_dir: str, tenant: dict) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{tenant['company_id']}-{tenant['region']}")
+    return os.path.join(output_dir, f"{name}.csv")
+
+
+async def export_tenant_catalogs(
+    tenants: list[dict],
+    output_dir: str = "catalogs",
+    formats: Iterable[str] = ("csv",),
+    compression: str = "none",
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    tenant_concurrency: int = DEFAULT_TENANT_CONCURRENCY,
+    render_workers: int = DEFAULT_RENDER_WORKERS,
+) -> list[dict]:
+    """
+    Writes one priced catalog per tenant (buyer org + region):
+
+    1. The product structure (titles, SKUs, ...) is fetched once.
+    2. Each tenant logs in as its punchout customer (same deterministic
+       credentials as the punchout setup flow) and its calculated prices
+       are fetched for its region, `tenant_concurrency` tenants at a time
+       over one shared connection pool. Nothing is provisioned: a buyer org
+       that never punched out has no customer (nor customer group) yet and
+       gets the region's prices, reported as `price_context` "region".
+    3. Each tenant's files are rendered on a process pool whose workers
+       received the structure once at start-up, so only the price map is
+       sent per tenant. Fetching the next tenants overlaps with rendering.
+
+    Returns one result dict per tenant; a failing tenant does not stop the
+    others.
+    """
+    from medusa_client import close_medusa_client, open_medusa_client
+    from provisioning import login_b2b_customer
+
+    formats = list(formats)
+    os.makedirs(output_dir, exist_ok=True)
+
+    structure = []
+    async for page in iter_catalog_pages(page_size, concurrency, retries):
+        for product, variant in iter_variants(page.get("products", [])):
+            structure.append((variant.get("id"), variant_row(product, variant)))
+    print(f"Fetched catalog structure: {len(structure):,} variants", file=sys.stderr)
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(tenant_concurrency)
+    await open_medusa_client()
+    try:
+        async with _catalog_client(concurrency * tenant_concurrency) as client:
+            region_ids = await _resolve_regions(client, {tenant["region"] for tenant in tenants})
+
+            with ProcessPoolExecutor(max_workers=render_workers, initializer=_init_render_worker,
+                                     initargs=(structure,)) as pool:
+
+                async def export_one(tenant: dict) -> dict:
+                    result = {**tenant, "paths": [], "rows": 0, "skipped": 0, "price_context": None, "error": None}
+                    try:
+                        region_id = region_ids.get(tenant["region"])
+                        if region_id is None:
+                            raise ValueError(f"unknown region {tenant['region']!r}")
+                        async with slots:
+                            token = await login_b2b_customer(tenant["company_id"])
+                            result["price_context"] = "customer" if token else "region"
+                            prices = await _fetch_tenant_prices(client, region_id, token, page_size, concurrency, retries)
+                        result["paths"], result["rows"], result["skipped"] = await loop.run_in_executor(
+                            pool, _render_tenant_catalog, tenant_output_path(output_dir, tenant), formats, compression, prices,
+                        )
+                    except Exception as e:
+                        result["error"] = str(e)
+                    return result
+
+                return await asyncio.gather(*(export_one(tenant) for tenant in tenants))
+    finally:
+        await close_medusa_client()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the Medusa catalog as procurement index catalogs.")
+    parser.add_argument("--output", default="index_catalog.csv",
+                        help="CSV file to write; other formats use the same name with their own extension (default: %(default)s)")
+    parser.add_argument("--format", dest="formats", default="csv",
+                        type=lambda value: [fmt.strip() for fmt in value.split(",") if fmt.strip()],
+                        help=f"comma-separated formats written from the same pass: {', '.join(WRITERS)} (default: csv)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSIONS), default="none",
+                        help="compress output files on the fly (default: %(default)s)")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="products per Medusa page (default: %(default)s)")
+    parser.add_argument("--concurrency", "--workers", type=int, default=DEFAULT_CONCURRENCY,
+                        help="pages fetched in parallel (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="retries per failed page (default: %(default)s)")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="seconds between progress lines, 0 to disable (default: %(default)s)")
+    parser.add_argument("--state-file", default=None,
+                        help=f"record export state here so later runs can use --incremental (e.g. {DEFAULT_STATE_PATH})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="write only rows added, changed or deleted since the last export recorded in --state-file; "
+                             "falls back to a full export when there is no state yet")
+    parser.add_argument("--delta-output", default="index_catalog_delta.csv",
+                        help="delta CSV written by --incremental (default: %(default)s)")
+    parser.add_argument("--tenant", dest="tenants", action="append", type=parse_tenant, default=[],
+                        metavar="COMPANY_ID[:REGION]",
+                        help=f"write a priced catalog for this buyer org and region (repeatable; region defaults to {DEFAULT_REGION})")
+    parser.add_argument("--tenants-file", help='JSON list of {"company_id": ..., "region": ...} tenants')
+    parser.add_argument("--tenant-output-dir", default="catalogs",
+                        help="directory for per-tenant catalogs (default: %(default)s)")
+    parser.add_argument("--tenant-concurrency", type=int, default=DEFAULT_TENANT_CONCURRENCY,
+                        help="tenants whose prices are fetched at the same time (default: %(default)s)")
+    parser.add_argument("--render-workers", type=int, default=DEFAULT_RENDER_WORKERS,
+                        help="processes rendering tenant catalogs (default: %(default)s)")
+    args = parser.parse_args(argv)
+    unknown = [fmt for fmt in args.formats if fmt not in WRITERS]
+    if unknown or not args.formats:
+        parser.error(f"--format must be a comma-separated list of {', '.join(WRITERS)}")
+    if args.incremental and not args.state_file:
+        args.state_file = DEFAULT_STATE_PATH
+    if args.tenants_file:
+        args.tenants += load_tenants(args.tenants_file)
+    return args
+
 if __name__ == "__main__":
-    print("Fetching active catalog from Medusa API...")
-    medusa_products = fetch_medusa_catalog()
-    
-    if medusa_products:
-        print(f"Found {len(medusa_products)} base products.")
-        generate_index_catalog_csv(medusa_products, "index_catalog.csv")
+    args = parse_args()
+
+    if args.tenants:
+        print(f"Exporting priced catalogs for {len(args.tenants)} tenants from Medusa API...")
+        started = time.monotonic()
+        try:
+            results = asyncio.run(export_tenant_catalogs(
+                args.tenants, args.tenant_output_dir, args.formats, args.compress, args.page_size,
+                args.concurrency, args.retries, args.tenant_concurrency, args.render_workers,
+            ))
+        except Exception as e:
+            print(f"Failed to export tenant catalogs from Medusa: {e}", file=sys.stderr)
+            sys.exit(1)
+        failed = [result for result in results if result["error"]]
+        for result in failed:
+            print(f"  {result['company_id']} ({result['region']}): {result['error']}", file=sys.stderr)
+        print(f"Generated {len(results) - len(failed)}/{len(results)} tenant catalogs in "
+              f"{args.tenant_output_dir} ({time.monotonic() - started:.1f}s)")
+        sys.exit(1 if failed else 0)
+
+    if args.incremental and CatalogState.load(args.state_file) is not None:
+        print("Exporting catalog changes from Medusa API...")
+        try:
+            counts = asyncio.run(export_delta_catalog_csv(
+                args.delta_output, args.state_file, args.page_size, args.concurrency, args.retries,
+                args.progress_interval, args.compress,
+            ))
+        except Exception as e:
+            print(f"Failed to export catalog delta from Medusa: {e}", file=sys.stderr)
+            sys.exit(1)
+        summary = ", ".join(f"{count} {change}" for change, count in counts.items())
+        print(f"Delta catalog successfully generated at {args.delta_output}{COMPRESSIONS[args.compress]} ({summary})")
+        sys.exit(0)
+
+    if args.incremental:
+        print(f"No catalog state at {args.state_file}; running a full export first.")
+    print("Streaming active catalog from Medusa API...")
+    try:
+        progress, paths = asyncio.run(export_index_catalog(
+            args.output, args.formats, args.compress, args.page_size, args.concurrency, args.retries,
+            args.progress_interval, args.state_file,
+        ))
+    except Exception as e:
+        print(f"Failed to export catalog from Medusa: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if progress.rows:
+        progress.report()
+        print(f"Catalog successfully generated at {', '.join(paths)}")
     else:
-        print("No products found or failed to connect to Medusa API.")
+        print("No products found in the Medusa catalog.")
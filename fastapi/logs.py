@@ -0,0 +1,223 @@
+"""
+Structured JSON logging that never blocks the event loop.
+
+Modules log through `get_logger(__name__)` with the standard `logging` API;
+keyword context goes in `extra={...}` and becomes top-level JSON fields.
+Records are put on a bounded queue (dropped, and counted, when it is full)
+and formatted and written to stdout by a background thread.
+
+`RequestContextMiddleware` gives every HTTP request a correlation id
+(`X-Request-ID`, taken from the caller when present) that is added to every
+record logged while serving it, together with the route and the punchout
+session id once the route has bound it with `bind_session_id()`.
+
+Per-route tuning:
+- LOG_ROUTE_LEVELS="/api/punchout/setup=DEBUG,/api/punchout/order=WARNING"
+- LOG_ROUTE_SAMPLING="/api/punchout/setup=0.1" keeps the INFO/DEBUG records
+  of 10% of the requests (all or nothing per request); warnings and errors
+  are always kept.
+
+Tokens never reach the output: fields named like a secret are replaced, and
+JWTs or Bearer credentials inside messages and values are masked.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from metrics import LOG_RECORDS_DROPPED
+
+
+def _parse_route_map(value: str, convert) -> dict:
+    routes = {}
+    for item in value.split(","):
+        route, sep, setting = item.strip().rpartition("=")
+        if sep and route:
+            routes[route.strip()] = convert(setting.strip())
+    return routes
+
+
+def _level(name: str) -> int:
+    return logging.getLevelName(name.upper()) if not name.isdigit() else int(name)
+
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+LOG_LEVEL = _level(os.getenv("LOG_LEVEL", "INFO"))
+LOG_ROUTE_LEVELS = _parse_route_map(os.getenv("LOG_ROUTE_LEVELS", ""), _level)
+LOG_ROUTE_SAMPLING = _parse_route_map(os.getenv("LOG_ROUTE_SAMPLING", ""), float)
+# Records waiting for the writer thread; beyond this they are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "punchout"
+
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+session_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("session_id", default=None)
+route_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("route", default=None)
+_sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=True)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """`get_logger(__name__)` → the `punchout.<module>` logger."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def bind_session_id(session_id: str | None) -> None:
+    """Adds the punchout session id to the records of the current request."""
+    session_id_var.set(session_id)
+
+
+# ── Redaction ─────────────────────────────────────────────────────────────────
+
+REDACTED = "[REDACTED]"
+_SECRET_KEY = re.compile(r"token|jwt|password|secret|authorization|api_?key", re.IGNORECASE)
+_SECRET_TEXT = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*|(?<=Bearer )[\w.~+/=-]+", re.IGNORECASE)
+
+
+def redact(value):
+    if isinstance(value, str):
+        return _SECRET_TEXT.sub(REDACTED, value)
+    if isinstance(value, dict):
+        return {key: REDACTED if _SECRET_KEY.search(str(key)) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+# ── Filtering (caller side) and formatting (writer thread) ───────────────────
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class _ContextFilter(logging.Filter):
+    """Applies the route's level and sampling, and stamps the correlation ids."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        route = route_var.get()
+        if record.levelno < LOG_ROUTE_LEVELS.get(route, LOG_LEVEL):
+            return False
+        if record.levelno < logging.WARNING and not _sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        record.route = route
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(redact(entry), default=str, ensure_ascii=False)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message here (args may be mutated later) but leave the
+        # JSON encoding to the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def configure_logging() -> None:
+    """Installs the queue handler on the `punchout` loggers and starts the writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+    records: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(_ContextFilter())
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers[:] = [handler]
+    logger.setLevel(min([LOG_LEVEL, *LOG_ROUTE_LEVELS.values()]))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Flushes the queue and stops the writer thread. Called on shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# ── Request correlation ───────────────────────────────────────────────────────
+
+_REQUEST_ID = re.compile(r"[\w.:-]{1,128}")
+
+
+class RequestContextMiddleware:
+    """ASGI middleware setting the request id, route and sampling decision for each request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                request_id = candidate if _REQUEST_ID.fullmatch(candidate) else None
+                break
+        request_id = request_id or uuid.uuid4().hex
+        route = scope["path"]
+        rate = LOG_ROUTE_SAMPLING.get(route)
+        tokens = (
+            (request_id_var, request_id_var.set(request_id)),
+            (session_id_var, session_id_var.set(None)),
+            (route_var, route_var.set(route)),
+            (_sampled_var, _sampled_var.set(rate is None or random.random() < rate)),
+        )
+
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
@@ -1,108 +1,157 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import Response, HTMLResponse
-import defusedxml.ElementTree as ET
-from pydantic import BaseModel
-from typing import List
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import Response, HTMLResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ValidationError
+from typing import List, Literal
+from contextlib import asynccontextmanager
+import asyncio
+import hmac
+import json
 import jwt
-import httpx
+import math
 import os
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from cart_codec import (
+    CartJSONResponse,
+    CartReturnRecord,
+    PunchoutCartReturn,
+    decode_cart_return,
+    validate_cart_return,
+)
+from cxml_parser import parse_setup_request, CXMLParseError
+from cxml_render import iter_order_message, render_order_message
+from catalog_artifact import (
+    CATALOG_ARTIFACT_FORMATS,
+    MEDIA_TYPE as CATALOG_MEDIA_TYPE,
+    RangeNotSatisfiable,
+    artifact_info,
+    artifact_path,
+    byte_range,
+    is_not_modified,
+    iter_file,
+    start_catalog_refresh,
+    stop_catalog_refresh,
+    trigger_regeneration,
+)
+from sku_index import (
+    invalidate_products,
+    resolve_sku,
+    sku_index_ready,
+    sku_index_stats,
+    start_sku_index,
+    stop_sku_index,
+)
+from enrichment import enrich_items, enrichment_cache_stats
+from admission import MEDUSA_ADMISSION_TIMEOUT, Overloaded, bind_tenant, rate_limit
+from logs import RequestContextMiddleware, bind_session_id, configure_logging, get_logger, stop_logging
+from profiling import PROFILE_ENABLED, ProfilingMiddleware
+from metrics import (
+    ADMISSION_REJECTIONS,
+    CART_LINES,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    ORDER_STAGE_SECONDS,
+    SETUP_ANONYMOUS_FALLBACK,
+    SETUP_STAGE_SECONDS,
+    render_metrics,
+)
+from batch import InvalidLine, iter_ndjson, map_as_completed, run_in_pool, shutdown_pool
+from medusa_client import open_medusa_client, close_medusa_client
+from provisioning import (
+    cached_b2b_customer_token,
+    get_b2b_customer_token,
+    start_session_provisioning,
+    token_cache_stats,
+    wait_for_session_provisioning,
+)
+from resilience import MedusaUnavailable, latency_budget
+from session_store import (
+    PROVISIONING_PENDING,
+    init_session_store,
+    close_session_store,
+    save_session,
+    get_session,
+    session_cache_stats,
+    is_shared as session_store_is_shared,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Medusa client per worker, reused by every request.
+    await open_medusa_client()
+    await init_session_store()
+    start_catalog_refresh()
+    start_sku_index()
+    try:
+        yield
+    finally:
+        await stop_sku_index()
+        await stop_catalog_refresh()
+        await close_session_store()
+        await close_medusa_client()
+        shutdown_pool()
+        stop_logging()
+
+
+app = FastAPI(
+    title="Punchout Middleware",
+    description="FastAPI middleware for mapping cXML to MedusaJS",
+    lifespan=lifespan,
+)
+# Added first so it runs inside RequestContextMiddleware and sees the request id
+if PROFILE_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestContextMiddleware)
 
-app = FastAPI(title="Punchout Middleware", description="FastAPI middleware for mapping cXML to MedusaJS")
+configure_logging()
+logger = get_logger(__name__)
 
 # ── Configuration (set via Docker Compose env vars) ──────────────────────────
 JWT_SECRET = os.getenv("JWT_SECRET", "supersecret")
 STOREFRONT_PUBLIC_URL = os.getenv("STOREFRONT_PUBLIC_URL", "http://localhost:8002")
-MEDUSA_BACKEND_URL = os.getenv("MEDUSA_BACKEND_URL", "http://medusa:9000")
-MEDUSA_PUBLISHABLE_KEY = os.getenv(
-    "NEXT_PUBLIC_MEDUSA_PUBLISHABLE_KEY",
-    "pk_78469e8fbf9368a553e606bb564cc5180c1af4b2154d28ccaba15b44131b30a2",
-)
+# Put only an opaque session reference in the StartPage token when possible
+PUNCHOUT_COMPACT_TOKENS = os.getenv("PUNCHOUT_COMPACT_TOKENS", "true").lower() in ("1", "true", "yes")
+# Shared secret Medusa's subscribers send in X-Punchout-Webhook-Secret; unset disables the webhooks
+PUNCHOUT_WEBHOOK_SECRET = os.getenv("PUNCHOUT_WEBHOOK_SECRET", "")
+# Max seconds spent provisioning the Medusa session before answering the setup
+# anyway (anonymous browsing); keep well under the procurement system's timeout
+PUNCHOUT_SETUP_BUDGET = float(os.getenv("PUNCHOUT_SETUP_BUDGET", "5"))
+# Answer setups for buyer orgs without a cached Medusa token right away and
+# provision in the background; needs compact tokens and a shared session store
+PUNCHOUT_ASYNC_PROVISIONING = os.getenv("PUNCHOUT_ASYNC_PROVISIONING", "false").lower() in ("1", "true", "yes")
+# Upper bound for the `wait` a redemption may ask for while provisioning runs
+PUNCHOUT_REDEEM_MAX_WAIT = float(os.getenv("PUNCHOUT_REDEEM_MAX_WAIT", "10"))
 
-# ── Medusa API helpers ────────────────────────────────────────────────────────
+@app.get("/")
+def read_root():
+    return {"status": "ok", "service": "Punchout Middleware"}
 
-def _medusa_headers() -> dict:
-    """Headers required for all Medusa Store API calls."""
+def _collect_cache_stats() -> dict:
+    # Runs in a thread: the SQLite backend counts its rows with a query
     return {
-        "Content-Type": "application/json",
-        "x-publishable-api-key": MEDUSA_PUBLISHABLE_KEY,
+        "pid": os.getpid(),
+        "medusa_tokens": token_cache_stats(),
+        "punchout_sessions": session_cache_stats(),
+        "sku_index": sku_index_stats(),
+        "variant_details": enrichment_cache_stats(),
     }
 
+@app.get("/api/punchout/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of this worker's caches (each worker reports its own)."""
+    return await asyncio.to_thread(_collect_cache_stats)
 
-async def get_or_create_b2b_customer(company_id: str) -> str | None:
-    """
-    Looks up an existing Punchout B2B customer in Medusa by the synthetic email
-    `punchout_<company_id>@punchout.local`. If it doesn't exist yet, creates it.
-
-    Returns the Medusa JWT token (Bearer) for that customer, or None on failure.
-    The approach: register the customer with a deterministic password derived from
-    the shared JWT_SECRET so FastAPI can always re-authenticate without storing state.
-    """
-    email = f"punchout_{company_id}@punchout.local"
-    # Deterministic password — never exposed to humans, only used internally.
-    password = jwt.encode({"sub": company_id}, JWT_SECRET, algorithm="HS256")[:32]
-
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        # ── 1. Attempt login first (most common path) ──────────────────────
-        login_res = await client.post(
-            f"{MEDUSA_BACKEND_URL}/auth/customer/emailpass",
-            json={"email": email, "password": password},
-            headers=_medusa_headers(),
-        )
-        if login_res.status_code == 200:
-            medusa_token = login_res.json().get("token")
-            print(f"[Punchout] Authenticated existing B2B customer: {email}")
-            return medusa_token
-
-        # ── 2. Customer doesn't exist → register then create ───────────────
-        if login_res.status_code in (401, 404):
-            # Step 2a: Register auth identity
-            reg_res = await client.post(
-                f"{MEDUSA_BACKEND_URL}/auth/customer/emailpass/register",
-                json={"email": email, "password": password},
-                headers=_medusa_headers(),
-            )
-            if reg_res.status_code not in (200, 201):
-                print(f"[Punchout] Failed to register B2B customer auth: {reg_res.text}")
-                return None
-
-            reg_token = reg_res.json().get("token")
-
-            # Step 2b: Create the customer profile
-            create_res = await client.post(
-                f"{MEDUSA_BACKEND_URL}/store/customers",
-                json={
-                    "email": email,
-                    "first_name": company_id,
-                    "last_name": "(Punchout B2B)",
-                    "company_name": company_id,
-                },
-                headers={
-                    **_medusa_headers(),
-                    "Authorization": f"Bearer {reg_token}",
-                },
-            )
-            if create_res.status_code not in (200, 201):
-                print(f"[Punchout] Failed to create B2B customer profile: {create_res.text}")
-
-            # Step 2c: Login to get a permanent session token
-            login_res2 = await client.post(
-                f"{MEDUSA_BACKEND_URL}/auth/customer/emailpass",
-                json={"email": email, "password": password},
-                headers=_medusa_headers(),
-            )
-            if login_res2.status_code == 200:
-                medusa_token = login_res2.json().get("token")
-                print(f"[Punchout] Created and authenticated new B2B customer: {email}")
-                return medusa_token
-
-        print(f"[Punchout] Could not authenticate B2B customer. Medusa responded: {login_res.status_code}")
-        return None
-
-@app.get("/")
-def read_root():
-    return {"status": "ok", "service": "Punchout Middleware"}
+@app.get("/metrics")
+async def prometheus_metrics():
+    """This worker's metrics (stage latencies, Medusa responses, caches) for Prometheus."""
+    caches = await asyncio.to_thread(_collect_cache_stats)
+    caches.pop("pid")
+    # Rendered on the event loop, the only place metrics are updated from
+    return Response(content=render_metrics(caches), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/api/punchout/test", response_class=HTMLResponse)
 async def punchout_test_form():
@@ -765,6 +814,23 @@ async def punchout_test_form():
     </html>
     """
 
+def _cxml_status_response(code: int, text: str, message: str, retry_after: float) -> Response:
+    """A cXML Response carrying only an error Status, sent with the same HTTP status."""
+    response_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<cXML payloadID="{uuid.uuid4()}@middleware" timestamp="{datetime.now(timezone.utc).isoformat(timespec='seconds')}">
+    <Response>
+        <Status code="{code}" text="{text}">{message}</Status>
+    </Response>
+</cXML>
+"""
+    return Response(
+        content=response_xml,
+        media_type="application/xml",
+        status_code=code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
 @app.post("/api/punchout/setup")
 async def punchout_setup(request: Request):
     """
@@ -776,158 +842,405 @@ async def punchout_setup(request: Request):
     directly to the Product Detail Page (PDP).
     """
     try:
-        xml_data = await request.body()
-        # Parse XML securely to prevent XXE
-        root = ET.fromstring(xml_data)
-        
-        request_node = root.find("Request")
-        header_node = root.find("Header")
-        if request_node is None or header_node is None:
-            raise HTTPException(status_code=400, detail="Missing Request or Header node")
-            
-        setup_request = request_node.find("PunchOutSetupRequest")
-        if setup_request is None:
-            raise HTTPException(status_code=400, detail="Missing PunchOutSetupRequest node")
-            
-        # Extract B2B Identity (CustomerGroup / Company Name)
-        # e.g. <Header><From><Credential domain="NetworkId"><Identity>AcmeCorp</Identity>...
-        from_identity_node = header_node.find(".//From/Credential/Identity")
-        b2b_company_identity = from_identity_node.text if from_identity_node is not None else "generic_b2b_user"
-            
-        buyer_cookie_node = setup_request.find("BuyerCookie")
-        browser_form_post_node = setup_request.find("BrowserFormPost/URL")
-        
-        buyer_cookie = buyer_cookie_node.text if buyer_cookie_node is not None else "Unknown"
-        browser_form_post_url = browser_form_post_node.text if browser_form_post_node is not None else "Unknown"
-        
-        print(f"Extracted BuyerCookie: {buyer_cookie}")
-        print(f"Extracted BrowserFormPost URL: {browser_form_post_url}")
-        print(f"B2B CustomerGroup Identity: {b2b_company_identity}")
-
-        # Level 2 Punchout: Check for SelectedItem
-        selected_item_node = setup_request.find(".//SelectedItem/ItemID/SupplierPartID")
-        sku = selected_item_node.text if selected_item_node is not None else None
-
-        # ── Provision real Medusa B2B session ─────────────────────────────
-        session_id = str(uuid.uuid4())
-
-        # Call Medusa to find-or-create the B2B customer for this company identity.
-        # The returned token is a valid Medusa JWT the storefront can use directly.
-        medusa_jwt = await get_or_create_b2b_customer(b2b_company_identity)
-
-        if medusa_jwt:
-            print(f"[Punchout] Medusa B2B session provisioned for {b2b_company_identity}")
+        # Parse XML securely (defusedxml, prevents XXE); the body size is
+        # checked while it is read.
+        with SETUP_STAGE_SECONDS.time("parse"):
+            fields = await parse_setup_request(request.stream())
+    except CXMLParseError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    # Extract B2B Identity (CustomerGroup / Company Name)
+    # e.g. <Header><From><Credential domain="NetworkId"><Identity>AcmeCorp</Identity>...
+    b2b_company_identity = fields.from_identity or "generic_b2b_user"
+
+    buyer_cookie = fields.buyer_cookie if fields.buyer_cookie is not None else "Unknown"
+    browser_form_post_url = fields.browser_form_post_url if fields.browser_form_post_url is not None else "Unknown"
+
+    logger.info(
+        "PunchOutSetupRequest received",
+        extra={
+            "buyer_cookie": buyer_cookie,
+            "browser_form_post_url": browser_form_post_url,
+            "company_id": b2b_company_identity,
+            "operation": fields.operation,
+        },
+    )
+
+    # ── Admission control (per buyer org) ──────────────────────────────
+    # Answer a storm from one org right away instead of queueing it in
+    # front of Medusa; Medusa calls below are tagged with the org.
+    bind_tenant(b2b_company_identity)
+    retry_after = rate_limit(b2b_company_identity)
+    if retry_after:
+        ADMISSION_REJECTIONS.inc("rate_limited")
+        logger.warning("Setup rate limit exceeded", extra={"company_id": b2b_company_identity})
+        return _cxml_status_response(
+            429, "Too Many Requests", "Too many punchout sessions for this buyer organization", retry_after
+        )
+
+    # Level 2 Punchout: SelectedItem/ItemID/SupplierPartID, resolved to the
+    # product page through the in-memory SKU index. An unknown SKU falls back
+    # to Level 1 (store front page) instead of failing after the redirect;
+    # while the index is still loading the raw SKU is passed on as before.
+    sku = fields.supplier_part_id
+    product_handle = variant_id = None
+    if sku and sku_index_ready():
+        with SETUP_STAGE_SECONDS.time("sku_lookup"):
+            entry = resolve_sku(sku)
+        if entry is not None:
+            product_handle, variant_id = entry.handle, entry.variant_id
         else:
-            print(f"[Punchout] WARNING: Could not provision Medusa session for {b2b_company_identity}. User will browse anonymously.")
-
-        # ── Build & sign the Punchout JWT ──────────────────────────────────
-        # This JWT is short-lived (15 min). It carries:
-        #   - b2b_company_id: the identity for display / group resolution
-        #   - medusa_jwt: the real Medusa Bearer token the storefront sets as _medusa_jwt
-        #   - sku: only on Level 2 deep-links
-        #   - session_id / buyer_cookie_url: for cart return correlation
+            logger.info("Unknown Level 2 SupplierPartID; falling back to Level 1", extra={"sku": sku})
+            sku = None
+
+    # ── Provision real Medusa B2B session ─────────────────────────────
+    session_id = str(uuid.uuid4())
+    bind_session_id(session_id)
+
+    # Call Medusa to find-or-create the B2B customer for this company identity
+    # (cached per company; concurrent setups share one provisioning call).
+    # The returned token is a valid Medusa JWT the storefront can use directly.
+    # Every Medusa call shares PUNCHOUT_SETUP_BUDGET; the outer timeout also
+    # covers waiting on a provisioning call started by another request.
+    # In asynchronous mode a missing token is provisioned after the response,
+    # and the storefront picks it up when it redeems the compact token.
+    compact_token = PUNCHOUT_COMPACT_TOKENS and session_store_is_shared()
+    provisioning = None
+    fallback_reason = None
+    with SETUP_STAGE_SECONDS.time("provision"), latency_budget(PUNCHOUT_SETUP_BUDGET):
+        medusa_jwt = None
+        if PUNCHOUT_ASYNC_PROVISIONING and compact_token:
+            medusa_jwt = await cached_b2b_customer_token(b2b_company_identity)
+            if medusa_jwt is None:
+                provisioning = PROVISIONING_PENDING
+        if medusa_jwt is None and provisioning is None:
+            try:
+                medusa_jwt = await asyncio.wait_for(
+                    get_b2b_customer_token(b2b_company_identity), timeout=PUNCHOUT_SETUP_BUDGET
+                )
+                if not medusa_jwt:
+                    fallback_reason = "provisioning_failed"
+            except MedusaUnavailable as e:
+                medusa_jwt, fallback_reason = None, e.reason
+            except asyncio.TimeoutError:
+                medusa_jwt, fallback_reason = None, "budget_exceeded"
+            except Overloaded:
+                ADMISSION_REJECTIONS.inc("overloaded")
+                logger.warning("No Medusa capacity for setup", extra={"company_id": b2b_company_identity})
+                return _cxml_status_response(
+                    503, "Service Unavailable", "Too many punchout sessions in progress", MEDUSA_ADMISSION_TIMEOUT
+                )
+
+    if medusa_jwt:
+        logger.info("Medusa B2B session provisioned", extra={"company_id": b2b_company_identity})
+    elif provisioning == PROVISIONING_PENDING:
+        logger.info("Provisioning Medusa B2B session in the background", extra={"company_id": b2b_company_identity})
+    else:
+        SETUP_ANONYMOUS_FALLBACK.inc(fallback_reason)
+        logger.warning(
+            "Could not provision Medusa session; user will browse anonymously",
+            extra={"company_id": b2b_company_identity, "reason": fallback_reason},
+        )
+
+    # Keep the session server-side for redemption and cart return correlation.
+    session_data = {
+        "b2b_company_id": b2b_company_identity,
+        "medusa_jwt": medusa_jwt,          # may be None — storefront handles gracefully
+        "buyer_cookie": buyer_cookie,
+        "browser_form_post_url": browser_form_post_url,
+        "sku": sku,
+        "product_handle": product_handle,
+        "variant_id": variant_id,
+        "provisioning": provisioning,
+    }
+    with SETUP_STAGE_SECONDS.time("session_store"):
+        await save_session(session_id, session_data)
+    if provisioning == PROVISIONING_PENDING:
+        start_session_provisioning(session_id, session_data)
+
+    # ── Build & sign the Punchout JWT ──────────────────────────────────
+    # This JWT is short-lived (15 min). When every worker can read the
+    # session store it only carries an opaque `sid`, which the storefront
+    # redeems via /api/punchout/session/redeem — this keeps the StartPage
+    # URL short enough for procurement systems that truncate long URLs.
+    # Otherwise it carries the full session:
+    #   - b2b_company_id: the identity for display / group resolution
+    #   - medusa_jwt: the real Medusa Bearer token the storefront sets as _medusa_jwt
+    #   - sku / product_handle / variant_id: only on Level 2 deep-links
+    #   - session_id / buyer_cookie_url: for cart return correlation
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
+    if compact_token:
+        payload_data = {"sid": session_id, "exp": expires_at}
+    else:
         payload_data = {
             "b2b_company_id": b2b_company_identity,
-            "medusa_jwt": medusa_jwt,          # may be None — storefront handles gracefully
+            "medusa_jwt": medusa_jwt,
             "session_id": session_id,
             "sku": sku,
+            "product_handle": product_handle,
+            "variant_id": variant_id,
             "browser_form_post_url": browser_form_post_url,
-            "exp": datetime.now(timezone.utc) + timedelta(minutes=15),
+            "exp": expires_at,
         }
+    with SETUP_STAGE_SECONDS.time("jwt_sign"):
         auth_token = jwt.encode(payload_data, JWT_SECRET, algorithm="HS256")
 
-        # ── Build the StartPage redirect URL ──────────────────────────────
-        storefront_login_url = f"{STOREFRONT_PUBLIC_URL}/api/punchout/login"
-        redirect_url = f"{storefront_login_url}?token={auth_token}"
-        
-        response_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-        <!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
-        <cXML payloadID="12345@middleware" timestamp="2026-02-24T00:00:00Z">
-            <Response>
-                <Status code="200" text="OK"/>
-                <PunchOutSetupResponse>
-                    <StartPage>
-                        <URL>{redirect_url}</URL>
-                    </StartPage>
-                </PunchOutSetupResponse>
-            </Response>
-        </cXML>
-        """
-        return Response(content=response_xml, media_type="application/xml")
+    # ── Build the StartPage redirect URL ──────────────────────────────
+    response_started = time.perf_counter()
+    storefront_login_url = f"{STOREFRONT_PUBLIC_URL}/api/punchout/login"
+    redirect_url = f"{storefront_login_url}?token={auth_token}"
     
-    except ET.ParseError:
-        raise HTTPException(status_code=400, detail="Invalid XML payload")
-
-class CartItem(BaseModel):
-    id: str
-    title: str
-    quantity: int
-    unit_price: float # Must be decimal/float in Medusa
-    currency_code: str
-    description: str = ""
-
-class PunchoutCartReturn(BaseModel):
-    session_id: str
-    browser_form_post_url: str
-    buyer_cookie: str
-    currency: str
-    items: List[CartItem]
-
-@app.post("/api/punchout/order")
-async def punchout_order(payload: PunchoutCartReturn):
+    response_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+    <!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+    <cXML payloadID="12345@middleware" timestamp="2026-02-24T00:00:00Z">
+        <Response>
+            <Status code="200" text="OK"/>
+            <PunchOutSetupResponse>
+                <StartPage>
+                    <URL>{redirect_url}</URL>
+                </StartPage>
+            </PunchOutSetupResponse>
+        </Response>
+    </cXML>
+    """
+    SETUP_STAGE_SECONDS.observe("response", value=time.perf_counter() - response_started)
+    return Response(content=response_xml, media_type="application/xml")
+
+class SessionRedeemRequest(BaseModel):
+    token: str
+    # Seconds to wait for a pending Medusa provisioning (capped by PUNCHOUT_REDEEM_MAX_WAIT)
+    wait: float = 0
+
+class SkuIndexInvalidation(BaseModel):
+    # Both empty → full reload
+    product_ids: List[str] = []
+    variant_ids: List[str] = []
+
+@app.post("/api/punchout/session/redeem")
+async def punchout_session_redeem(body: SessionRedeemRequest):
+    """
+    Exchanges the compact StartPage token (`{"sid": ...}`) for the session
+    details. Called server-to-server by the storefront's punchout login route.
+
+    If the Medusa token is still being provisioned (`provisioning: "pending"`),
+    waits up to `wait` seconds for it; the response then says whether it is
+    `ready`, `failed` or still `pending` (browse anonymously).
+    """
+    try:
+        claims = jwt.decode(body.token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired punchout token")
+
+    session_id = claims.get("sid")
+    session = await get_session(session_id) if session_id else None
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired punchout session")
+    session = await wait_for_session_provisioning(
+        session_id, session, min(max(body.wait, 0.0), PUNCHOUT_REDEEM_MAX_WAIT)
+    )
+    return {"session_id": session_id, **session}
+
+async def _resolve_cart_return(payload: CartReturnRecord) -> CartReturnRecord:
+    """
+    Fills BuyerCookie / BrowserFormPost URL from the server-side session so the
+    storefront does not have to round-trip them (and cannot tamper with them).
+    Known sessions also tag the request with their buyer org, so the Medusa
+    calls made for the cart queue for admission as that tenant.
+    """
+    session = await get_session(payload.session_id)
+    if session is not None:
+        if session.get("b2b_company_id"):
+            bind_tenant(session["b2b_company_id"])
+        payload.buyer_cookie = session.get("buyer_cookie") or payload.buyer_cookie
+        payload.browser_form_post_url = session.get("browser_form_post_url") or payload.browser_form_post_url
+    if not payload.buyer_cookie or not payload.browser_form_post_url:
+        raise HTTPException(
+            status_code=400,
+            detail="Unknown punchout session; buyer_cookie and browser_form_post_url are required",
+        )
+    return payload
+
+# The body is decoded by cart_codec (same fields and 422 errors as a
+# PunchoutCartReturn parameter, much less CPU for large carts); the schema is
+# only declared here for the OpenAPI docs.
+@app.post(
+    "/api/punchout/order",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": PunchoutCartReturn.model_json_schema()}},
+        }
+    },
+)
+async def punchout_order(request: Request, format: Literal["json", "xml"] = "json"):
     """
     Handles the PunchOutOrderMessage (Cart return).
     Called by the Storefront when the user clicks "Transfer Cart".
     It translates the Medusa JSON cart into the cXML standard, 
     and returns it to the Storefront so it can render a hidden auto-submit HTML form.
+
+    With `?format=xml` the cXML document itself is streamed back as
+    `application/xml` (the BrowserFormPost URL is sent in the
+    `X-Punchout-Redirect-Url` header) instead of being wrapped in JSON.
     """
-    
-    total_amount = sum(item.quantity * item.unit_price for item in payload.items)
-    
-    # 1. Build the ItemIn XML elements
-    items_xml = ""
-    for idx, item in enumerate(payload.items, start=1):
-        items_xml += f"""
-                <ItemIn quantity="{item.quantity}">
-                    <ItemID>
-                        <SupplierPartID>{item.id}</SupplierPartID>
-                    </ItemID>
-                    <ItemDetail>
-                        <UnitPrice>
-                            <Money currency="{payload.currency}">{item.unit_price:.2f}</Money>
-                        </UnitPrice>
-                        <Description xml:lang="en">{item.title}</Description>
-                        <UnitOfMeasure>EA</UnitOfMeasure>
-                        <Classification domain="UNSPSC">00000000</Classification>
-                    </ItemDetail>
-                </ItemIn>"""
-
-    # 2. Build the full cXML Payload
-    # Note: A real implementation would dynamically fetch Supplier Identity configs from the Database
-    cxml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
-<cXML payloadID="order-return-{payload.session_id}@middleware" timestamp="2026-02-24T00:00:00Z">
-    <Header>
-        <From><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></From>
-        <To><Credential domain="NetworkId"><Identity>BuyerNetwork</Identity></Credential></To>
-        <Sender><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></Sender>
-    </Header>
-    <Message>
-        <PunchOutOrderMessage>
-            <BuyerCookie>{payload.buyer_cookie}</BuyerCookie>
-            <PunchOutOrderMessageHeader operationAllowed="edit">
-                <Total>
-                    <Money currency="{payload.currency}">{total_amount:.2f}</Money>
-                </Total>
-            </PunchOutOrderMessageHeader>
-            {items_xml}
-        </PunchOutOrderMessage>
-    </Message>
-</cXML>
-"""
+    payload = decode_cart_return(await request.body(), request.headers.get("content-type"))
+    bind_session_id(payload.session_id)
+    CART_LINES.observe("order", value=len(payload.items))
+    with ORDER_STAGE_SECONDS.time("session"):
+        payload = await _resolve_cart_return(payload)
+    # UNSPSC / UoM / manufacturer / lead time: one batched Medusa lookup per cart
+    with ORDER_STAGE_SECONDS.time("enrich"):
+        details = await enrich_items(payload.items)
+
+    # Raw cXML, streamed in chunks of ItemIn elements (bounded memory for
+    # carts with thousands of lines)
+    if format == "xml":
+        return StreamingResponse(
+            iter_order_message(payload, details),
+            media_type="application/xml",
+            headers={"X-Punchout-Redirect-Url": payload.browser_form_post_url},
+        )
 
+    with ORDER_STAGE_SECONDS.time("render"):
+        cxml = render_order_message(payload, details)
+    return CartJSONResponse({
+        "status": "success",
+        "redirect_url": payload.browser_form_post_url,
+        "cxml_base64": cxml # Return as plain text for the Storefront to Base64 encode into an HTML form
+    })
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+async def _convert_cart_return(index: int, raw) -> dict:
+    """Converts one cart return of a batch; failures become error results."""
+    if isinstance(raw, InvalidLine):
+        return {"index": index, "status": "error", "status_code": 400, "detail": raw.error}
+    try:
+        payload = await _resolve_cart_return(validate_cart_return(raw))
+        CART_LINES.observe("batch", value=len(payload.items))
+        details = await enrich_items(payload.items)
+        cxml = await run_in_pool(render_order_message, payload, details)
+    except ValidationError as e:
+        return {"index": index, "status": "error", "status_code": 422, "detail": json.loads(e.json(include_url=False))}
+    except HTTPException as e:
+        return {"index": index, "status": "error", "status_code": e.status_code, "detail": e.detail}
+    except Exception as e:
+        logger.exception("Batch cart failed", extra={"index": index})
+        return {"index": index, "status": "error", "status_code": 500, "detail": "Internal error while rendering cart"}
     return {
+        "index": index,
+        "session_id": payload.session_id,
         "status": "success",
         "redirect_url": payload.browser_form_post_url,
-        "cxml_base64": cxml_response # Return as plain text for the Storefront to Base64 encode into an HTML form
+        "cxml_base64": cxml,
     }
+
+@app.post("/api/punchout/order/batch")
+async def punchout_order_batch(request: Request):
+    """
+    Converts many cart returns in one call (reconciliation jobs, storefront
+    retry queue).
+
+    Accepts NDJSON (`application/x-ndjson`, one PunchoutCartReturn per line)
+    or a JSON array, and streams back NDJSON: one result per cart, in
+    completion order, tagged with the cart's position in the input. A cart
+    that fails validation or rendering yields an error line; the rest of the
+    batch carries on. Rendering runs on a bounded worker pool.
+    """
+    # The body is fully read before the response starts: Starlette's streaming
+    # response listens on the same receive channel for client disconnects.
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_MEDIA_TYPES:
+        carts = [cart async for cart in iter_ndjson(request.stream())]
+    else:
+        try:
+            carts = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON payload")
+        if not isinstance(carts, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of cart returns or NDJSON")
+
+    async def results():
+        async for result in map_as_completed(carts, _convert_cart_return):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/api/punchout/sku-index/invalidate")
+async def punchout_sku_index_invalidate(
+    body: SkuIndexInvalidation,
+    x_punchout_webhook_secret: str = Header(default=""),
+):
+    """
+    Called by Medusa's product subscriber when products or variants change.
+    The named products are re-fetched into the SKU index (no ids → full
+    reload); the other workers follow within SKU_INDEX_SYNC_INTERVAL.
+    """
+    if not PUNCHOUT_WEBHOOK_SECRET or not hmac.compare_digest(
+        x_punchout_webhook_secret.encode(), PUNCHOUT_WEBHOOK_SECRET.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret")
+    refreshed = await invalidate_products(body.product_ids, body.variant_ids)
+    return {"status": "ok", "refreshed_products": refreshed, **sku_index_stats()}
+
+@app.api_route("/api/punchout/catalog", methods=["GET", "HEAD"])
+async def punchout_catalog(request: Request, format: Literal["csv", "cif", "cxml"] = "csv"):
+    """
+    Serves the latest precomputed index catalog (gzip-compressed CSV, CIF 3.0
+    or cXML Index), regenerated in the background on a schedule.
+
+    Supports conditional requests (If-None-Match / If-Modified-Since → 304)
+    and single byte ranges (Range / If-Range → 206), so pollers normally get
+    a 304 and interrupted downloads can resume.
+    """
+    if format not in CATALOG_ARTIFACT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Catalog format {format!r} is not generated")
+    try:
+        fd = os.open(artifact_path(format), os.O_RDONLY)
+    except FileNotFoundError:
+        trigger_regeneration()
+        raise HTTPException(
+            status_code=503,
+            detail="The catalog is being generated, retry later",
+            headers={"Retry-After": "60"},
+        )
+
+    try:
+        info = await artifact_info(format, fd)
+        headers = {
+            "ETag": info.etag,
+            "Last-Modified": format_datetime(info.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'attachment; filename="{info.filename}"',
+        }
+        if is_not_modified(request.headers, info):
+            os.close(fd)
+            return Response(status_code=304, headers=headers)
+        try:
+            requested = byte_range(request.headers, info)
+        except RangeNotSatisfiable:
+            os.close(fd)
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{info.size}"})
+    except BaseException:
+        os.close(fd)
+        raise
+
+    status_code = 200
+    start, end = 0, info.size - 1
+    if requested is not None:
+        status_code = 206
+        start, end = requested
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD":
+        os.close(fd)
+        return Response(status_code=status_code, headers=headers, media_type=CATALOG_MEDIA_TYPE)
+    return StreamingResponse(
+        iter_file(fd, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=CATALOG_MEDIA_TYPE,
+        background=BackgroundTask(os.close, fd),
+    )
@@ -0,0 +1,119 @@
+"""
+Shared HTTP client for every call the middleware makes to the Medusa backend.
+
+One `httpx.AsyncClient` is created per worker process when the FastAPI app
+starts (see the lifespan handler in `main.py`) and closed on shutdown, so
+login/register/create calls reuse pooled keep-alive connections instead of
+paying a TCP (and TLS) handshake per PunchOutSetupRequest.
+"""
+import os
+
+import httpx
+
+from logs import get_logger
+from metrics import MEDUSA_EVENT_HOOKS
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+MEDUSA_BACKEND_URL = os.getenv("MEDUSA_BACKEND_URL", "http://medusa:9000")
+MEDUSA_PUBLISHABLE_KEY = os.getenv(
+    "NEXT_PUBLIC_MEDUSA_PUBLISHABLE_KEY",
+    "pk_78469e8fbf9368a553e606bb564cc5180c1af4b2154d28ccaba15b44131b30a2",
+)
+
+# Connection pool sizing
+MEDUSA_HTTP_MAX_CONNECTIONS = int(os.getenv("MEDUSA_HTTP_MAX_CONNECTIONS", "100"))
+MEDUSA_HTTP_MAX_KEEPALIVE = int(os.getenv("MEDUSA_HTTP_MAX_KEEPALIVE", "20"))
+MEDUSA_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MEDUSA_HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Per-phase timeouts (seconds)
+MEDUSA_HTTP_CONNECT_TIMEOUT = float(os.getenv("MEDUSA_HTTP_CONNECT_TIMEOUT", "3"))
+MEDUSA_HTTP_READ_TIMEOUT = float(os.getenv("MEDUSA_HTTP_READ_TIMEOUT", "10"))
+MEDUSA_HTTP_WRITE_TIMEOUT = float(os.getenv("MEDUSA_HTTP_WRITE_TIMEOUT", "10"))
+MEDUSA_HTTP_POOL_TIMEOUT = float(os.getenv("MEDUSA_HTTP_POOL_TIMEOUT", "5"))
+
+# HTTP/2 is only negotiated over TLS (ALPN); against a plain http:// Medusa URL
+# httpx silently stays on HTTP/1.1.
+MEDUSA_HTTP2 = os.getenv("MEDUSA_HTTP2", "false").lower() in ("1", "true", "yes")
+
+_client: httpx.AsyncClient | None = None
+
+logger = get_logger(__name__)
+
+
+def medusa_headers() -> dict:
+    """Headers required for all Medusa Store API calls."""
+    return {
+        "Content-Type": "application/json",
+        "x-publishable-api-key": MEDUSA_PUBLISHABLE_KEY,
+    }
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_medusa_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """
+    Builds a pooled client bound to MEDUSA_BACKEND_URL.
+
+    `transport` is only meant for running against an in-process stand-in
+    (e.g. an ASGI app); production always uses the default pooled transport.
+    """
+    http2 = MEDUSA_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("MEDUSA_HTTP2 is enabled but the 'h2' package is missing; using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        base_url=MEDUSA_BACKEND_URL,
+        headers=medusa_headers(),
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=MEDUSA_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=MEDUSA_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=MEDUSA_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=MEDUSA_HTTP_CONNECT_TIMEOUT,
+            read=MEDUSA_HTTP_READ_TIMEOUT,
+            write=MEDUSA_HTTP_WRITE_TIMEOUT,
+            pool=MEDUSA_HTTP_POOL_TIMEOUT,
+        ),
+        transport=transport,
+        # Status-code counters and latency histograms for /metrics
+        event_hooks=MEDUSA_EVENT_HOOKS,
+    )
+
+
+async def open_medusa_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """Creates the worker-wide client. Called once from the app lifespan."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = build_medusa_client(transport)
+    return _client
+
+
+async def close_medusa_client() -> None:
+    """Closes the worker-wide client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_medusa_client() -> httpx.AsyncClient:
+    """
+    Returns the worker-wide client.
+
+    Falls back to creating it lazily so helpers still work when the module is
+    used outside the FastAPI lifespan (scripts, REPL).
+    """
+    global _client
+    if _client is None:
+        _client = build_medusa_client()
+    return _client
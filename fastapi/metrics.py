@@ -0,0 +1,269 @@
+"""
+In-process metrics exposed on GET /metrics in the Prometheus text format.
+
+- `Counter`, `Gauge` and `Histogram`: labelled series kept in plain dicts
+  keyed by the label values. Recording is a dict lookup plus a bisect, cheap
+  enough to stay on in production. Not thread-safe; update them from the event loop.
+- `MEDUSA_EVENT_HOOKS`: httpx event hooks installed on the pooled Medusa
+  client, counting responses by endpoint and status code and timing them.
+
+Every uvicorn worker keeps its own series (like the cache stats); each scrape
+is answered by whichever worker accepts it, so scrape every worker or run
+one worker per container.
+"""
+import re
+import time
+from bisect import bisect_left
+from typing import Iterable
+
+# Seconds; covers a cached setup (~1ms) up to a Medusa timeout (10s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CART_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        self._series[labels] = self._series.get(labels, 0.0) + amount
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in self._series.items():
+            yield f"{self.name}{self._labels(labels)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        self._series[labels] = value
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in self._series.items():
+            yield f"{self.name}{self._labels(labels)} {_number(value)}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            # per-bucket counts (last one is +Inf), then sum
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels) -> _Timer:
+        """`with HISTOGRAM.time("label"): ...` observes the block's wall time."""
+        return _Timer(self, labels)
+
+    def _samples(self) -> Iterable[str]:
+        bounds = self.buckets + (float("inf"),)
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{self._labels(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+# ── Metrics recorded by the punchout routes ───────────────────────────────────
+
+SETUP_STAGE_SECONDS = Histogram(
+    "punchout_setup_stage_seconds",
+    "Time spent in each stage of PunchOutSetupRequest handling.",
+    ["stage"],
+)
+PROVISIONING_STEP_SECONDS = Histogram(
+    "punchout_provisioning_step_seconds",
+    "Time spent in each Medusa call of B2B customer provisioning.",
+    ["step"],
+)
+PROVISIONING_TOTAL = Counter(
+    "punchout_provisioning_total",
+    "B2B customer provisioning attempts by result.",
+    ["result"],
+)
+ORDER_STAGE_SECONDS = Histogram(
+    "punchout_order_stage_seconds",
+    "Time spent in each stage of cart return handling.",
+    ["stage"],
+)
+CART_LINES = Histogram(
+    "punchout_cart_lines",
+    "Number of lines per returned cart.",
+    ["route"],
+    buckets=CART_SIZE_BUCKETS,
+)
+MEDUSA_RESPONSES = Counter(
+    "punchout_medusa_responses_total",
+    "Responses received from Medusa by endpoint and status code.",
+    ["method", "endpoint", "status"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "punchout_log_records_dropped_total",
+    "Log records dropped because the logging queue was full.",
+)
+ENRICHMENT_LINES = Counter(
+    "punchout_enrichment_lines_total",
+    "Cart lines by where their item details came from (unresolved lines use the defaults).",
+    ["source"],
+)
+MEDUSA_BREAKER_STATE = Gauge(
+    "punchout_medusa_breaker_state",
+    "Circuit breaker state per Medusa endpoint (0 closed, 1 half-open, 2 open).",
+    ["endpoint"],
+)
+MEDUSA_BREAKER_REJECTIONS = Counter(
+    "punchout_medusa_breaker_rejections_total",
+    "Medusa calls not attempted because the endpoint's breaker was open.",
+    ["endpoint"],
+)
+MEDUSA_RETRIES_TOTAL = Counter(
+    "punchout_medusa_retries_total",
+    "Medusa calls retried after a transport error or retryable status.",
+    ["endpoint"],
+)
+MEDUSA_HEDGES = Counter(
+    "punchout_medusa_hedges_total",
+    "Hedged duplicate Medusa calls sent, by which request answered first.",
+    ["endpoint", "winner"],
+)
+SETUP_ANONYMOUS_FALLBACK = Counter(
+    "punchout_setup_anonymous_fallback_total",
+    "Setups that fell back to anonymous browsing, by reason.",
+    ["reason"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "punchout_admission_rejections_total",
+    "Setup requests answered with a cXML error by admission control, by reason.",
+    ["reason"],
+)
+MEDUSA_IN_FLIGHT = Gauge(
+    "punchout_medusa_in_flight",
+    "Medusa calls currently holding an admission slot.",
+)
+MEDUSA_QUEUE_WAIT_SECONDS = Histogram(
+    "punchout_medusa_queue_wait_seconds",
+    "Time Medusa calls waited for an admission slot.",
+)
+MEDUSA_RESPONSE_SECONDS = Histogram(
+    "punchout_medusa_response_seconds",
+    "Time until Medusa returned response headers.",
+    ["method", "endpoint"],
+)
+
+
+# ── httpx hooks for the Medusa client ─────────────────────────────────────────
+
+# Medusa ids (prod_01H..., variant_01H..., cus_01H...) in paths would give
+# every resource its own series.
+_ID_SEGMENT = re.compile(r"/[a-z]+_[0-9A-Za-z]{16,}(?=/|$)")
+
+
+def _endpoint(path: str) -> str:
+    return _ID_SEGMENT.sub("/:id", path)
+
+
+async def _on_request(request) -> None:
+    request.extensions["punchout_started"] = time.perf_counter()
+
+
+async def _on_response(response) -> None:
+    request = response.request
+    endpoint = _endpoint(request.url.path)
+    MEDUSA_RESPONSES.inc(request.method, endpoint, response.status_code)
+    started = request.extensions.get("punchout_started")
+    if started is not None:
+        MEDUSA_RESPONSE_SECONDS.observe(request.method, endpoint, value=time.perf_counter() - started)
+
+
+MEDUSA_EVENT_HOOKS = {"request": [_on_request], "response": [_on_response]}
+
+
+# ── Exposition ────────────────────────────────────────────────────────────────
+
+def _cache_samples(caches: dict) -> str:
+    """Hit/miss/size series from the `stats()` dicts of the caches."""
+    families = (
+        ("punchout_cache_hits_total", "counter", "Cache lookups that found a live entry.", "hits"),
+        ("punchout_cache_misses_total", "counter", "Cache lookups that found nothing.", "misses"),
+        ("punchout_cache_entries", "gauge", "Entries currently held by the cache.", "size"),
+    )
+    blocks = []
+    for name, kind, documentation, key in families:
+        lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        for cache, stats in caches.items():
+            if isinstance(stats, dict) and key in stats:
+                lines.append(f'{name}{{cache="{_escape(cache)}"}} {_number(stats[key])}')
+        blocks.append("\n".join(lines))
+    return "\n".join(blocks)
+
+
+def render_metrics(caches: dict | None = None) -> str:
+    """All registered metrics (plus the given cache stats) in the Prometheus text format."""
+    blocks = [metric.render() for metric in _registry]
+    if caches:
+        blocks.append(_cache_samples(caches))
+    return "\n".join(blocks) + "\n"
@@ -0,0 +1,119 @@
+"""
+On-demand profiling of single punchout requests.
+
+Off by default. With PROFILE_ENABLED=true, `ProfilingMiddleware` runs the
+pyinstrument sampling profiler over a request to one of PROFILE_ROUTES when
+
+- the caller sends `X-Punchout-Profile: <PROFILE_TOKEN>`, or
+- the request is picked by PROFILE_SAMPLE_RATE (e.g. 0.001 = one in a thousand).
+
+Profiles are written to PROFILE_DIR as `<time>-<route>-<request id>` in the
+speedscope format (open in https://www.speedscope.app or convert for
+flamegraph tools) or as pyinstrument HTML, and the file name is returned in
+the `X-Punchout-Profile` response header. Only the newest PROFILE_KEEP files
+are kept.
+
+When disabled, the middleware is not installed and pyinstrument is never
+imported, so requests pay nothing.
+"""
+import asyncio
+import hmac
+import os
+import random
+import time
+
+from logs import get_logger, request_id_var
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Secret expected in X-Punchout-Profile; unset disables header-triggered profiles
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTES = {
+    route.strip()
+    for route in os.getenv("PROFILE_ROUTES", "/api/punchout/setup,/api/punchout/order").split(",")
+    if route.strip()
+}
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/punchout-profiles")
+# "speedscope" (flamegraph JSON) or "html"
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope").lower()
+# Sampling interval in seconds
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+PROFILE_HEADER = b"x-punchout-profile"
+_EXTENSIONS = {"speedscope": ".speedscope.json", "html": ".html"}
+
+logger = get_logger(__name__)
+
+
+def _requested(scope) -> bool:
+    if PROFILE_TOKEN:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, PROFILE_TOKEN.encode())
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _render(profiler) -> str:
+    if PROFILE_FORMAT == "html":
+        return profiler.output_html()
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    return profiler.output(renderer=SpeedscopeRenderer())
+
+
+def _prune() -> None:
+    entries = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in entries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else ():
+        os.remove(entry.path)
+
+
+def _save(path: str, profiler) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_render(profiler))
+    _prune()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests selected by `_requested()`."""
+
+    def __init__(self, app):
+        from pyinstrument import Profiler
+
+        self.app = app
+        self._profiler_cls = Profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PROFILE_ROUTES or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = request_id_var.get() or os.urandom(8).hex()
+        route = scope["path"].strip("/").replace("/", "_")
+        filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{route}-{request_id}{_EXTENSIONS.get(PROFILE_FORMAT, '.txt')}"
+        header = (PROFILE_HEADER, filename.encode("latin-1"))
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        # async_mode="enabled" follows this request's task across awaits and
+        # leaves other requests on the loop out of the profile.
+        profiler = self._profiler_cls(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, filename)
+            try:
+                await asyncio.to_thread(_save, path, profiler)
+                logger.info("Request profile saved", extra={"path": path, "seconds": profiler.last_session.duration})
+            except Exception:
+                logger.exception("Could not save request profile")
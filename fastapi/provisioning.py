@@ -0,0 +1,327 @@
+"""
+Provisioning of the synthetic Medusa customer behind each punchout buyer org.
+
+`get_or_create_b2b_customer` talks to Medusa through `resilience.medusa_request`
+(circuit breaker, retries, the caller's latency budget); the punchout routes
+call `get_b2b_customer_token`, which serves tokens from a TTL/LRU cache keyed
+by company identity and coalesces concurrent provisioning for the same
+company into a single Medusa round trip.
+
+With PUNCHOUT_ASYNC_PROVISIONING the setup route does not wait for a cold
+provisioning: `start_session_provisioning` runs it in the background and
+stores the token in the punchout session, and the session redemption waits
+for it with `wait_for_session_provisioning`.
+"""
+import asyncio
+import os
+import time
+
+import jwt
+
+from admission import Overloaded
+from cache import SingleFlight, make_cache
+from logs import get_logger
+from metrics import PROVISIONING_STEP_SECONDS, PROVISIONING_TOTAL, SETUP_ANONYMOUS_FALLBACK
+from resilience import MedusaUnavailable, latency_budget, medusa_request
+from session_store import PROVISIONING_PENDING, get_session, save_session
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+JWT_SECRET = os.getenv("JWT_SECRET", "supersecret")
+
+# Max number of buyer orgs whose tokens are kept in memory (LRU beyond that)
+MEDUSA_TOKEN_CACHE_SIZE = int(os.getenv("MEDUSA_TOKEN_CACHE_SIZE", "10000"))
+# Used when Medusa returns a token without an `exp` claim
+MEDUSA_TOKEN_DEFAULT_TTL = float(os.getenv("MEDUSA_TOKEN_DEFAULT_TTL", "3600"))
+# Never hand out a token with less lifetime left than this: the storefront
+# stores it as the shopper's session cookie.
+MEDUSA_TOKEN_MIN_TTL = float(os.getenv("MEDUSA_TOKEN_MIN_TTL", "600"))
+# Start a background refresh once a cached token is this close to expiring
+MEDUSA_TOKEN_REFRESH_AHEAD = float(os.getenv("MEDUSA_TOKEN_REFRESH_AHEAD", "3600"))
+# Send a second login if the first has not answered within MEDUSA_HEDGE_DELAY
+MEDUSA_HEDGE_LOGIN = os.getenv("MEDUSA_HEDGE_LOGIN", "false").lower() in ("1", "true", "yes")
+# How often a redemption re-reads a session provisioned by another worker
+PUNCHOUT_REDEEM_POLL_INTERVAL = float(os.getenv("PUNCHOUT_REDEEM_POLL_INTERVAL", "0.1"))
+
+# Shared by all workers when CACHE_BACKEND=sqlite, so one login serves every worker.
+_token_cache = make_cache("medusa_tokens", maxsize=MEDUSA_TOKEN_CACHE_SIZE, default_ttl=MEDUSA_TOKEN_DEFAULT_TTL)
+_provisioning = SingleFlight()
+_background_refreshes: set[asyncio.Task] = set()
+# session_id -> background provisioning started by this worker
+_session_provisioning: dict[str, asyncio.Task] = {}
+
+logger = get_logger(__name__)
+
+
+def _credentials(company_id: str) -> tuple[str, str]:
+    """Synthetic email and password of the company's punchout customer."""
+    email = f"punchout_{company_id}@punchout.local"
+    # Deterministic password — never exposed to humans, only used internally.
+    password = jwt.encode({"sub": company_id}, JWT_SECRET, algorithm="HS256")[:32]
+    return email, password
+
+
+async def get_or_create_b2b_customer(company_id: str) -> str | None:
+    """
+    Looks up an existing Punchout B2B customer in Medusa by the synthetic email
+    `punchout_<company_id>@punchout.local`. If it doesn't exist yet, creates it.
+
+    Returns the Medusa JWT token (Bearer) for that customer, or None on failure.
+    Raises MedusaUnavailable when Medusa could not be reached in time, and
+    admission.Overloaded when this worker had no free Medusa slot.
+    The approach: register the customer with a deterministic password derived from
+    the shared JWT_SECRET so FastAPI can always re-authenticate without storing state.
+    """
+    email, password = _credentials(company_id)
+    try:
+        return await _provision(company_id, email, password)
+    except MedusaUnavailable as e:
+        logger.warning("Medusa unavailable for B2B customer", extra={"email": email, "reason": e.reason, "error": str(e)})
+        PROVISIONING_TOTAL.inc("failed")
+        raise
+
+
+async def _provision(company_id: str, email: str, password: str) -> str | None:
+
+    # ── 1. Attempt login first (most common path) ──────────────────────────
+    with PROVISIONING_STEP_SECONDS.time("login"):
+        login_res = await medusa_request(
+            "POST",
+            "/auth/customer/emailpass",
+            json={"email": email, "password": password},
+            idempotent=True,
+            hedge=MEDUSA_HEDGE_LOGIN,
+        )
+    if login_res.status_code == 200:
+        medusa_token = login_res.json().get("token")
+        logger.info("Authenticated existing B2B customer", extra={"email": email})
+        PROVISIONING_TOTAL.inc("existing")
+        return medusa_token
+
+    # ── 2. Customer doesn't exist → register then create ───────────────────
+    if login_res.status_code in (401, 404):
+        # Step 2a: Register auth identity
+        with PROVISIONING_STEP_SECONDS.time("register"):
+            reg_res = await medusa_request(
+                "POST",
+                "/auth/customer/emailpass/register",
+                json={"email": email, "password": password},
+            )
+        if reg_res.status_code not in (200, 201):
+            logger.warning(
+                "Failed to register B2B customer auth",
+                extra={"email": email, "status": reg_res.status_code, "response": reg_res.text},
+            )
+            PROVISIONING_TOTAL.inc("failed")
+            return None
+
+        reg_token = reg_res.json().get("token")
+
+        # Step 2b: Create the customer profile
+        with PROVISIONING_STEP_SECONDS.time("create"):
+            create_res = await medusa_request(
+                "POST",
+                "/store/customers",
+                json={
+                    "email": email,
+                    "first_name": company_id,
+                    "last_name": "(Punchout B2B)",
+                    "company_name": company_id,
+                },
+                headers={"Authorization": f"Bearer {reg_token}"},
+            )
+        if create_res.status_code not in (200, 201):
+            logger.warning(
+                "Failed to create B2B customer profile",
+                extra={"email": email, "status": create_res.status_code, "response": create_res.text},
+            )
+
+        # Step 2c: Login to get a permanent session token
+        with PROVISIONING_STEP_SECONDS.time("login2"):
+            login_res2 = await medusa_request(
+                "POST",
+                "/auth/customer/emailpass",
+                json={"email": email, "password": password},
+                idempotent=True,
+            )
+        if login_res2.status_code == 200:
+            medusa_token = login_res2.json().get("token")
+            logger.info("Created and authenticated new B2B customer", extra={"email": email})
+            PROVISIONING_TOTAL.inc("created")
+            return medusa_token
+
+    logger.warning("Could not authenticate B2B customer", extra={"email": email, "status": login_res.status_code})
+    PROVISIONING_TOTAL.inc("failed")
+    return None
+
+
+async def login_b2b_customer(company_id: str) -> str | None:
+    """
+    Read-only variant of `get_b2b_customer_token` for batch jobs: returns a
+    cached token or logs in as the company's punchout customer, but never
+    registers or creates one. None when the customer was never provisioned
+    (or the login was refused). Raises like `get_or_create_b2b_customer`.
+    """
+    entry = await _token_cache.aget(company_id)
+    if entry is not None:
+        return entry["token"]
+    email, password = _credentials(company_id)
+    response = await medusa_request(
+        "POST",
+        "/auth/customer/emailpass",
+        json={"email": email, "password": password},
+        idempotent=True,
+    )
+    if response.status_code == 200:
+        return response.json().get("token")
+    return None
+
+
+def _token_expiry(token: str) -> float:
+    """Returns the token's `exp` as a unix timestamp (signature is Medusa's to check)."""
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+        return float(claims["exp"])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return time.time() + MEDUSA_TOKEN_DEFAULT_TTL
+
+
+async def _provision_and_cache(company_id: str) -> str | None:
+    token = await get_or_create_b2b_customer(company_id)
+    if token:
+        expires_at = _token_expiry(token)
+        await _token_cache.aset(
+            company_id,
+            {"token": token, "refresh_at": expires_at - MEDUSA_TOKEN_REFRESH_AHEAD},
+            ttl=expires_at - time.time() - MEDUSA_TOKEN_MIN_TTL,
+        )
+    return token
+
+
+async def _background_refresh(company_id: str) -> None:
+    # Not bound by the latency budget of the request that triggered it
+    with latency_budget(None):
+        try:
+            await _provisioning.do(company_id, lambda: _provision_and_cache(company_id))
+        except (MedusaUnavailable, Overloaded):
+            pass  # the cached token is still valid
+
+
+def _refresh_in_background(company_id: str) -> None:
+    if _provisioning.in_flight(company_id):
+        return
+    task = asyncio.ensure_future(_background_refresh(company_id))
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+
+async def get_b2b_customer_token(company_id: str) -> str | None:
+    """
+    Returns a Medusa Bearer token for the company, provisioning it at most once
+    per company at a time.
+
+    Cached tokens are served until MEDUSA_TOKEN_MIN_TTL before they expire;
+    inside the MEDUSA_TOKEN_REFRESH_AHEAD window they are still served while a
+    fresh one is fetched in the background. Raises like
+    `get_or_create_b2b_customer`.
+    """
+    token = await cached_b2b_customer_token(company_id)
+    if token is not None:
+        return token
+    return await _provisioning.do(company_id, lambda: _provision_and_cache(company_id))
+
+
+async def cached_b2b_customer_token(company_id: str) -> str | None:
+    """The cached token for the company (refreshed ahead in the background), without calling Medusa."""
+    entry = await _token_cache.aget(company_id)
+    if entry is None:
+        return None
+    if time.time() >= entry["refresh_at"]:
+        _refresh_in_background(company_id)
+    return entry["token"]
+
+
+async def invalidate_b2b_customer_token(company_id: str) -> None:
+    """Drops a cached token, e.g. after Medusa rejected it."""
+    await _token_cache.adelete(company_id)
+
+
+# ── Asynchronous provisioning of punchout sessions ───────────────────────────
+
+async def _provision_session(session_id: str, session_data: dict) -> dict:
+    company_id = session_data["b2b_company_id"]
+    # Whatever goes wrong below, the session must not stay pending: the
+    # redeem call would wait on it until its timeout, every time.
+    record = {**session_data, "medusa_jwt": None, "provisioning": "failed"}
+    reason = "provisioning_failed"
+    try:
+        # Nobody is waiting on the setup response any more; httpx timeouts and
+        # the breaker bound this instead of the setup latency budget.
+        with latency_budget(None):
+            token = await get_b2b_customer_token(company_id)
+        if token:
+            ready = {**session_data, "medusa_jwt": token, "provisioning": "ready"}
+            await save_session(session_id, ready)
+            record, reason = ready, None
+    except (MedusaUnavailable, Overloaded) as e:
+        reason = e.reason
+    except Exception:
+        logger.exception("Unexpected error while provisioning Medusa session", extra={"company_id": company_id})
+    finally:
+        if reason:
+            SETUP_ANONYMOUS_FALLBACK.inc(reason)
+            logger.warning(
+                "Could not provision Medusa session; user will browse anonymously",
+                extra={"company_id": company_id, "reason": reason},
+            )
+            await save_session(session_id, record)
+    return record
+
+
+def start_session_provisioning(session_id: str, session_data: dict) -> None:
+    """
+    Provisions the session's Medusa token in the background. `session_data`
+    must already be saved with `provisioning=PROVISIONING_PENDING`; it is saved
+    again with the token (or without one, on failure) when done.
+    """
+    task = asyncio.ensure_future(_provision_session(session_id, session_data))
+    _session_provisioning[session_id] = task
+
+    def done(task: asyncio.Task) -> None:
+        _session_provisioning.pop(session_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background session provisioning failed", exc_info=task.exception())
+
+    task.add_done_callback(done)
+
+
+async def wait_for_session_provisioning(session_id: str, session: dict, timeout: float) -> dict:
+    """
+    Returns the session once its provisioning is no longer pending, or as it
+    is after `timeout` seconds. Awaits the task directly when this worker runs
+    it, otherwise re-reads the session store.
+    """
+    if session.get("provisioning") != PROVISIONING_PENDING or timeout <= 0:
+        return session
+    task = _session_provisioning.get(session_id)
+    if task is not None:
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            return session
+        except Exception:
+            return await get_session(session_id) or session
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(PUNCHOUT_REDEEM_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+        current = await get_session(session_id)
+        if current is None:
+            return session
+        if current.get("provisioning") != PROVISIONING_PENDING:
+            return current
+        session = current
+    return session
+
+
+def token_cache_stats() -> dict:
+    return _token_cache.stats()
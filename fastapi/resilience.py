@@ -0,0 +1,249 @@
+"""
+Resilience layer for the Medusa calls made while serving a request
+(PunchOutSetupRequest provisioning, cart enrichment).
+
+`medusa_request()` wraps the pooled client with:
+
+- a circuit breaker per endpoint: after MEDUSA_BREAKER_FAILURES consecutive
+  failures (transport errors, timeouts, 5xx, 429) the endpoint is skipped for
+  MEDUSA_BREAKER_RESET seconds, then a single probe call decides whether it
+  closes again;
+- bounded retries with exponential backoff and full jitter. Idempotent calls
+  are retried on any failure; the others only when the request never reached
+  Medusa (connect errors, pool timeouts);
+- the latency budget of the current request (`latency_budget()`): every call
+  and backoff is cut to the time left, so the whole provisioning sequence
+  cannot take longer than the budget;
+- optional hedging for idempotent calls: if no answer arrived after
+  MEDUSA_HEDGE_DELAY seconds, a duplicate request is sent and the first
+  answer wins;
+- an admission slot (`admission.medusa_slot`) held for every attempt, so the
+  worker's in-flight Medusa calls stay under MEDUSA_MAX_IN_FLIGHT. `Overloaded`
+  is passed through untouched: it says nothing about Medusa's health.
+
+Failures surface as `MedusaUnavailable`, whose `reason` the setup route
+records before falling back to anonymous browsing.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from admission import Overloaded, medusa_slot
+from metrics import MEDUSA_BREAKER_REJECTIONS, MEDUSA_BREAKER_STATE, MEDUSA_HEDGES, MEDUSA_RETRIES_TOTAL
+from medusa_client import get_medusa_client
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+MEDUSA_BREAKER_FAILURES = int(os.getenv("MEDUSA_BREAKER_FAILURES", "5"))
+MEDUSA_BREAKER_RESET = float(os.getenv("MEDUSA_BREAKER_RESET", "30"))
+MEDUSA_RETRIES = int(os.getenv("MEDUSA_RETRIES", "2"))
+MEDUSA_RETRY_BACKOFF = float(os.getenv("MEDUSA_RETRY_BACKOFF", "0.1"))
+MEDUSA_HEDGE_DELAY = float(os.getenv("MEDUSA_HEDGE_DELAY", "0.25"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# The request was never sent, so even a non-idempotent call can be repeated
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("medusa_deadline", default=None)
+
+
+class MedusaUnavailable(Exception):
+    """Medusa could not be used for this request; `reason` labels the fallback metric."""
+
+    reason = "medusa_error"
+
+
+class CircuitOpenError(MedusaUnavailable):
+    reason = "circuit_open"
+
+
+class BudgetExceeded(MedusaUnavailable):
+    reason = "budget_exceeded"
+
+    def __init__(self, message: str, sent: bool = False):
+        super().__init__(message)
+        # False when the budget ran out before the request went out, which
+        # says nothing about Medusa's health
+        self.sent = sent
+
+
+# ── Latency budget ────────────────────────────────────────────────────────────
+
+@contextmanager
+def latency_budget(seconds: float | None):
+    """Limits every Medusa call inside the block to a shared deadline (None lifts it)."""
+    token = _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> float | None:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# ── Circuit breaker ───────────────────────────────────────────────────────────
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = MEDUSA_BREAKER_FAILURES, reset_timeout: float = MEDUSA_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self._probing = False
+        MEDUSA_BREAKER_STATE.set(name, value=self.state)
+
+    def _set_state(self, state: int) -> None:
+        self.state = state
+        MEDUSA_BREAKER_STATE.set(self.name, value=state)
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError unless a call may go through now."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+            MEDUSA_BREAKER_REJECTIONS.inc(self.name)
+            raise CircuitOpenError(f"Circuit open for Medusa {self.name}")
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def release_probe(self) -> None:
+        """The probe call was cancelled before it had an outcome; let the next one try."""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(endpoint: str) -> CircuitBreaker:
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+    return breaker
+
+
+def breaker_stats() -> dict:
+    return {name: {"state": breaker.state, "failures": breaker.failures} for name, breaker in _breakers.items()}
+
+
+# ── Calls ─────────────────────────────────────────────────────────────────────
+
+async def _send(method: str, path: str, kwargs: dict) -> httpx.Response:
+    remaining = remaining_budget()
+    if remaining is not None and remaining <= 0:
+        raise BudgetExceeded(f"No latency budget left for Medusa {path}")
+    async with medusa_slot(remaining):
+        if remaining is None:
+            return await get_medusa_client().request(method, path, **kwargs)
+        # The slot wait came out of the budget too
+        remaining = remaining_budget()
+        if remaining <= 0:
+            raise BudgetExceeded(f"Latency budget spent waiting for a Medusa slot for {path}")
+        try:
+            return await asyncio.wait_for(get_medusa_client().request(method, path, **kwargs), timeout=remaining)
+        except asyncio.TimeoutError:
+            raise BudgetExceeded(f"Latency budget exhausted waiting for Medusa {path}", sent=True) from None
+
+
+async def _send_hedged(method: str, path: str, kwargs: dict, delay: float) -> httpx.Response:
+    primary = asyncio.ensure_future(_send(method, path, kwargs))
+    labels = {primary: "primary"}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = asyncio.ensure_future(_send(method, path, kwargs))
+        labels[hedge] = "hedge"
+        pending = {primary, hedge}
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    MEDUSA_HEDGES.inc(path, labels[task])
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller is cancelled: no attempt may outlive
+        # it and keep its admission slot
+        for task in labels:
+            task.cancel()
+
+
+async def medusa_request(
+    method: str,
+    path: str,
+    *,
+    idempotent: bool = False,
+    hedge: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """
+    Sends a request to Medusa through the endpoint's breaker, with retries and
+    the current latency budget. Returns the last response (which may still be
+    an error status); raises MedusaUnavailable when no response was obtained.
+    """
+    breaker = breaker_for(path)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            if hedge and idempotent:
+                response = await _send_hedged(method, path, kwargs, MEDUSA_HEDGE_DELAY)
+            else:
+                response = await _send(method, path, kwargs)
+        except BudgetExceeded as e:
+            if e.sent:
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+            raise
+        except (asyncio.CancelledError, Overloaded):
+            breaker.release_probe()
+            raise
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            if attempt == MEDUSA_RETRIES or not (idempotent or isinstance(e, _NOT_SENT)):
+                raise MedusaUnavailable(f"Medusa {path} failed: {e!r}") from e
+        else:
+            if response.status_code not in RETRYABLE_STATUSES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt == MEDUSA_RETRIES or not idempotent:
+                return response
+
+        # Only retryable outcomes get here, and never on the last attempt.
+        # Full jitter; give up instead of sleeping past the deadline
+        delay = random.uniform(0, MEDUSA_RETRY_BACKOFF * 2 ** attempt)
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= delay:
+            raise BudgetExceeded(f"No latency budget left to retry Medusa {path}")
+        MEDUSA_RETRIES_TOTAL.inc(path)
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,202 @@
+"""
+Punchout session store: buyer org, Medusa token, BuyerCookie, BrowserFormPost
+URL and Level 2 SKU (plus the product handle / variant it resolved to)
+recorded at PunchOutSetupRequest time, keyed by session_id. With asynchronous
+provisioning the session is saved first with `provisioning="pending"` and
+saved again once the Medusa token is known.
+
+Two backends sit behind the same async functions:
+
+- Postgres (`punchout_sessions` table, psycopg2 connection pool run off the
+  event loop), used whenever DATABASE_URL is set. Lookups go through the
+  primary key and expired rows are purged in batches by a background task.
+- The cache selected by CACHE_BACKEND, used when no database is configured.
+  With CACHE_BACKEND=sqlite it is shared by all workers on the host.
+
+The Postgres store also writes through to the cache, so the redemption that
+normally follows a setup within seconds does not need a database round trip.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from cache import CACHE_BACKEND, make_cache
+from logs import get_logger
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# "postgres" or "cache"; defaults to postgres when DATABASE_URL is set
+PUNCHOUT_SESSION_BACKEND = os.getenv("PUNCHOUT_SESSION_BACKEND", "postgres" if DATABASE_URL else "cache").lower()
+PUNCHOUT_SESSION_TTL = float(os.getenv("PUNCHOUT_SESSION_TTL", str(24 * 60 * 60)))
+PUNCHOUT_SESSION_CACHE_SIZE = int(os.getenv("PUNCHOUT_SESSION_CACHE_SIZE", "50000"))
+PUNCHOUT_DB_POOL_MIN = int(os.getenv("PUNCHOUT_DB_POOL_MIN", "1"))
+PUNCHOUT_DB_POOL_MAX = int(os.getenv("PUNCHOUT_DB_POOL_MAX", "10"))
+PUNCHOUT_SESSION_CLEANUP_INTERVAL = float(os.getenv("PUNCHOUT_SESSION_CLEANUP_INTERVAL", "300"))
+PUNCHOUT_SESSION_CLEANUP_BATCH = int(os.getenv("PUNCHOUT_SESSION_CLEANUP_BATCH", "1000"))
+
+SESSION_FIELDS = (
+    "b2b_company_id", "medusa_jwt", "buyer_cookie", "browser_form_post_url", "sku", "product_handle", "variant_id",
+    "provisioning",
+)
+PROVISIONING_PENDING = "pending"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS punchout_sessions (
+    session_id            UUID PRIMARY KEY,
+    b2b_company_id        TEXT NOT NULL,
+    medusa_jwt            TEXT,
+    buyer_cookie          TEXT,
+    browser_form_post_url TEXT,
+    sku                   TEXT,
+    product_handle        TEXT,
+    variant_id            TEXT,
+    provisioning          TEXT,
+    created_at            TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at            TIMESTAMPTZ NOT NULL
+);
+ALTER TABLE punchout_sessions ADD COLUMN IF NOT EXISTS product_handle TEXT;
+ALTER TABLE punchout_sessions ADD COLUMN IF NOT EXISTS variant_id TEXT;
+ALTER TABLE punchout_sessions ADD COLUMN IF NOT EXISTS provisioning TEXT;
+CREATE INDEX IF NOT EXISTS punchout_sessions_expires_at_idx ON punchout_sessions (expires_at);
+"""
+
+_UPSERT = (
+    f"INSERT INTO punchout_sessions (session_id, {', '.join(SESSION_FIELDS)}, expires_at)"
+    f" VALUES (%s, {', '.join(['%s'] * len(SESSION_FIELDS))}, %s)"
+    " ON CONFLICT (session_id) DO UPDATE SET "
+    + ", ".join(f"{field} = EXCLUDED.{field}" for field in SESSION_FIELDS)
+    + ", expires_at = EXCLUDED.expires_at"
+)
+_SELECT = (
+    f"SELECT {', '.join(SESSION_FIELDS)}"
+    " FROM punchout_sessions WHERE session_id = %s AND expires_at > now()"
+)
+
+_sessions = make_cache("punchout_sessions", maxsize=PUNCHOUT_SESSION_CACHE_SIZE, default_ttl=PUNCHOUT_SESSION_TTL)
+_pool = None  # psycopg2.pool.ThreadedConnectionPool when the Postgres backend is active
+_cleanup_task: asyncio.Task | None = None
+
+logger = get_logger(__name__)
+
+
+# ── Postgres backend (blocking helpers, always called via asyncio.to_thread) ──
+
+def _run(query: str, params: tuple = (), fetch: bool = False):
+    conn = _pool.getconn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            if fetch:
+                return cur.fetchone()
+            return cur.rowcount
+    finally:
+        _pool.putconn(conn)
+
+
+def _open_pool():
+    from psycopg2.pool import ThreadedConnectionPool
+
+    pool = ThreadedConnectionPool(PUNCHOUT_DB_POOL_MIN, PUNCHOUT_DB_POOL_MAX, dsn=DATABASE_URL)
+    conn = pool.getconn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(_SCHEMA)
+    finally:
+        pool.putconn(conn)
+    return pool
+
+
+def _purge_expired() -> int:
+    """Deletes expired sessions in bounded batches so no single statement holds long locks."""
+    total = 0
+    while True:
+        deleted = _run(
+            "DELETE FROM punchout_sessions WHERE session_id IN ("
+            " SELECT session_id FROM punchout_sessions WHERE expires_at < now() LIMIT %s)",
+            (PUNCHOUT_SESSION_CLEANUP_BATCH,),
+        )
+        total += deleted
+        if deleted < PUNCHOUT_SESSION_CLEANUP_BATCH:
+            return total
+
+
+async def _cleanup_loop() -> None:
+    while True:
+        await asyncio.sleep(PUNCHOUT_SESSION_CLEANUP_INTERVAL)
+        try:
+            purged = await asyncio.to_thread(_purge_expired)
+            if purged:
+                logger.info("Purged expired punchout sessions", extra={"purged": purged})
+        except Exception:
+            logger.exception("Session cleanup failed")
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+
+async def init_session_store() -> None:
+    """Opens the Postgres pool and starts expiry cleanup. Called from the app lifespan."""
+    global _pool, _cleanup_task
+    if PUNCHOUT_SESSION_BACKEND != "postgres" or not DATABASE_URL:
+        return
+    try:
+        _pool = await asyncio.to_thread(_open_pool)
+    except Exception as e:
+        logger.warning("Could not open Postgres session store (%s); falling back to the cache", e)
+        return
+    _cleanup_task = asyncio.create_task(_cleanup_loop())
+
+
+async def close_session_store() -> None:
+    global _pool, _cleanup_task
+    if _cleanup_task is not None:
+        _cleanup_task.cancel()
+        _cleanup_task = None
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.closeall)
+
+
+def is_shared() -> bool:
+    """True when a session saved by this worker can be read by every other worker."""
+    return _pool is not None or CACHE_BACKEND == "sqlite"
+
+
+async def save_session(session_id: str, data: dict) -> None:
+    record = {field: data.get(field) for field in SESSION_FIELDS}
+    await _sessions.aset(session_id, record)
+    if _pool is not None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=PUNCHOUT_SESSION_TTL)
+        await asyncio.to_thread(
+            _run,
+            _UPSERT,
+            (session_id, *(record[field] for field in SESSION_FIELDS), expires_at),
+        )
+
+
+async def get_session(session_id: str) -> dict | None:
+    record = await _sessions.aget(session_id)
+    if record is not None or _pool is None:
+        return record
+
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        return None
+    row = await asyncio.to_thread(
+        _run,
+        _SELECT,
+        (session_id,),
+        True,
+    )
+    if row is None:
+        return None
+    record = dict(zip(SESSION_FIELDS, row))
+    # A pending record is about to change on another worker; keep reading the database
+    if record["provisioning"] != PROVISIONING_PENDING:
+        await _sessions.aset(session_id, record)
+    return record
+
+
+def session_cache_stats() -> dict:
+    return _sessions.stats()
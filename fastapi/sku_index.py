@@ -0,0 +1,231 @@
+"""
+In-memory index of the storefront catalog for Level 2 deep links:
+SKU (or variant id) → variant id, product id and product handle.
+
+The index is loaded with a paginated bulk scan of the Medusa store API when
+the app starts (in the background; until it is ready, lookups report
+"unknown" and setup keeps the raw SupplierPartID as before) and reloaded
+every SKU_INDEX_REFRESH_INTERVAL seconds.
+
+Medusa's product subscriber calls the invalidation endpoint with the ids of
+changed products, which are re-fetched and patched in place. Every worker
+holds its own index: the worker receiving the call also writes a new stamp
+to the shared cache (CACHE_BACKEND=sqlite), and the other workers reload
+when they notice it, within SKU_INDEX_SYNC_INTERVAL seconds.
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Iterable, NamedTuple
+
+from cache import make_cache
+from logs import get_logger
+from medusa_client import get_medusa_client
+
+# ── Configuration (set via Docker Compose env vars) ──────────────────────────
+SKU_INDEX_ENABLED = os.getenv("SKU_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+SKU_INDEX_PAGE_SIZE = int(os.getenv("SKU_INDEX_PAGE_SIZE", "200"))
+SKU_INDEX_CONCURRENCY = int(os.getenv("SKU_INDEX_CONCURRENCY", "4"))
+SKU_INDEX_REFRESH_INTERVAL = float(os.getenv("SKU_INDEX_REFRESH_INTERVAL", "3600"))
+SKU_INDEX_SYNC_INTERVAL = float(os.getenv("SKU_INDEX_SYNC_INTERVAL", "30"))
+
+INDEX_FIELDS = "id,handle,variants.id,variants.sku"
+# Product ids per targeted re-fetch request
+_REFETCH_BATCH = 100
+
+
+class SkuEntry(NamedTuple):
+    variant_id: str
+    product_id: str
+    handle: str
+
+
+class SkuIndex:
+    """Two dicts (by SKU, by variant id) of shared SkuEntry tuples."""
+
+    def __init__(self):
+        self._by_sku: dict[str, SkuEntry] = {}
+        self._by_variant: dict[str, SkuEntry] = {}
+        self.ready = False
+        self.loaded_at: float | None = None
+        # Patches made while a full reload is scanning; replayed onto its result
+        self._journal: list[tuple[set[str], list[dict]]] | None = None
+
+    def __len__(self) -> int:
+        return len(self._by_variant)
+
+    def lookup(self, key: str) -> SkuEntry | None:
+        return self._by_sku.get(key) or self._by_variant.get(key)
+
+    @staticmethod
+    def _entries(product: dict) -> Iterable[tuple[str | None, SkuEntry]]:
+        handle = product.get("handle")
+        if not handle:
+            return
+        for variant in product.get("variants") or []:
+            if variant.get("id"):
+                yield variant.get("sku"), SkuEntry(variant["id"], product["id"], handle)
+
+    def begin_load(self) -> None:
+        """Marks the start of a full scan: patches from now on are kept for `load()`."""
+        self._journal = []
+
+    def abort_load(self) -> None:
+        self._journal = None
+
+    def load(self, products: Iterable[dict]) -> None:
+        """
+        Replaces the whole index (built aside, then swapped in). Patches made
+        since `begin_load()` are applied again on top, since the scan may have
+        read those products before they changed.
+        """
+        by_sku, by_variant = {}, {}
+        for product in products:
+            for sku, entry in self._entries(product):
+                by_variant[entry.variant_id] = entry
+                if sku:
+                    by_sku[sku] = entry
+        for product_ids, patched in self._journal or ():
+            self._replace(by_sku, by_variant, product_ids, patched)
+        self._journal = None
+        self._by_sku, self._by_variant = by_sku, by_variant
+        self.ready = True
+        self.loaded_at = time.time()
+
+    def product_ids_for_variants(self, variant_ids: Iterable[str]) -> set[str]:
+        return {entry.product_id for vid in variant_ids if (entry := self._by_variant.get(vid)) is not None}
+
+    def replace_products(self, product_ids: Iterable[str], products: Iterable[dict]) -> None:
+        """Drops every entry of `product_ids`, then adds `products` (missing ones stay deleted)."""
+        product_ids, products = set(product_ids), list(products)
+        self._replace(self._by_sku, self._by_variant, product_ids, products)
+        if self._journal is not None:
+            self._journal.append((product_ids, products))
+
+    def _replace(self, by_sku: dict, by_variant: dict, product_ids: set[str], products: list[dict]) -> None:
+        for sku, entry in list(by_sku.items()):
+            if entry.product_id in product_ids:
+                del by_sku[sku]
+        for variant_id, entry in list(by_variant.items()):
+            if entry.product_id in product_ids:
+                del by_variant[variant_id]
+        for product in products:
+            for sku, entry in self._entries(product):
+                by_variant[entry.variant_id] = entry
+                if sku:
+                    by_sku[sku] = entry
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "variants": len(self._by_variant),
+            "skus": len(self._by_sku),
+            "loaded_at": self.loaded_at,
+        }
+
+
+_index = SkuIndex()
+_events = make_cache("sku_index_events", maxsize=16, default_ttl=7 * 24 * 60 * 60)
+_seen_stamp: str | None = None
+_loop_task: asyncio.Task | None = None
+_load_lock = asyncio.Lock()
+
+logger = get_logger(__name__)
+
+
+async def _scan(filters: dict) -> list[dict]:
+    from generate_catalog import iter_catalog_pages
+
+    products = []
+    async for page in iter_catalog_pages(
+        SKU_INDEX_PAGE_SIZE, SKU_INDEX_CONCURRENCY, retries=2,
+        filters={"fields": INDEX_FIELDS, **filters}, client=get_medusa_client(),
+    ):
+        products.extend(page.get("products", []))
+    return products
+
+
+async def reload_sku_index() -> None:
+    """Full paginated reload of the index."""
+    global _seen_stamp
+    async with _load_lock:
+        stamp = await _events.aget("stamp")
+        started = time.monotonic()
+        _index.begin_load()
+        try:
+            products = await _scan({})
+        except BaseException:
+            _index.abort_load()
+            raise
+        _index.load(products)
+        _seen_stamp = stamp
+    logger.info(
+        "SKU index loaded",
+        extra={"variants": len(_index), "seconds": round(time.monotonic() - started, 3)},
+    )
+
+
+async def invalidate_products(product_ids: Iterable[str] = (), variant_ids: Iterable[str] = ()) -> int:
+    """
+    Re-fetches the given products (variant ids are mapped to their products)
+    and patches them into the index; with no ids at all, reloads everything.
+    Tells the other workers through the shared cache. Returns the number of
+    products re-fetched (0 for a full reload).
+    """
+    global _seen_stamp
+    product_ids = set(product_ids) | _index.product_ids_for_variants(variant_ids)
+    if not product_ids and not variant_ids:
+        await reload_sku_index()
+        refreshed = 0
+    else:
+        ids = sorted(product_ids)
+        for start in range(0, len(ids), _REFETCH_BATCH):
+            batch = ids[start:start + _REFETCH_BATCH]
+            _index.replace_products(batch, await _scan({"id[]": batch}))
+        refreshed = len(ids)
+    _seen_stamp = uuid.uuid4().hex
+    await _events.aset("stamp", _seen_stamp)
+    return refreshed
+
+
+async def _maintenance_loop() -> None:
+    next_full_reload = 0.0
+    while True:
+        try:
+            if time.monotonic() >= next_full_reload:
+                await reload_sku_index()
+                next_full_reload = time.monotonic() + SKU_INDEX_REFRESH_INTERVAL
+            elif await _events.aget("stamp") != _seen_stamp:
+                await reload_sku_index()
+        except Exception:
+            logger.exception("SKU index refresh failed")
+            next_full_reload = time.monotonic() + SKU_INDEX_SYNC_INTERVAL
+        await asyncio.sleep(SKU_INDEX_SYNC_INTERVAL)
+
+
+def start_sku_index() -> None:
+    """Starts warming and maintaining the index in the background. Called from the app lifespan."""
+    global _loop_task
+    if SKU_INDEX_ENABLED and _loop_task is None:
+        _loop_task = asyncio.create_task(_maintenance_loop())
+
+
+async def stop_sku_index() -> None:
+    global _loop_task
+    if _loop_task is not None:
+        _loop_task.cancel()
+        _loop_task = None
+
+
+def sku_index_ready() -> bool:
+    return _index.ready
+
+
+def resolve_sku(key: str) -> SkuEntry | None:
+    """O(1) lookup by SKU or variant id; None if unknown (or the index is not loaded)."""
+    return _index.lookup(key)
+
+
+def sku_index_stats() -> dict:
+    return {"pid": os.getpid(), **_index.stats()}
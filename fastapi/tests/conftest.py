@@ -0,0 +1,17 @@
+"""
+Unit tests for the middleware modules. Run from fastapi/:
+
+    python -m pytest tests
+
+The modules read their configuration from the environment at import time,
+so the background jobs are switched off here before any of them is loaded.
+"""
+import os
+import sys
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+os.environ.setdefault("SKU_INDEX_ENABLED", "false")
+os.environ.setdefault("CATALOG_REFRESH_INTERVAL", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
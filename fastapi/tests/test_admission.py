@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import FairScheduler, Overloaded, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+# ── TokenBucket ───────────────────────────────────────────────────────────────
+
+def test_bucket_allows_a_burst_then_asks_to_wait(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+    for _ in range(3):
+        bucket.try_acquire()
+    clock.now += 0.25
+    assert bucket.try_acquire() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.try_acquire() == 0.0
+
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() > 0
+
+
+# ── FairScheduler ─────────────────────────────────────────────────────────────
+
+async def _hold(scheduler: FairScheduler, tenant: str, order: list, release: asyncio.Event, timeout: float = 5):
+    await scheduler.acquire(tenant, timeout)
+    order.append(tenant)
+    await release.wait()
+    scheduler.release()
+
+
+def test_scheduler_wakes_tenants_round_robin():
+    async def main():
+        scheduler = FairScheduler(limit=1, tenant_queue=10)
+        await scheduler.acquire("holder", 1)
+        order, release = [], asyncio.Event()
+        release.set()
+        tasks = [asyncio.create_task(_hold(scheduler, "a", order, release)) for _ in range(3)]
+        tasks += [asyncio.create_task(_hold(scheduler, "b", order, release)) for _ in range(2)]
+        tasks.append(asyncio.create_task(_hold(scheduler, "c", order, release)))
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 6
+
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c", "a", "b", "a"]
+        assert scheduler.in_flight == 0 and scheduler.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_scheduler_grants_free_slots_immediately():
+    async def main():
+        scheduler = FairScheduler(limit=2, tenant_queue=1)
+        await scheduler.acquire("a", 0)
+        await scheduler.acquire("a", 0)
+        assert scheduler.in_flight == 2
+        with pytest.raises(Overloaded):
+            await scheduler.acquire("a", 0)
+
+    asyncio.run(main())
+
+
+def test_scheduler_rejects_a_full_tenant_queue_only_for_that_tenant():
+    async def main():
+        scheduler = FairScheduler(limit=1, tenant_queue=1)
+        await scheduler.acquire("holder", 1)
+        order, release = [], asyncio.Event()
+        queued = asyncio.create_task(_hold(scheduler, "a", order, release))
+        other = asyncio.create_task(_hold(scheduler, "b", order, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded):
+            await scheduler.acquire("a", 1)
+
+        release.set()
+        scheduler.release()
+        await asyncio.gather(queued, other)
+        assert order == ["a", "b"]
+
+    asyncio.run(main())
+
+
+def test_scheduler_timeout_leaves_the_queue_clean():
+    async def main():
+        scheduler = FairScheduler(limit=1, tenant_queue=10)
+        await scheduler.acquire("holder", 1)
+        with pytest.raises(Overloaded):
+            await scheduler.acquire("a", 0.01)
+        assert scheduler.waiting == 0 and not scheduler._queues
+
+        scheduler.release()
+        assert scheduler.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_scheduler_cancelled_waiter_does_not_take_a_slot():
+    async def main():
+        scheduler = FairScheduler(limit=1, tenant_queue=10)
+        await scheduler.acquire("holder", 1)
+        order, release = [], asyncio.Event()
+        release.set()
+        cancelled = asyncio.create_task(_hold(scheduler, "a", order, release))
+        waiting = asyncio.create_task(_hold(scheduler, "b", order, release))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        scheduler.release()
+        await waiting
+        assert order == ["b"]
+        assert scheduler.in_flight == 0 and scheduler.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_medusa_slot_queues_under_the_given_tenant(monkeypatch):
+    async def main():
+        scheduler = FairScheduler(limit=1, tenant_queue=10)
+        monkeypatch.setattr(admission, "_scheduler", scheduler)
+        monkeypatch.setattr(admission, "MEDUSA_MAX_IN_FLIGHT", 1)
+        await scheduler.acquire("holder", 1)
+
+        async def system_call():
+            async with admission.medusa_slot(tenant=admission.SYSTEM_TENANT):
+                pass
+
+        admission.bind_tenant("acme")
+        task = asyncio.create_task(system_call())
+        await asyncio.sleep(0)
+        assert list(scheduler._queues) == [admission.SYSTEM_TENANT]
+
+        scheduler.release()
+        await task
+        assert scheduler.in_flight == 0
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from cache import SingleFlight, SQLiteCache, TTLCache
+
+
+# ── SingleFlight ──────────────────────────────────────────────────────────────
+
+def test_single_flight_shares_one_call_per_key():
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"value-{key}"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            *(flight.do("a", lambda: fetch("a")) for _ in range(5)),
+            flight.do("b", lambda: fetch("b")),
+        )
+        assert results == ["value-a"] * 5 + ["value-b"]
+        assert not flight.in_flight("a")
+
+    asyncio.run(main())
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_single_flight_shares_the_exception_then_forgets_it():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(flight.do("a", failing), flight.do("a", failing), return_exceptions=True)
+        assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+        assert len(calls) == 1
+
+        with pytest.raises(RuntimeError):
+            await flight.do("a", failing)
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_single_flight_survives_a_cancelled_waiter():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("a", fetch))
+        second = asyncio.create_task(flight.do("a", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "value"
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+# ── TTLCache / SQLiteCache ────────────────────────────────────────────────────
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return TTLCache(maxsize=100, default_ttl=60)
+    return SQLiteCache("test", maxsize=100, default_ttl=60, path=str(tmp_path / "cache.sqlite3"))
+
+
+def test_batch_api_matches_single_calls(cache):
+    cache.set_many({"a": {"n": 1}, "b": [2], "c": "three"})
+    cache.set("d", 4)
+    assert cache.get_many(["a", "b", "d", "missing"]) == {"a": {"n": 1}, "b": [2], "d": 4}
+    assert cache.get("c") == "three"
+    assert cache.get_many([]) == {}
+
+
+def test_batch_writes_with_non_positive_ttl_delete(cache):
+    cache.set_many({"a": 1, "b": 2})
+    cache.set_many({"a": 1}, ttl=0)
+    assert cache.get_many(["a", "b"]) == {"b": 2}
+
+
+def test_async_api(cache):
+    async def main():
+        await cache.aset_many({"a": 1, "b": 2})
+        await cache.aset("c", 3)
+        assert await cache.aget_many(["a", "b", "c"]) == {"a": 1, "b": 2, "c": 3}
+        await cache.adelete("a")
+        assert await cache.aget("a") is None
+
+    asyncio.run(main())
+
+
+def test_sqlite_get_many_spans_several_statements(tmp_path):
+    cache = SQLiteCache("test", maxsize=5000, default_ttl=60, path=str(tmp_path / "cache.sqlite3"))
+    items = {f"k{i}": i for i in range(SQLiteCache._BATCH * 2 + 7)}
+    cache.set_many(items)
+    assert cache.get_many(items) == items
+    assert cache.stats()["hits"] == len(items)
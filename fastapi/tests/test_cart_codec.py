@@ -0,0 +1,114 @@
+import dataclasses
+import json
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+import cart_codec
+from cart_codec import CartJSONResponse, PunchoutCartReturn, decode_cart_return
+
+GOOD = {
+    "session_id": "s",
+    "buyer_cookie": "c",
+    "browser_form_post_url": "http://b",
+    "currency": "usd",
+    "items": [{"id": "a", "title": "t", "quantity": 1, "unit_price": 1, "currency_code": "usd"}],
+}
+
+
+def _body(**fields) -> str:
+    return json.dumps({**GOOD, **fields})
+
+
+def _item(**fields) -> str:
+    return _body(items=[{**GOOD["items"][0], **fields}])
+
+
+# name → (body, content type)
+CASES = {
+    "good": (_body(), "application/json"),
+    "float-price": (_item(unit_price=12.5), "application/json"),
+    "quantity-as-string": (_item(quantity="3"), "application/json"),
+    "quantity-as-float": (_item(quantity=3.0), "application/json"),
+    "fractional-quantity": (_item(quantity=3.5), "application/json"),
+    "quantity-as-bool": (_item(quantity=True), "application/json"),
+    "huge-quantity": (_item(quantity=10 ** 30), "application/json"),
+    "price-as-string": (_item(unit_price="1.5"), "application/json"),
+    "invalid-price": (_item(unit_price="x"), "application/json"),
+    "int-id": (_item(id=5), "application/json"),
+    "null-description": (_item(description=None), "application/json"),
+    "missing-fields": (json.dumps({"session_id": "s"}), "application/json"),
+    "items-not-a-list": (_body(items={}), "application/json"),
+    "item-not-an-object": (_body(items=[1]), "application/json"),
+    "null-cookie": (_body(buyer_cookie=None), "application/json"),
+    "extra-field": (_body(extra=1), "application/json"),
+    "truncated-json": ('{"session_id": ', "application/json"),
+    "invalid-utf8": (b'{"session_id": "\xff"}', "application/json"),
+    "empty-body": ("", "application/json"),
+    "array": ("[]", "application/json"),
+    "no-content-type": (_body(), None),
+    "json-suffix-content-type": (_body(), "application/vnd.cart+json"),
+    "text-content-type": (_body(), "text/plain"),
+}
+
+# What FastAPI does with a `payload: PunchoutCartReturn` body parameter
+reference_app = FastAPI()
+
+
+@reference_app.post("/order")
+def reference_order(payload: PunchoutCartReturn):
+    return payload.model_dump()
+
+
+codec_app = FastAPI()
+
+
+@codec_app.post("/order")
+async def codec_order(request: Request):
+    record = decode_cart_return(await request.body(), request.headers.get("content-type"))
+    return dataclasses.asdict(record)
+
+
+@pytest.fixture(params=sorted(cart_codec.BACKENDS))
+def backend(request, monkeypatch):
+    try:
+        monkeypatch.setattr(cart_codec, "_backend", cart_codec.make_backend(request.param))
+    except ImportError:
+        pytest.skip(f"{request.param} is not installed")
+    return request.param
+
+
+def _post(client: TestClient, body, content_type: str | None):
+    headers = {"Content-Type": content_type} if content_type else {}
+    response = client.post("/order", content=body, headers=headers)
+    return response.status_code, response.json()
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_decoding_matches_a_fastapi_body_parameter(backend, case):
+    body, content_type = CASES[case]
+    expected = _post(TestClient(reference_app), body, content_type)
+    assert _post(TestClient(codec_app), body, content_type) == expected
+
+
+def test_fast_backends_accept_strict_bodies_without_pydantic(backend, monkeypatch):
+    if backend == "pydantic":
+        pytest.skip("no fast path")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("fell back to Pydantic")
+
+    monkeypatch.setattr(cart_codec, "_decode_like_fastapi", fail)
+    record = decode_cart_return(CASES["float-price"][0].encode(), "application/json")
+    assert record.items[0].unit_price == 12.5
+    assert record.buyer_cookie == "c"
+
+
+@pytest.mark.parametrize("content", [
+    {"status": "success", "redirect_url": "https://b.example/ret?x=1&y=ü", "cxml_base64": "<cXML/>"},
+    {"results": [{"index": 0, "status_code": 422, "detail": [{"loc": ["body", 0], "msg": "x"}]}], "count": 1},
+])
+def test_response_encoding_matches_json_response(backend, content):
+    assert json.loads(CartJSONResponse(content).body) == json.loads(JSONResponse(content).body)
@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from catalog_artifact import ArtifactInfo, RangeNotSatisfiable, byte_range
+
+INFO = ArtifactInfo("/tmp/index_catalog.csv.gz", 1000, '"abc"', datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=999-999", (999, 999)),
+])
+def test_satisfiable_ranges(value, expected):
+    assert byte_range({"range": value}, INFO) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "bytes=500-100",  # last before first: invalid, so ignored
+    "bytes=-",
+    "bytes=abc-",
+    "bytes=--5",
+    "bytes=0-99,200-299",
+    "items=0-99",
+])
+def test_malformed_or_unsupported_ranges_send_the_whole_artifact(value):
+    assert byte_range({"range": value}, INFO) is None
+
+
+@pytest.mark.parametrize("value", ["bytes=1000-", "bytes=1000-2000", "bytes=-0"])
+def test_ranges_past_the_end_are_not_satisfiable(value):
+    with pytest.raises(RangeNotSatisfiable):
+        byte_range({"range": value}, INFO)
+
+
+def test_stale_if_range_sends_the_whole_artifact():
+    assert byte_range({"range": "bytes=0-99", "if-range": '"old"'}, INFO) is None
+    assert byte_range({"range": "bytes=0-99", "if-range": '"abc"'}, INFO) == (0, 99)
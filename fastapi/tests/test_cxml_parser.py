@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from cxml_parser import CXMLParseError, CXMLTooLargeError, DefusedXMLBackend, LxmlBackend
+
+SETUP_REQUEST = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.038/cXML.dtd">
+<cXML payloadID="1@test" timestamp="2026-02-24T00:00:00Z">
+    <Header>
+        <From><Credential domain="NetworkId"><Identity>AcmeCorp</Identity></Credential></From>
+        <To><Credential domain="NetworkId"><Identity>Supplier</Identity></Credential></To>
+    </Header>
+    <Request>
+        <PunchOutSetupRequest operation="create">
+            <BuyerCookie>cookie-1</BuyerCookie>
+            <BrowserFormPost><URL>https://procurement.example.com/return</URL></BrowserFormPost>
+            <SelectedItem><ItemID><SupplierPartID>SKU-12345</SupplierPartID></ItemID></SelectedItem>
+        </PunchOutSetupRequest>
+    </Request>
+</cXML>"""
+
+XXE = b"""<?xml version="1.0"?>
+<!DOCTYPE cXML [<!ENTITY x SYSTEM "file:///etc/passwd">]>
+<cXML><Header/><Request><PunchOutSetupRequest><BuyerCookie>&x;</BuyerCookie></PunchOutSetupRequest></Request></cXML>"""
+
+ENTITY_EXPANSION = b"""<?xml version="1.0"?>
+<!DOCTYPE cXML [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;">]>
+<cXML><Header/><Request><PunchOutSetupRequest><BuyerCookie>&b;</BuyerCookie></PunchOutSetupRequest></Request></cXML>"""
+
+
+def _lxml_backend():
+    pytest.importorskip("lxml")
+    return LxmlBackend()
+
+
+BACKENDS = {
+    # Whole-document parse (the default for bodies under CXML_STREAM_THRESHOLD)
+    "defusedxml": lambda: DefusedXMLBackend(stream_threshold=0),
+    # Incremental parse from the first byte
+    "defusedxml-stream": lambda: DefusedXMLBackend(stream_threshold=1),
+    "lxml": _lxml_backend,
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request):
+    return BACKENDS[request.param]()
+
+
+def parse(backend, data: bytes, max_bytes: int = 10 ** 6, max_depth: int = 32, chunk_size: int = 64):
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    return backend.parse_setup_request_bytes(chunks, max_bytes, max_depth)
+
+
+def test_extracts_the_setup_fields(backend):
+    fields = parse(backend, SETUP_REQUEST)
+    assert fields.from_identity == "AcmeCorp"
+    assert fields.buyer_cookie == "cookie-1"
+    assert fields.browser_form_post_url == "https://procurement.example.com/return"
+    assert fields.supplier_part_id == "SKU-12345"
+    assert fields.operation == "create"
+
+
+def test_async_parse_matches_the_sync_one(backend):
+    async def chunks():
+        for i in range(0, len(SETUP_REQUEST), 100):
+            yield SETUP_REQUEST[i:i + 100]
+
+    fields = asyncio.run(backend.parse_setup_request(chunks(), 10 ** 6, 32))
+    assert repr(fields) == repr(parse(backend, SETUP_REQUEST))
+
+
+@pytest.mark.parametrize("document", [XXE, ENTITY_EXPANSION], ids=["external-entity", "entity-expansion"])
+def test_rejects_entity_declarations(backend, document):
+    with pytest.raises(CXMLParseError):
+        parse(backend, document)
+
+
+def test_rejects_oversized_bodies(backend):
+    with pytest.raises(CXMLTooLargeError):
+        parse(backend, SETUP_REQUEST, max_bytes=len(SETUP_REQUEST) - 1)
+
+
+def test_enforces_the_depth_limit(backend):
+    def nested(levels: int) -> bytes:
+        return (
+            b"<cXML>" + b"<a>" * levels + b"</a>" * levels
+            + b"<Header/><Request><PunchOutSetupRequest/></Request></cXML>"
+        )
+
+    parse(backend, nested(31))
+    with pytest.raises(CXMLParseError):
+        parse(backend, nested(32))
+
+
+def test_rejects_trailing_content(backend):
+    for trailer in (b"<junk/>", b"garbage"):
+        with pytest.raises(CXMLParseError):
+            parse(backend, SETUP_REQUEST + trailer)
+
+
+def test_first_buyer_cookie_wins(backend):
+    document = SETUP_REQUEST.replace(
+        b"<BuyerCookie>cookie-1</BuyerCookie>",
+        b"<BuyerCookie>first</BuyerCookie><BuyerCookie>second</BuyerCookie>",
+    )
+    assert parse(backend, document).buyer_cookie == "first"
+
+
+@pytest.mark.parametrize("document", [
+    b"<cXML><Request><PunchOutSetupRequest/></Request></cXML>",
+    b"<cXML><Header/><Request/></cXML>",
+    b"",
+], ids=["no-header", "no-setup-request", "empty"])
+def test_rejects_incomplete_requests(backend, document):
+    with pytest.raises(CXMLParseError):
+        parse(backend, document)
+
+
+def test_optional_selected_item(backend):
+    document = SETUP_REQUEST.replace(
+        b"<SelectedItem><ItemID><SupplierPartID>SKU-12345</SupplierPartID></ItemID></SelectedItem>", b""
+    )
+    assert parse(backend, document).supplier_part_id is None
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import enrichment
+import metrics
+from cache import TTLCache
+from medusa_client import close_medusa_client, open_medusa_client
+from sku_index import SkuEntry
+
+PRODUCTS = {
+    "prod_1": {
+        "id": "prod_1",
+        "metadata": {"unspsc": "44121600"},
+        "variants": [{"id": "variant_1", "sku": "SKU-1", "metadata": {"uom": "BX"}}],
+    },
+}
+UNINDEXED = [
+    {"id": "variant_2", "sku": "SKU-2", "metadata": {"unspsc": "43211500"}, "product": {"id": "prod_2", "metadata": {}}},
+    {"id": "variant_3", "sku": None, "metadata": {}, "product": {"id": "prod_3", "metadata": {"uom": "PK"}}},
+]
+INDEX = {"SKU-1": SkuEntry("variant_1", "prod_1", "product-1")}
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(enrichment, "_details", TTLCache())
+    monkeypatch.setattr(enrichment, "_unindexed", TTLCache())
+    monkeypatch.setattr(enrichment, "resolve_sku", INDEX.get)
+    monkeypatch.setattr(metrics.ENRICHMENT_LINES, "_series", {})
+
+
+def enrich(line_ids, calls):
+    def handler(request):
+        calls.append((request.url.path, request.url.params))
+        if request.url.path == "/store/products":
+            ids = request.url.params.get_list("id[]")
+            return httpx.Response(200, json={"products": [PRODUCTS[i] for i in ids if i in PRODUCTS]})
+        keys = set(request.url.params.get_list("sku[]")) | set(request.url.params.get_list("id[]"))
+        return httpx.Response(200, json={
+            "variants": [v for v in UNINDEXED if v["id"] in keys or v["sku"] in keys],
+        })
+
+    async def main():
+        await open_medusa_client(httpx.MockTransport(handler))
+        try:
+            return await enrichment.enrich_items([SimpleNamespace(id=line_id) for line_id in line_ids])
+        finally:
+            await close_medusa_client()
+
+    return asyncio.run(main())
+
+
+def lines(source: str) -> float:
+    return metrics.ENRICHMENT_LINES._series.get((source,), 0)
+
+
+def test_indexed_and_unindexed_lines_are_enriched():
+    calls = []
+    details = enrich(["SKU-1", "SKU-2", "variant_3", "SKU-404"], calls)
+
+    assert details["SKU-1"].unspsc == "44121600" and details["SKU-1"].unit_of_measure == "BX"
+    assert details["SKU-2"].unspsc == "43211500"
+    assert details["variant_3"].unit_of_measure == "PK"
+    assert "SKU-404" not in details
+    assert sorted(path for path, _ in calls) == ["/store/products", "/store/punchout/variants"]
+    fallback_params = dict(calls)["/store/punchout/variants"]
+    assert fallback_params.get_list("sku[]") == ["SKU-2", "SKU-404", "variant_3"]
+    assert fallback_params.get_list("id[]") == ["variant_3"]
+    assert (lines("fetched"), lines("fallback"), lines("unresolved")) == (1, 2, 1)
+
+
+def test_fallback_results_are_cached_per_line():
+    enrich(["SKU-2"], [])
+    calls = []
+    details = enrich(["SKU-2"], calls)
+    assert details["SKU-2"].unspsc == "43211500"
+    assert calls == []
+
+
+def test_fallback_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(enrichment, "ENRICHMENT_FALLBACK", False)
+    calls = []
+    details = enrich(["SKU-1", "SKU-2"], calls)
+    assert list(details) == ["SKU-1"]
+    assert [path for path, _ in calls] == ["/store/products"]
+    assert lines("unresolved") == 1
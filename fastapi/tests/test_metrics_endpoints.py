@@ -0,0 +1,34 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def test_metrics_are_rendered_on_the_event_loop(monkeypatch):
+    # Metrics are not thread-safe: a threadpool render could race the handlers
+    rendered_on_loop = []
+
+    def spy(caches=None):
+        rendered_on_loop.append(_on_event_loop())
+        return metrics.render_metrics(caches)
+
+    monkeypatch.setattr(main, "render_metrics", spy)
+    response = TestClient(main.app).get("/metrics")
+    assert response.status_code == 200
+    assert rendered_on_loop == [True]
+
+
+def test_cache_stats_endpoint():
+    response = TestClient(main.app).get("/api/punchout/cache/stats")
+    assert response.status_code == 200
+    assert set(response.json()) >= {"pid", "medusa_tokens", "punchout_sessions", "sku_index", "variant_details"}
@@ -0,0 +1,253 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+import resilience
+from medusa_client import close_medusa_client, open_medusa_client
+from resilience import BudgetExceeded, CircuitBreaker, CircuitOpenError, MedusaUnavailable, latency_budget, medusa_request
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "MEDUSA_RETRIES", 2)
+    monkeypatch.setattr(resilience, "MEDUSA_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(resilience, "MEDUSA_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(admission, "_scheduler", admission.FairScheduler(10, 10))
+    monkeypatch.setattr(admission, "MEDUSA_MAX_IN_FLIGHT", 10)
+
+
+def run_with_medusa(handler, fn):
+    """Runs `fn()` with the worker-wide client answering through `handler`."""
+    async def main():
+        await open_medusa_client(httpx.MockTransport(handler))
+        try:
+            return await fn()
+        finally:
+            await close_medusa_client()
+
+    return asyncio.run(main())
+
+
+# ── CircuitBreaker ────────────────────────────────────────────────────────────
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("/a", failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.failures == 0
+
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("/a", failure_threshold=1, reset_timeout=10)
+    breaker.before_call()
+    breaker.record_failure()
+
+    clock[0] += 10
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("/a", failure_threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock[0] += 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_released_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker("/a", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+# ── medusa_request ────────────────────────────────────────────────────────────
+
+def test_idempotent_call_is_retried_on_503():
+    statuses = iter([503, 503, 200])
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(next(statuses))
+
+    response = run_with_medusa(handler, lambda: medusa_request("GET", "/store/x", idempotent=True))
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert resilience.breaker_for("/store/x").failures == 0
+
+
+def test_non_idempotent_call_is_not_retried_once_sent():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(503)
+
+    response = run_with_medusa(handler, lambda: medusa_request("POST", "/store/x"))
+    assert response.status_code == 503
+    assert len(calls) == 1
+    assert resilience.breaker_for("/store/x").failures == 1
+
+
+def test_transport_errors_surface_as_medusa_unavailable():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        raise httpx.ReadError("connection reset")
+
+    with pytest.raises(MedusaUnavailable):
+        run_with_medusa(handler, lambda: medusa_request("GET", "/store/x", idempotent=True))
+    assert len(calls) == resilience.MEDUSA_RETRIES + 1
+
+
+def test_open_breaker_rejects_without_calling_medusa(monkeypatch):
+    monkeypatch.setattr(resilience, "MEDUSA_RETRIES", 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(500)
+
+    breaker = resilience.breaker_for("/store/x")
+    breaker.failure_threshold = 2
+
+    async def main():
+        for _ in range(2):
+            await medusa_request("GET", "/store/x")
+        with pytest.raises(CircuitOpenError):
+            await medusa_request("GET", "/store/x")
+
+    run_with_medusa(handler, main)
+    assert len(calls) == 2
+
+
+def test_spent_budget_is_not_a_medusa_failure():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200)
+
+    async def main():
+        with latency_budget(0):
+            with pytest.raises(BudgetExceeded) as exc_info:
+                await medusa_request("GET", "/store/x", idempotent=True)
+        assert not exc_info.value.sent
+
+    run_with_medusa(handler, main)
+    assert calls == []
+    assert resilience.breaker_for("/store/x").failures == 0
+
+
+def test_budget_running_out_in_flight_counts_as_a_failure():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def main():
+        with latency_budget(0.05):
+            with pytest.raises(BudgetExceeded) as exc_info:
+                await medusa_request("GET", "/store/x", idempotent=True)
+        assert exc_info.value.sent
+
+    run_with_medusa(handler, main)
+    assert resilience.breaker_for("/store/x").failures == 1
+    assert admission._scheduler.in_flight == 0
+
+
+# ── Hedging ───────────────────────────────────────────────────────────────────
+
+def test_hedge_answers_first_and_the_slow_attempt_is_cancelled():
+    attempts = []
+    cancelled = []
+
+    async def handler(request):
+        attempt = len(attempts)
+        attempts.append(attempt)
+        if attempt == 0:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(attempt)
+                raise
+        return httpx.Response(200, json={"attempt": attempt})
+
+    async def main():
+        response = await medusa_request("GET", "/store/x", idempotent=True, hedge=True)
+        await asyncio.sleep(0)
+        return response
+
+    response = run_with_medusa(handler, main)
+    assert response.json() == {"attempt": 1}
+    assert cancelled == [0]
+    assert admission._scheduler.in_flight == 0
+
+
+def test_fast_answer_sends_no_hedge():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        return httpx.Response(200)
+
+    run_with_medusa(handler, lambda: medusa_request("GET", "/store/x", idempotent=True, hedge=True))
+    assert len(attempts) == 1
+
+
+def test_cancelled_caller_leaves_no_attempt_behind():
+    started = []
+
+    async def handler(request):
+        started.append(request.url.path)
+        await asyncio.sleep(5)
+        return httpx.Response(200)
+
+    async def main():
+        task = asyncio.create_task(medusa_request("GET", "/store/x", idempotent=True, hedge=True))
+        await asyncio.sleep(0.1)
+        assert len(started) == 2  # primary and hedge
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    run_with_medusa(handler, main)
+    assert admission._scheduler.in_flight == 0
+    breaker = resilience.breaker_for("/store/x")
+    assert breaker.failures == 0 and not breaker._probing
@@ -3,6 +3,40 @@ import jwt from "jsonwebtoken"
 
 const JWT_SECRET = process.env.JWT_SECRET || "supersecret"
 
+// Internal URL of the FastAPI middleware (container-to-container). Used to
+// redeem compact StartPage tokens that only carry a session reference.
+const PUNCHOUT_MIDDLEWARE_URL =
+    process.env.PUNCHOUT_MIDDLEWARE_URL || "http://fastapi:8000"
+
+// Seconds the middleware may hold the redemption while it is still creating
+// the buyer org's Medusa customer (asynchronous provisioning). Past that the
+// shopper browses anonymously rather than staring at a blank page.
+const PUNCHOUT_REDEEM_WAIT = Number(process.env.PUNCHOUT_REDEEM_WAIT || "8")
+
+type PunchoutSession = {
+    b2b_company_id: string
+    medusa_jwt?: string      // Real Medusa Bearer token (may be absent on errors)
+    session_id?: string
+    sku?: string
+    product_handle?: string  // Level 2 SKU resolved by the middleware's SKU index
+    variant_id?: string
+    browser_form_post_url?: string
+    provisioning?: "pending" | "ready" | "failed" | null
+}
+
+async function redeemSession(token: string): Promise<PunchoutSession> {
+    const res = await fetch(`${PUNCHOUT_MIDDLEWARE_URL}/api/punchout/session/redeem`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ token, wait: PUNCHOUT_REDEEM_WAIT }),
+        cache: "no-store",
+    })
+    if (!res.ok) {
+        throw new Error(`Session redemption failed with status ${res.status}`)
+    }
+    return res.json()
+}
+
 // ── Public-facing storefront URL ─────────────────────────────────────────────
 // NEXT_PUBLIC_BASE_URL is set to http://localhost:8002 in .env.local and
 // docker-compose. We MUST NOT use request.nextUrl.origin here because inside
@@ -24,29 +58,31 @@ export async function GET(request: NextRequest) {
     }
 
     try {
-        // 1. Verify the short-lived Punchout JWT signed by FastAPI
-        const decoded = jwt.verify(token, JWT_SECRET) as {
-            b2b_company_id: string
-            medusa_jwt?: string      // Real Medusa Bearer token (may be absent on errors)
-            session_id?: string
-            sku?: string
-            browser_form_post_url?: string
-        }
+        // 1. Verify the short-lived Punchout JWT signed by FastAPI.
+        //    Compact tokens only carry `sid`; the session itself is fetched
+        //    from the middleware's session store.
+        const verified = jwt.verify(token, JWT_SECRET) as PunchoutSession & { sid?: string }
+        const decoded = verified.sid ? await redeemSession(token) : verified
 
         const b2bCompanyId = decoded.b2b_company_id
         const medusaToken = decoded.medusa_jwt
         const sku = decoded.sku
+        const productHandle = decoded.product_handle
 
         console.log(`[Punchout] B2B session established. Company: ${b2bCompanyId}`)
 
         // 2. Determine redirect target — no country prefix, middleware handles it
         // The Next.js middleware.ts auto-prepends the correct country code (e.g. /cl/)
         let targetPath = "/store"
-        if (sku) {
-            console.log(`[Punchout] Deep Link Level 2 → routing to SKU ${sku}`)
-            targetPath = `/store` // Fallback to store; PDP needs a valid product handle
-            // For a proper PDP deep link, use: targetPath = `/es/products/${sku}`
-            // This requires the sku to be a valid Medusa product handle, not a variant ID.
+        if (productHandle) {
+            // Level 2: the middleware already resolved the SKU to its product page
+            console.log(`[Punchout] Deep Link Level 2 → routing SKU ${sku} to product ${productHandle}`)
+            targetPath = `/products/${encodeURIComponent(productHandle)}`
+            if (decoded.variant_id) {
+                targetPath += `?v_id=${encodeURIComponent(decoded.variant_id)}`
+            }
+        } else if (sku) {
+            console.log(`[Punchout] Deep Link Level 2 → SKU ${sku} not resolved, routing to store`)
         }
 
         const response = NextResponse.redirect(new URL(targetPath, baseUrl))
@@ -63,6 +99,8 @@ export async function GET(request: NextRequest) {
                 path: "/",
             })
             console.log(`[Punchout] _medusa_jwt cookie set for ${b2bCompanyId}`)
+        } else if (decoded.provisioning === "pending") {
+            console.warn(`[Punchout] Medusa session for ${b2bCompanyId} still provisioning — user will browse anonymously`)
         } else {
             console.warn(`[Punchout] No Medusa JWT in token — user will browse anonymously`)
         }
@@ -0,0 +1,44 @@
+import type { MedusaRequest, MedusaResponse } from "@medusajs/framework/http"
+import { ContainerRegistrationKeys } from "@medusajs/framework/utils"
+
+// Keys accepted per request (the middleware sends ENRICHMENT_BATCH_SIZE)
+const MAX_KEYS = 500
+
+function listParam(value: unknown): string[] {
+  if (value === undefined) {
+    return []
+  }
+  const values = Array.isArray(value) ? value : [value]
+  return values.filter((v): v is string => typeof v === "string" && v !== "")
+}
+
+/**
+ * Variants by SKU (`sku[]`) or id (`id[]`), with the metadata the punchout
+ * middleware enriches PunchOutOrderMessage lines from. The store product
+ * list cannot be filtered by variant, so this serves the cart lines the
+ * middleware's SKU index does not know (index disabled or still loading).
+ */
+export async function GET(req: MedusaRequest, res: MedusaResponse) {
+  const skus = listParam(req.query.sku)
+  const ids = listParam(req.query.id)
+  if (skus.length + ids.length > MAX_KEYS) {
+    res.status(400).json({ message: `At most ${MAX_KEYS} sku/id values per request` })
+    return
+  }
+  const or = [
+    ...(skus.length ? [{ sku: skus }] : []),
+    ...(ids.length ? [{ id: ids }] : []),
+  ]
+  if (!or.length) {
+    res.json({ variants: [] })
+    return
+  }
+
+  const query = req.scope.resolve(ContainerRegistrationKeys.QUERY)
+  const { data: variants } = await query.graph({
+    entity: "product_variant",
+    fields: ["id", "sku", "metadata", "product.id", "product.metadata"],
+    filters: { $or: or },
+  })
+  res.json({ variants })
+}
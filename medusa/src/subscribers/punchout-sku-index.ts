@@ -0,0 +1,67 @@
+import type { SubscriberArgs, SubscriberConfig } from "@medusajs/framework"
+
+// Internal URL of the FastAPI punchout middleware and the shared secret its
+// webhook endpoints expect. Without a secret the subscriber does nothing.
+const PUNCHOUT_MIDDLEWARE_URL =
+  process.env.PUNCHOUT_MIDDLEWARE_URL || "http://fastapi:8000"
+const PUNCHOUT_WEBHOOK_SECRET = process.env.PUNCHOUT_WEBHOOK_SECRET || ""
+
+/**
+ * Keeps the middleware's in-memory SKU index (Level 2 deep links) in sync:
+ * every product or variant change re-fetches the affected product there.
+ */
+export default async function punchoutSkuIndexHandler({
+  event: { name, data },
+  container,
+}: SubscriberArgs<{ id: string }>) {
+  if (!PUNCHOUT_WEBHOOK_SECRET) {
+    return
+  }
+
+  let body: { product_ids?: string[]; variant_ids?: string[] } = {
+    product_ids: [data.id],
+  }
+  if (name.startsWith("product-variant.")) {
+    // Send the parent product so new variants are picked up too; a deleted
+    // variant can't be retrieved any more, the middleware maps its id itself.
+    try {
+      const variant = await container
+        .resolve("product")
+        .retrieveProductVariant(data.id, { select: ["product_id"] })
+      body = { product_ids: [variant.product_id] }
+    } catch {
+      body = { variant_ids: [data.id] }
+    }
+  }
+
+  try {
+    const res = await fetch(
+      `${PUNCHOUT_MIDDLEWARE_URL}/api/punchout/sku-index/invalidate`,
+      {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "X-Punchout-Webhook-Secret": PUNCHOUT_WEBHOOK_SECRET,
+        },
+        body: JSON.stringify(body),
+      }
+    )
+    if (!res.ok) {
+      console.warn(`[Punchout] SKU index invalidation failed with status ${res.status}`)
+    }
+  } catch (error) {
+    // The middleware's periodic reload catches up if it was unreachable
+    console.warn("[Punchout] SKU index invalidation failed:", error)
+  }
+}
+
+export const config: SubscriberConfig = {
+  event: [
+    "product.created",
+    "product.updated",
+    "product.deleted",
+    "product-variant.created",
+    "product-variant.updated",
+    "product-variant.deleted",
+  ],
+}